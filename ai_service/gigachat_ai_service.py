@@ -4,22 +4,63 @@ import logging
 import os
 import asyncio
 import re
+import time
 import uuid
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any, List, Callable, Awaitable
 import httpx
 from bs4 import BeautifulSoup
 
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
-from gigachat.exceptions import ResponseError
+from gigachat.exceptions import RateLimitError, ResponseError
+from opentelemetry.trace import SpanKind
 
 from config import Config, config
-from utils.rate_limiter import get_global_limiter
-from utils.generation_queue import get_generation_queue, GenerationType
+from utils.admission import GenerationRejected
+from utils.metrics import record_token_usage
+from utils.circuit_breaker import UpstreamUnavailable, get_circuit_breaker
+from utils.gigachat_clients import credentials_key, get_gigachat_client_pool
+from utils.hedging import LatencyTracker, hedged
+from utils.model_router import get_model_router
+from utils.rate_limiter import get_key_limiter
+from utils.tracing import start_span
+from utils.credential_pool import get_credential_health, get_shared_credential_pool
+from utils.credential_router import FAILOVER_STATUSES, CredentialFailover, Route, log_failover, plan_routes
+from utils.generation_queue import (
+    get_generation_queue, credentials_load, credentials_wait, select_shared_credentials, remaining_budget,
+    GenerationCancelled, GenerationExpired, GenerationType,
+)
 
 
 logger = logging.getLogger(__name__)
 
+# Таймаут HTTP-запроса к GigaChat по умолчанию (как в библиотеке gigachat) и для генерации изображений
+CHAT_TIMEOUT = 30.0
+IMAGE_TIMEOUT = 40.0
+MIN_TIMEOUT = 0.1
+
+# Время ответа на запросы через _agenerate: по нему выбирается момент дублирования запроса
+_latency = LatencyTracker()
+
+DEFAULT_BASE_URL = "https://gigachat.devices.sberbank.ru/api/v1"
+
+def _once(callback: Optional[Callable[[], Awaitable[None]]]) -> Optional[Callable[[], Awaitable[None]]]:
+    """Колбэк начала обработки, который срабатывает один раз, даже если задача перешла на другой ключ"""
+    if callback is None:
+        return None
+    called = False
+
+    async def wrapper():
+        nonlocal called
+        if called:
+            return
+        called = True
+        await callback()
+
+    return wrapper
+
+
 async def _has_links(user_idea):
     """Функция для проверки наличия ссылок в идеи(тексте) пользователя"""
     return any(word in user_idea.lower() for word in ['http://', 'https://', 'www.', '.ru', '.com', 'ссылка'])
@@ -31,57 +72,211 @@ class GigaChatService:
     def __init__(self, config: Config):
         self.credentials = config.GIGACHAT_CREDENTIALS # Ключ по умолчанию
         self.verify_ssl_certs = False
+        self.base_url = config.GIGACHAT_BASE_URL or DEFAULT_BASE_URL
+        # Адреса API передаются клиенту, только если заданы (иначе — значения по умолчанию библиотеки)
+        self.client_options = {
+            key: value
+            for key, value in (("base_url", config.GIGACHAT_BASE_URL), ("auth_url", config.GIGACHAT_AUTH_URL))
+            if value
+        }
+        # Клиенты из пула общие для всех запросов ключа, поэтому таймаут у них наибольший,
+        # а таймаут отдельного запроса задаёт _call_timeout
+        self.pooled_client_options = {
+            "verify_ssl_certs": self.verify_ssl_certs,
+            "timeout": max(CHAT_TIMEOUT, IMAGE_TIMEOUT),
+            **self.client_options,
+        }
+
+    @staticmethod
+    def _timeout(default: float) -> float:
+        """Таймаут HTTP-запроса: не дольше, чем осталось до крайнего срока задачи очереди"""
+        budget = remaining_budget()
+        if budget is None:
+            return default
+        return max(MIN_TIMEOUT, min(default, budget))
+
+    @asynccontextmanager
+    async def _call_timeout(self, default: float):
+        """
+        Таймаут одного запроса к GigaChat через общий клиент из пула.
+        Истечение таймаута выглядит как таймаут httpx, поэтому очередь повторяет задачу как раньше.
+        """
+        timeout = self._timeout(default)
+        try:
+            async with asyncio.timeout(timeout):
+                yield
+        except TimeoutError as e:
+            raise httpx.ReadTimeout(f"Запрос к GigaChat не уложился в {timeout:.1f} сек.") from e
+
+    @asynccontextmanager
+    async def _upstream_call(self, credentials: str, endpoint: str, default_timeout: float,
+                             failover_route: Optional[Route] = None):
+        """
+        Запрос к методу GigaChat endpoint: под предохранителем ключа и с таймаутом _call_timeout.
+        Ответы 401, 402 и 429 учитываются в доступности ключа. Если задан failover_route (у задачи есть
+        запасной ключ), такой ответ становится CredentialFailover: очередь не повторяет задачу с тем же ключом.
+        """
+        try:
+            async with get_circuit_breaker(credentials, endpoint).guard():
+                async with self._call_timeout(default_timeout):
+                    yield
+        except ResponseError as e:
+            retry_after = e.retry_after if isinstance(e, RateLimitError) else None
+            get_credential_health().report_status(credentials, e.status_code, retry_after)
+            if failover_route is not None and e.status_code in FAILOVER_STATUSES:
+                raise CredentialFailover(failover_route, e.status_code) from e
+            raise
+
+    async def _run_routes(self, credentials: Optional[str], generation_type: GenerationType,
+                          endpoints: tuple[str, ...], run: Callable[[Route, bool], Awaitable[Any]]) -> Any:
+        """
+        Выполнить задачу с ключами из plan_routes: если ключ недоступен (разомкнут предохранитель,
+        исчерпана квота на ключе бота) или отклонён GigaChat (401, 402, 429), задача ставится в очередь следующего ключа.
+
+        :param run: Выполнение задачи с ключом маршрута; второй аргумент — есть ли запасной ключ
+        """
+        routes = await plan_routes(credentials, generation_type.value)
+        for index, route in enumerate(routes):
+            next_route = routes[index + 1] if index + 1 < len(routes) else None
+            try:
+                # Пока GigaChat недоступен, запрос отклоняется сразу, а не после ожидания в очереди
+                for endpoint in endpoints:
+                    get_circuit_breaker(route.credentials, endpoint).ensure_available()
+                return await run(route, next_route is not None)
+            except GenerationRejected as e:
+                if next_route is None:
+                    raise
+                reason = "circuit_open" if isinstance(e, UpstreamUnavailable) else "rejected"
+                log_failover(route, next_route, reason, generation_type.value)
+            except CredentialFailover as e:
+                log_failover(route, next_route, str(e.status_code), generation_type.value)
 
     async def _agenerate(self, prompt: str, system_prompt: str = "", temperature: float = 0.7, max_tokens: int = 512,
-                         credentials: str = None, on_start_callback: Optional[Callable[[], Awaitable[None]]] = None) -> tuple[str, int]:
-        """Внутренний метод для генерации ответа через GigaChat с использованием очереди"""
+                         credentials: str = None, on_start_callback: Optional[Callable[[], Awaitable[None]]] = None,
+                         generation_type: GenerationType = GenerationType.TEXT,
+                         operation: Optional[str] = None) -> tuple[str, int]:
+        """
+        Внутренний метод для генерации ответа через GigaChat с использованием очереди.
+        operation — имя операции в GIGACHAT_MODEL_ROUTES (по умолчанию — тип генерации).
+        """
         # Сохраняем значения параметров для использования в замыкании
         prompt_value = prompt
         system_prompt_value = system_prompt or "Ты — полезный ассистент."
         temperature_value = temperature
         max_tokens_value = max_tokens
-        used_credentials = credentials if credentials else self.credentials
-        
-        async def _generate_internal():
-            try:
-                # Получаем глобальный лимитер
-                limiter = get_global_limiter()
+        operation_value = operation or generation_type.value
+
+        def _request_with(credentials_value: str, failover_route: Optional[Route] = None, model: Optional[str] = None):
+            async def _generate_internal():
+                try:
+                    # Лимитер ключа: запросы с одним ключом идут по одному, с разными — параллельно
+                    limiter = get_key_limiter(credentials_key(credentials_value))
                 
-                # Используем лимитер для ограничения одновременных запросов
-                async with limiter:
-                    # Формируем сообщения
-                    messages = [
-                        Messages(role=MessagesRole.SYSTEM, content=system_prompt_value),
-                        Messages(role=MessagesRole.USER, content=prompt_value),
-                    ]
-
-                    chat = Chat(messages=messages, temperature=temperature_value, max_tokens=max_tokens_value)
-
-                    # Используем контекстный менеджер
-                    async with GigaChat(credentials=used_credentials, verify_ssl_certs=self.verify_ssl_certs) as giga:
-                        response = await giga.achat(payload=chat)
-
-                    if response.choices and len(response.choices) > 0:
-                        return response.choices[0].message.content.strip()
-                    return "Не удалось сгенерировать ответ."
-            except Exception as e:
-                logger.error(f"Ошибка при обращении к GigaChat: {e}", exc_info=True)
-                raise
-        
-        # Добавляем задачу в очередь
-        queue = get_generation_queue(used_credentials)
-        result, position = await queue.add_task(GenerationType.TEXT, _generate_internal, on_start_callback=on_start_callback)
+                    # Используем лимитер для ограничения одновременных запросов
+                    async with limiter:
+                        # Формируем сообщения
+                        messages = [
+                            Messages(role=MessagesRole.SYSTEM, content=system_prompt_value),
+                            Messages(role=MessagesRole.USER, content=prompt_value),
+                        ]
+
+                        chat = Chat(messages=messages, temperature=temperature_value, max_tokens=max_tokens_value,
+                                    model=model)
+
+                        # Клиент ключа берётся из пула: токен доступа и соединение переиспользуются
+                        # В span входит и получение токена доступа, если его нужно обновить
+                        giga = get_gigachat_client_pool().get(credentials_value, **self.pooled_client_options)
+                        with start_span("gigachat.chat", kind=SpanKind.CLIENT, generation_type=generation_type.value,
+                                        max_tokens=max_tokens_value, model=model) as span:
+                            started_at = time.monotonic()
+                            async with self._upstream_call(credentials_value, "chat", CHAT_TIMEOUT, failover_route):
+                                response = await giga.achat(payload=chat)
+                            get_model_router().observe(model, time.monotonic() - started_at)
+                            if response.usage:
+                                span.set_attribute("gigachat.total_tokens", response.usage.total_tokens)
+                        record_token_usage(response.usage, generation_type.value)
+
+                        if response.choices and len(response.choices) > 0:
+                            return response.choices[0].message.content.strip()
+                        return "Не удалось сгенерировать ответ."
+                except CredentialFailover:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка при обращении к GigaChat: {e}", exc_info=True)
+                    raise
+
+            return _generate_internal
+
+        async def _submit(credentials_value: str, on_start, failover_route: Optional[Route] = None):
+            # Модель выбирается по операции; если очередь ключа не даёт уложиться в бюджет — модель быстрее
+            model = get_model_router().choose(
+                operation_value, credentials_load(credentials_value), credentials_wait(credentials_value)
+            )
+            # Добавляем задачу в очередь
+            queue = get_generation_queue(credentials_value)
+            get_shared_credential_pool().mark_placed(credentials_value)
+            return await queue.add_task(generation_type, _request_with(credentials_value, failover_route, model),
+                                        on_start_callback=on_start)
+
+        # Сообщение о начале обработки показывается один раз, даже если задача перейдёт на другой ключ
+        on_start = _once(on_start_callback)
+
+        async def _run(route: Route, failover: bool):
+            failover_route = route if failover else None
+            hedge_delay = self._hedge_delay(generation_type, route.credentials)
+            if hedge_delay is None:
+                return await _submit(route.credentials, on_start, failover_route)
+
+            async def start_hedge():
+                alternate = await self._hedge_credentials(route.credentials)
+                if alternate is None:
+                    return None
+                logger.info("Запрос %s идёт дольше %.1f сек., запускаем дубль с другим ключом",
+                            generation_type.value, hedge_delay)
+                # Сообщение о начале обработки уже показывает основной запрос
+                return _submit(alternate, None)
+
+            response, _ = await hedged(
+                _submit(route.credentials, on_start, failover_route), start_hedge, hedge_delay, generation_type.value
+            )
+            return response
+
+        started_at = time.monotonic()
+        # Без ключа пользователя — наименее загруженный из ключей бота, при отказе ключа — запасной
+        result, position = await self._run_routes(credentials, generation_type, ("chat",), _run)
+        _latency.observe(generation_type.value, time.monotonic() - started_at)
         return result, position
 
+    def _hedge_delay(self, generation_type: GenerationType, credentials: str) -> Optional[float]:
+        """
+        Через сколько секунд дублировать запрос (наблюдённый p90 времени ответа) или None — не дублировать.
+        Дублируются только текстовые генерации; запросы со своим ключом пользователя — если GENERATION_HEDGE_USER_KEYS.
+        """
+        if not config.GENERATION_HEDGING or generation_type != GenerationType.TEXT:
+            return None
+        if credentials not in get_shared_credential_pool() and not config.GENERATION_HEDGE_USER_KEYS:
+            return None
+        return _latency.quantile(generation_type.value)
+
+    async def _hedge_credentials(self, credentials: str) -> Optional[str]:
+        """Другой ключ бота со свободной очередью и доступным GigaChat; None — дублировать некуда"""
+        alternate = select_shared_credentials(exclude=(credentials,))
+        if alternate is None or not get_shared_credential_pool().is_available(alternate):
+            return None
+        if await get_generation_queue(alternate).count_pending_tasks() == 0:
+            return alternate
+        return None
+
     async def validate_credentials(self, credentials: str) -> tuple[bool, str]:
         """Проверяет валидность API-ключа GigaChat"""
         try:
             # Пытаемся сделать простой запрос для проверки ключа
             test_prompt = "Привет, ответь одним словом: OK"
             messages = [Messages(role=MessagesRole.USER, content=test_prompt)]
-            chat = Chat(messages=messages, max_tokens=10)
+            chat = Chat(messages=messages, max_tokens=10, model=get_model_router().choose("validation"))
             
-            async with GigaChat(credentials=credentials, verify_ssl_certs=self.verify_ssl_certs) as giga:
+            async with GigaChat(credentials=credentials, verify_ssl_certs=self.verify_ssl_certs,
+                                **self.client_options) as giga:
                 response = await giga.achat(payload=chat)
             
             if response and response.choices:
@@ -102,9 +297,10 @@ class GigaChatService:
         try:
 
             messages = [Messages(role=MessagesRole.USER, content="Привет")]
-            chat = Chat(messages=messages, max_tokens=5)
+            chat = Chat(messages=messages, max_tokens=5, model=get_model_router().choose("validation"))
 
-            async with GigaChat(credentials=credentials, verify_ssl_certs=self.verify_ssl_certs) as giga:
+            async with GigaChat(credentials=credentials, verify_ssl_certs=self.verify_ssl_certs,
+                                **self.client_options) as giga:
                 response = await giga.achat(payload=chat)
 
             if response and response.usage:
@@ -172,7 +368,8 @@ class GigaChatService:
             "Если пользователь не указал ссылки — НЕ ВСТАВЛЯЙ ИХ НИ ПРИ КАКИХ ОБСТОЯТЕЛЬСТВАХ."
         )
 
-        result, position = await self._agenerate(prompt, system, temperature=0.7, credentials=user_api_key, on_start_callback=on_start_callback)
+        result, position = await self._agenerate(prompt, system, temperature=0.7, credentials=user_api_key, on_start_callback=on_start_callback,
+                                                 operation="free_text")
 
         return result.strip(), position
 
@@ -183,7 +380,7 @@ class GigaChatService:
         if not used_credentials:
             return False, "API-ключ не указан"
 
-        url = "https://gigachat.devices.sberbank.ru/api/v1/balance"
+        url = f"{self.base_url.rstrip('/')}/balance"
         headers = {
             "Authorization": f"Bearer {used_credentials}",
             "X-Request-ID": "req-" + asyncio.current_task().get_name()[-8:],
@@ -278,7 +475,8 @@ class GigaChatService:
             "Если в данных не было ссылок — НЕ ВСТАВЛЯЙ ИХ НИ ПРИ КАКИХ ОБСТОЯТЕЛЬСТВАХ."
         )
 
-        result, _ = await self._agenerate(prompt, system, temperature=0.7, credentials=user_api_key)
+        result, _ = await self._agenerate(prompt, system, temperature=0.7, credentials=user_api_key,
+                                          operation="structured_post")
         return result.strip()
 
     async def generate_text_from_examples(
@@ -334,7 +532,8 @@ class GigaChatService:
             "Если в примерах нет ссылок — ты их не вставляешь. Никаких исключений."
         )
 
-        result, _ = await self._agenerate(prompt, system, temperature=0.7, credentials=user_api_key)
+        result, _ = await self._agenerate(prompt, system, temperature=0.7, credentials=user_api_key,
+                                          operation="examples")
         return result.strip()
 
 
@@ -394,8 +593,10 @@ class GigaChatService:
             "Строго следуй формату: исправленный текст → (если были правки) → 'Рекомендации по улучшению'."
         )
 
-        logger.info(f"Editing text with strict rules: {prompt}")
-        result, position = await self._agenerate(prompt, system, temperature=0.3, max_tokens=1536, credentials=user_api_key, on_start_callback=on_start_callback)
+        # Текст пользователя в лог не пишем — только размер промта
+        logger.debug("Редактирование текста по строгим правилам, промт: %d символов", len(prompt))
+        result, position = await self._agenerate(prompt, system, temperature=0.3, max_tokens=1536, credentials=user_api_key, on_start_callback=on_start_callback,
+                                                 operation="edit_text")
         return result.strip(), position
 
     async def edit_text_with_wishes(
@@ -460,8 +661,9 @@ class GigaChatService:
             "Формат ответа: только текст, больше ничего."
         )
 
-        logger.info(f"Editing text with user wishes: {user_wishes}")
-        result, position = await self._agenerate(prompt, system, temperature=0.4, max_tokens=1536, credentials=user_api_key, on_start_callback=on_start_callback)
+        logger.debug("Редактирование текста по пожеланиям, пожелания: %d символов", len(user_wishes))
+        result, position = await self._agenerate(prompt, system, temperature=0.4, max_tokens=1536, credentials=user_api_key, on_start_callback=on_start_callback,
+                                                 operation="edit_text_with_wishes")
         return result.strip(), position
 
     async def generate_content_plan(
@@ -535,7 +737,9 @@ class GigaChatService:
             temperature=0.8,
             max_tokens=1024,
             credentials=user_api_key,
-            on_start_callback=on_start_callback
+            on_start_callback=on_start_callback,
+            generation_type=GenerationType.CONTENT_PLAN,
+            operation="content_plan",
         )
         return result.strip(), position
 
@@ -574,7 +778,8 @@ class GigaChatService:
             "Не добавляй пояснений в ответ — только промпт."
         )
 
-        result, _ = await self._agenerate(prompt, system, temperature=0.8, max_tokens=512, credentials=user_api_key)
+        result, _ = await self._agenerate(prompt, system, temperature=0.8, max_tokens=512, credentials=user_api_key,
+                                          generation_type=GenerationType.ENHANCE_PROMPT, operation="image_prompt")
         return result.strip()
     
     async def enhance_image_prompt(
@@ -616,7 +821,9 @@ class GigaChatService:
             "Не добавляй пояснений в ответ — только улучшенный промпт."
         )
 
-        result, position = await self._agenerate(prompt, system, temperature=0.8, max_tokens=512, credentials=user_api_key, on_start_callback=on_start_callback)
+        result, position = await self._agenerate(prompt, system, temperature=0.8, max_tokens=512, credentials=user_api_key,
+                                                 on_start_callback=on_start_callback, generation_type=GenerationType.ENHANCE_PROMPT,
+                                                 operation="enhance_prompt")
         return result.strip(), position
 
     async def generate_image(self, prompt: str, style: Optional[str],
@@ -635,30 +842,33 @@ class GigaChatService:
         # Преобразуем стиль в русское название
         style_value = style_mapping.get(style, style if style else "реализм")
         prompt_value = prompt
-        used_credentials = credentials if credentials else self.credentials
         
         # Логируем параметры для отладки
-        logger.info(f"Генерация изображения: промпт='{prompt_value[:100]}...', стиль='{style_value}' (исходный: '{style}')")
+        logger.info("Генерация изображения: промпт %d символов, стиль '%s' (исходный: '%s')",
+                    len(prompt_value), style_value, style)
         
-        async def _generate_image_internal():
-            async with GigaChat(
-                    credentials=used_credentials,
-                    verify_ssl_certs=False,
-                    timeout=40.0,  
-            ) as giga:
-
+        def _request_with(used_credentials: str, failover_route: Optional[Route], model: Optional[str]):
+            async def _generate_image_internal():
+                giga = get_gigachat_client_pool().get(used_credentials, **self.pooled_client_options)
                 generate_prompt = f"Нарисуй изображение подходящее под текст '{prompt_value}' в стиле '{style_value}'"
-                logger.debug(f"Финальный промпт для GigaChat: {generate_prompt}")
+                logger.debug("Финальный промпт для GigaChat: %d символов", len(generate_prompt))
 
                 payload = Chat(
                     messages=[Messages(role=MessagesRole.USER, content=generate_prompt)],
                     temperature=0.7,
                     max_tokens=500,
                     function_call="auto",
+                    model=model,
                 )
 
                 # Асинхронный вызов
-                response = await giga.achat(payload)
+                with start_span("gigachat.chat", kind=SpanKind.CLIENT, generation_type=GenerationType.IMAGE.value,
+                                model=model):
+                    started_at = time.monotonic()
+                    async with self._upstream_call(used_credentials, "chat", IMAGE_TIMEOUT, failover_route):
+                        response = await giga.achat(payload)
+                    get_model_router().observe(model, time.monotonic() - started_at)
+                record_token_usage(response.usage, GenerationType.IMAGE.value)
                 message_content = response.choices[0].message.content
 
                 soup = BeautifulSoup(message_content, "html.parser")
@@ -668,7 +878,9 @@ class GigaChatService:
                     raise Exception("Не удалось сгенерировать изображение. Попробуйте ещё раз!")
 
                 file_id = img_tag["src"]
-                image_response = giga.get_image(file_id)
+                with start_span("gigachat.get_image", kind=SpanKind.CLIENT):
+                    async with self._upstream_call(used_credentials, "files", IMAGE_TIMEOUT, failover_route):
+                        image_response = await giga.aget_image(file_id)
 
                 filename = f"temp/temp_image_{uuid.uuid4()}.png"
                 os.makedirs("temp", exist_ok=True)
@@ -677,14 +889,29 @@ class GigaChatService:
                 image_data = base64.b64decode(image_response.content)
                 await asyncio.to_thread(self._save_image, filename, image_data) # создаем файл асинхронно
 
-                logger.info(f"Изображение успешно сохранено: {filename}")
+                logger.info("Изображение успешно сохранено: %s", filename)
                 return True, filename
-        
-        # Добавляем задачу в очередь
+
+            return _generate_image_internal
+
+        on_start = _once(on_start_callback)
+
+        async def _run(route: Route, failover: bool):
+            model = get_model_router().choose(
+                "image", credentials_load(route.credentials), credentials_wait(route.credentials)
+            )
+            # Добавляем задачу в очередь
+            queue = get_generation_queue(route.credentials)
+            get_shared_credential_pool().mark_placed(route.credentials)
+            return await queue.add_task(GenerationType.IMAGE,
+                                        _request_with(route.credentials, route if failover else None, model),
+                                        on_start_callback=on_start)
+
         try:
-            queue = get_generation_queue(used_credentials)
-            result, position = await queue.add_task(GenerationType.IMAGE, _generate_image_internal, on_start_callback=on_start_callback)
+            result, position = await self._run_routes(credentials, GenerationType.IMAGE, ("chat", "files"), _run)
             return result[0], result[1], position
+        except (GenerationCancelled, GenerationExpired):
+            raise
         except Exception as e:
             logger.exception("Ошибка при генерации изображения: %s", e)
             error_msg = str(e)
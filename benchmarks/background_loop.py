@@ -0,0 +1,32 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Optional
+
+
+class BackgroundLoop:
+    """
+    Цикл событий в отдельном потоке для заглушек внешних сервисов.
+
+    Заглушки не должны работать в цикле событий бота: синхронный HTTP-вызов в боте
+    заблокировал бы и бота, и заглушку, которая должна ему ответить.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="benchmark-fakes", daemon=True)
+        self._thread.start()
+
+    async def call(self, coro: Awaitable[Any]) -> Any:
+        """Выполнить корутину в фоновом цикле и дождаться результата из текущего цикла"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
@@ -0,0 +1,164 @@
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+# Минимальный PNG 1x1 — ответ на запрос содержимого сгенерированного изображения
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+@dataclass
+class FakeGigaChatSettings:
+    """Поведение заглушки GigaChat"""
+    latency: float = 1.0  # Среднее время ответа чата, секунды
+    model_latency: Dict[str, float] = field(default_factory=dict)  # Время ответа по моделям (вместо latency)
+    jitter: float = 0.3  # Разброс времени ответа (доля от latency)
+    auth_latency: float = 0.05
+    image_latency: float = 3.0  # Дополнительное время на «рисование» изображения
+    rate_429: float = 0.0  # Доля запросов чата, на которые отвечаем 429
+    max_concurrency: Optional[int] = 1  # Одновременных запросов чата сверх этого числа — 429 (как на бесплатном тарифе)
+    token_ttl: float = 1800  # Время жизни токена доступа, секунды
+    stream_chunk_delay: float = 0.05  # Пауза между частями потокового ответа
+
+
+@dataclass
+class FakeGigaChatStats:
+    requests: Counter = field(default_factory=Counter)  # Запросы по эндпоинтам
+    models: Counter = field(default_factory=Counter)  # Запросы чата по моделям
+    responses_429: int = 0
+    tokens: int = 0
+    max_in_flight: int = 0
+
+
+class FakeGigaChat:
+    """
+    Локальная заглушка GigaChat API для нагрузочных тестов: OAuth, чат (обычный и потоковый),
+    содержимое изображений и баланс. Время ответа и доля ответов 429 настраиваются.
+    """
+
+    def __init__(self, settings: Optional[FakeGigaChatSettings] = None):
+        self.settings = settings or FakeGigaChatSettings()
+        self.stats = FakeGigaChatStats()
+        self._in_flight = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+        self.auth_url = ""
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/v2/oauth", self._oauth)
+        app.router.add_post("/api/v1/chat/completions", self._chat)
+        app.router.add_get("/api/v1/files/{file_id}/content", self._file_content)
+        app.router.add_get("/api/v1/balance", self._balance)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=host, port=port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}/api/v1"
+        self.auth_url = f"http://{host}:{port}/api/v2/oauth"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _delay(self, base: float) -> float:
+        spread = base * self.settings.jitter
+        return max(0.0, random.uniform(base - spread, base + spread))
+
+    async def _oauth(self, request: web.Request) -> web.Response:
+        self.stats.requests["oauth"] += 1
+        if not request.headers.get("Authorization", "").startswith("Basic "):
+            return web.json_response({"code": 6, "message": "credentials doesn't match db data"}, status=401)
+        await asyncio.sleep(self.settings.auth_latency)
+        return web.json_response({
+            "access_token": uuid.uuid4().hex,
+            "expires_at": int((time.time() + self.settings.token_ttl) * 1000),
+        })
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        self.stats.requests["chat"] += 1
+        payload = await request.json()
+
+        over_capacity = self.settings.max_concurrency is not None and self._in_flight >= self.settings.max_concurrency
+        if over_capacity or random.random() < self.settings.rate_429:
+            self.stats.responses_429 += 1
+            return web.json_response({"status": 429, "message": "Too Many Requests"}, status=429)
+
+        self._in_flight += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, self._in_flight)
+        try:
+            prompt = payload["messages"][-1]["content"]
+            model = payload.get("model") or "GigaChat"
+            self.stats.models[model] += 1
+            is_image = payload.get("function_call") == "auto" and prompt.startswith("Нарисуй")
+            latency = self.settings.model_latency.get(model, self.settings.latency)
+            await asyncio.sleep(self._delay(latency + (self.settings.image_latency if is_image else 0)))
+
+            if is_image:
+                content = f'<img src="{uuid.uuid4()}" fuse="true"/>'
+            else:
+                content = f"Сгенерированный текст для запроса: {prompt[:80]}"
+            usage = {
+                "prompt_tokens": len(prompt) // 4 + 1,
+                "completion_tokens": len(content) // 4 + 1,
+                "total_tokens": (len(prompt) + len(content)) // 4 + 2,
+            }
+            self.stats.tokens += usage["total_tokens"]
+
+            if payload.get("stream"):
+                return await self._stream(request, payload, content, usage)
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": content}, "index": 0,
+                             "finish_reason": "stop"}],
+                "created": int(time.time()),
+                "model": payload.get("model") or "GigaChat",
+                "usage": usage,
+                "object": "chat.completion",
+            })
+        finally:
+            self._in_flight -= 1
+
+    async def _stream(self, request: web.Request, payload, content: str, usage) -> web.StreamResponse:
+        """Потоковый ответ (SSE) по несколько слов в каждой части"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = content.split(" ")
+        for index in range(0, len(words), 3):
+            chunk = {
+                "choices": [{"delta": {"role": "assistant", "content": " ".join(words[index:index + 3]) + " "},
+                             "index": 0}],
+                "created": int(time.time()),
+                "model": payload.get("model") or "GigaChat",
+                "object": "chat.completion",
+            }
+            if index + 3 >= len(words):
+                chunk["choices"][0]["finish_reason"] = "stop"
+                chunk["usage"] = usage
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(self.settings.stream_chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _file_content(self, request: web.Request) -> web.Response:
+        self.stats.requests["file_content"] += 1
+        return web.Response(body=TINY_PNG, content_type="image/jpg")
+
+    async def _balance(self, request: web.Request) -> web.Response:
+        self.stats.requests["balance"] += 1
+        return web.json_response({"balance": [{"usage": "GigaChat", "value": 1_000_000}]})
@@ -0,0 +1,80 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+
+BOT_USER = {"id": 1000000, "is_bot": True, "first_name": "NKO Bot", "username": "nko_benchmark_bot"}
+
+# Методы, которые возвращают отправленное или изменённое сообщение
+_MESSAGE_METHODS = {
+    "sendmessage", "sendphoto", "senddocument", "editmessagetext", "editmessagecaption",
+    "editmessagereplymarkup", "forwardmessage", "copymessage",
+}
+
+
+class FakeTelegram:
+    """
+    Локальная заглушка Bot API для нагрузочных тестов: отвечает на любые методы правдоподобными
+    объектами и считает вызовы по методам. latency — время ответа на каждый вызов, секунды.
+    """
+
+    def __init__(self, latency: float = 0.03):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=host, port=port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def session(self, **kwargs) -> AiohttpSession:
+        """Сессия aiogram, которая отправляет запросы Bot API в заглушку (kwargs — параметры AiohttpSession)"""
+        return AiohttpSession(api=TelegramAPIServer.from_base(self.base_url), **kwargs)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method.lower(), params)})
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getme":
+            return BOT_USER
+        if method in _MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            message_id = int(params.get("message_id") or next(self._message_ids))
+            message = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+            }
+            if method == "sendphoto":
+                message["photo"] = [{"file_id": uuid.uuid4().hex, "file_unique_id": uuid.uuid4().hex[:16],
+                                     "width": 1, "height": 1}]
+                message["caption"] = str(params.get("caption", ""))
+            else:
+                message["text"] = str(params.get("text") or params.get("caption") or "")
+            return message
+        return True
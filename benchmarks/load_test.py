@@ -0,0 +1,398 @@
+"""
+Нагрузочный тест бота без внешних сервисов.
+
+Поднимает заглушки GigaChat и Bot API, подаёт в настоящий Dispatcher (main.build_dispatcher) поток
+синтетических обновлений от N пользователей и печатает пропускную способность, время сценариев,
+ожидание в очереди генерации и число SQL-запросов на обновление.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --users 50 --rounds 3
+    python -m benchmarks.load_test --json baseline.json            # сохранить результат как базовый
+    python -m benchmarks.load_test --compare baseline.json         # сравнить с базовым результатом
+    python -m benchmarks.load_test --fast-runtime --compare baseline.json  # uvloop и orjson против стандартных
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from benchmarks.background_loop import BackgroundLoop
+from benchmarks.fake_gigachat import FakeGigaChat, FakeGigaChatSettings
+from benchmarks.fake_telegram import BOT_USER, FakeTelegram
+from utils.runtime import describe_runtime, event_loop_factory, json_functions
+
+
+# Счётчик SQL-запросов текущего обновления (изменяемый список, чтобы его видели дочерние задачи)
+_update_queries: ContextVar[Optional[List[int]]] = ContextVar("update_queries", default=None)
+
+_ids = itertools.count(1)
+
+# Сценарии: последовательность обновлений одного пользователя; ("message", текст) или ("callback", data)
+SCENARIOS: Dict[str, List[tuple]] = {
+    "free_text": [
+        ("message", "Напиши пост о субботнике в городском парке для наших волонтёров"),
+    ],
+    "image": [
+        ("message", "Создание картинки 🎨"),
+        ("message", "Волонтёры убирают осенний парк, солнечный день"),
+        ("callback", "image_prompt_original"),
+        ("callback", "image_realistic"),
+    ],
+    "content_plan": [
+        ("message", "Создать контент-план 📅"),
+        ("message", "неделя"),
+        ("message", "3 раза в неделю"),
+        ("callback", "content_plan_from_data"),
+    ],
+    "history": [
+        ("message", "История 📜"),
+        ("callback", "history_item_next_1"),
+    ],
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (0, если значений нет)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """"free_text=5,image=1" -> веса сценариев"""
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def parse_model_latency(value: str) -> Dict[str, float]:
+    """"GigaChat=0.3,GigaChat-Pro=0.8" -> время ответа моделей заглушки"""
+    latency = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, seconds = item.split("=")
+        latency[name.strip()] = float(seconds)
+    return latency
+
+
+def _configure_environment(args, fake_gigachat: FakeGigaChat, workdir: str):
+    """Переменные окружения бота; задаются до импорта модулей бота (config читается при импорте)"""
+    from cryptography.fernet import Fernet
+
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCHMARK",
+        "ENCRYPTION_KEY": Fernet.generate_key().decode(),
+        "GIGACHAT_CREDENTIALS": base64.b64encode(b"benchmark:benchmark").decode(),
+        "GIGACHAT_BASE_URL": fake_gigachat.base_url,
+        "GIGACHAT_AUTH_URL": fake_gigachat.auth_url,
+        "DATABASE_URL": args.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        "REDIS_URL": args.redis_url or "",
+        "GENERATION_QUEUE_BACKEND": "redis" if args.redis_url else "local",
+        "GENERATION_QUOTAS": args.quotas,
+        "RUN_MODE": "polling",
+        "TRACING_EXPORTER": "",
+        "METRICS_PORT": "",
+        "INSTANCE_NAME": "benchmark",
+        "FAST_RUNTIME": "true" if args.fast_runtime else "false",
+    })
+    if args.model_routes is not None:
+        os.environ["GIGACHAT_MODEL_ROUTES"] = args.model_routes
+    # Новые версии библиотеки gigachat требуют явно указать модель
+    os.environ.setdefault("GIGACHAT_MODEL", "GigaChat")
+
+
+class LoadTest:
+    """Прогон сценариев через настоящий Dispatcher"""
+
+    def __init__(self, args, bot, dp):
+        self.args = args
+        self.bot = bot
+        self.dp = dp
+        self.rng = random.Random(args.seed)
+        self.update_times: List[float] = []
+        self.update_queries: List[int] = []
+        self.scenario_times: Dict[str, List[float]] = defaultdict(list)
+        self.errors = 0
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def _update(self, user_id: int, kind: str, payload: str):
+        from aiogram.types import Update
+
+        chat = {"id": user_id, "type": "private"}
+        now = int(time.time())
+        if kind == "message":
+            data = {"update_id": next(_ids), "message": {
+                "message_id": next(_ids), "date": now, "chat": chat, "from": self._user(user_id), "text": payload,
+            }}
+        else:
+            data = {"update_id": next(_ids), "callback_query": {
+                "id": str(next(_ids)), "from": self._user(user_id), "chat_instance": "benchmark", "data": payload,
+                "message": {"message_id": next(_ids), "date": now, "chat": chat, "from": BOT_USER, "text": "..."},
+            }}
+        return Update.model_validate(data, context={"bot": self.bot})
+
+    async def _feed(self, user_id: int, kind: str, payload: str):
+        queries = [0]
+        token = _update_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, self._update(user_id, kind, payload))
+        except Exception as e:
+            self.errors += 1
+            logging.getLogger(__name__).warning(f"Ошибка обработки обновления ({kind} {payload!r}): {e}")
+        finally:
+            self.update_times.append(time.perf_counter() - started)
+            self.update_queries.append(queries[0])
+            _update_queries.reset(token)
+
+    async def _run_user(self, user_id: int, mix: Dict[str, float]):
+        await asyncio.sleep(self.rng.uniform(0, self.args.ramp))
+        names, weights = list(mix), list(mix.values())
+        for _ in range(self.args.rounds):
+            name = self.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            for kind, payload in SCENARIOS[name]:
+                await self._feed(user_id, kind, payload)
+                await asyncio.sleep(self.args.think_time)
+            self.scenario_times[name].append(time.perf_counter() - started)
+
+    async def run(self, user_ids: List[int]) -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_user(user_id, self.args.mix) for user_id in user_ids))
+        return time.perf_counter() - started
+
+
+async def _seed_users(user_ids: List[int], own_key_share: float, rng: random.Random):
+    """Пользователи с данными НКО; часть из них — со своим API-ключом (отдельная очередь генерации)"""
+    from database import db_manager
+    from database.repositories import AIAPIRepository, NKORepository, UserRepository
+
+    async with db_manager.get_session() as session:
+        for user_id in user_ids:
+            await UserRepository(session).create_user(user_id)
+            await NKORepository(session).save_nko_data(user_id, {
+                "name": f"НКО {user_id}",
+                "description": "Помогаем бездомным животным",
+                "activities": "волонтёрство, сбор кормов",
+                "organization_size": 12,
+            })
+            if rng.random() < own_key_share:
+                key = base64.b64encode(f"user{user_id}:secret".encode()).decode()
+                await AIAPIRepository(session).create_api_key(user_id, "GigaChat", key)
+
+
+async def main(args) -> Dict[str, Any]:
+    fake_gigachat = FakeGigaChat(FakeGigaChatSettings(
+        latency=args.gigachat_latency,
+        model_latency=args.model_latency,
+        image_latency=args.image_latency,
+        rate_429=args.rate_429,
+        max_concurrency=args.gigachat_concurrency or None,
+    ))
+    fake_telegram = FakeTelegram(latency=args.telegram_latency)
+    fakes = BackgroundLoop()
+    fakes.start()
+    await fakes.call(fake_gigachat.start())
+    await fakes.call(fake_telegram.start())
+    workdir = tempfile.mkdtemp(prefix="nko_benchmark_")
+    _configure_environment(args, fake_gigachat, workdir)
+
+    # Модули бота импортируются только после настройки окружения
+    from aiogram import Bot
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    from opentelemetry.trace import StatusCode
+    from sqlalchemy import event
+
+    # Время ожидания и выполнения задач генерации берём из span трассировки (все трассы сохраняются)
+    spans = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(spans))
+    trace.set_tracer_provider(provider)
+
+    from database import db_manager
+    from main import build_dispatcher
+    from utils.generation_queue import stop_all_generation_queues
+    from utils.redis_client import close_redis
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    db_manager.engine.echo = args.verbose
+
+    @event.listens_for(db_manager.engine.sync_engine, "before_cursor_execute")
+    def _count_query(*_):
+        queries = _update_queries.get()
+        if queries is not None:
+            queries[0] += 1
+
+    await db_manager.init_db()
+    user_ids = list(range(10_000, 10_000 + args.users))
+    await _seed_users(user_ids, args.own_key_share, random.Random(args.seed))
+
+    json_dumps, json_loads = json_functions(args.fast_runtime)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=fake_telegram.session(json_loads=json_loads, json_dumps=json_dumps))
+    dp = build_dispatcher(bot)
+    test = LoadTest(args, bot, dp)
+    try:
+        elapsed = await test.run(user_ids)
+    finally:
+        await stop_all_generation_queues()
+        await bot.session.close()
+        await dp.storage.close()
+        await close_redis()
+        await db_manager.close()
+        await fakes.call(fake_gigachat.stop())
+        await fakes.call(fake_telegram.stop())
+        fakes.stop()
+
+    durations = defaultdict(list)
+    failed_generations = 0
+    for span in spans.get_finished_spans():
+        durations[span.name].append((span.end_time - span.start_time) / 1e9)
+        if span.name == "generation.execute" and span.status.status_code == StatusCode.ERROR:
+            failed_generations += 1
+    provider.shutdown()
+
+    return {
+        "params": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+        "runtime": describe_runtime(args.fast_runtime),
+        "elapsed": elapsed,
+        "updates": len(test.update_times),
+        "updates_per_second": len(test.update_times) / elapsed if elapsed else 0.0,
+        "errors": test.errors,
+        "failed_generations": failed_generations,
+        "update_latency": _summary(test.update_times),
+        "scenario_latency": {name: _summary(values) for name, values in sorted(test.scenario_times.items())},
+        "queue_wait": _summary(durations["generation.queue_wait"]),
+        "generation_execute": _summary(durations["generation.execute"]),
+        "db_queries_per_update": {
+            "mean": statistics.fmean(test.update_queries) if test.update_queries else 0.0,
+            "p90": percentile(test.update_queries, 90),
+            "max": max(test.update_queries, default=0),
+        },
+        "gigachat": {
+            "requests": dict(fake_gigachat.stats.requests),
+            "models": dict(fake_gigachat.stats.models),
+            "responses_429": fake_gigachat.stats.responses_429,
+            "tokens": fake_gigachat.stats.tokens,
+            "max_in_flight": fake_gigachat.stats.max_in_flight,
+        },
+        "telegram_calls": dict(fake_telegram.calls.most_common()),
+    }
+
+
+def _format_summary(summary: Dict[str, float], unit: str = "s") -> str:
+    return (f"n={summary['count']:<5} p50={summary['p50']:.3f}{unit} p90={summary['p90']:.3f}{unit} "
+            f"p99={summary['p99']:.3f}{unit} max={summary['max']:.3f}{unit}")
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    def delta(path: List[str]) -> str:
+        if baseline is None:
+            return ""
+        old: Any = baseline
+        new: Any = result
+        for key in path:
+            old, new = old.get(key, {}), new.get(key, {})
+        if not isinstance(old, (int, float)) or not old:
+            return ""
+        return f"  ({(new - old) / old:+.1%} к базовому)"
+
+    print(f"Среда выполнения: {result.get('runtime', '—')}"
+          + (f" (базовый: {baseline.get('runtime', '—')})" if baseline is not None else ""))
+    print(f"Обновлений: {result['updates']} за {result['elapsed']:.1f} с — "
+          f"{result['updates_per_second']:.1f} обн./с{delta(['updates_per_second'])}, ошибок: {result['errors']}, "
+          f"неудачных генераций: {result['failed_generations']}")
+    print(f"Обработка обновления:  {_format_summary(result['update_latency'])}{delta(['update_latency', 'p90'])}")
+    for name, summary in result["scenario_latency"].items():
+        print(f"Сценарий {name:<13} {_format_summary(summary)}{delta(['scenario_latency', name, 'p90'])}")
+    print(f"Ожидание в очереди:    {_format_summary(result['queue_wait'])}{delta(['queue_wait', 'p90'])}")
+    print(f"Выполнение генерации:  {_format_summary(result['generation_execute'])}")
+    queries = result["db_queries_per_update"]
+    print(f"SQL-запросов на обновление: среднее {queries['mean']:.1f}, p90 {queries['p90']}, "
+          f"максимум {queries['max']}{delta(['db_queries_per_update', 'mean'])}")
+    gigachat = result["gigachat"]
+    print(f"GigaChat: запросы {gigachat['requests']}, ответов 429: {gigachat['responses_429']}, "
+          f"токенов: {gigachat['tokens']}, максимум одновременных: {gigachat['max_in_flight']}")
+    print(f"Модели GigaChat: {gigachat.get('models', {})}")
+    print(f"Bot API: {result['telegram_calls']}")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушках GigaChat и Telegram")
+    parser.add_argument("--users", type=int, default=20, help="Число пользователей")
+    parser.add_argument("--rounds", type=int, default=3, help="Сценариев на пользователя")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("free_text=5,image=1,content_plan=1,history=3"),
+                        help="Веса сценариев: free_text, image, content_plan, history")
+    parser.add_argument("--ramp", type=float, default=2.0, help="Пользователи начинают в течение стольких секунд")
+    parser.add_argument("--think-time", type=float, default=0.05, help="Пауза между действиями пользователя, с")
+    parser.add_argument("--gigachat-latency", type=float, default=0.5, help="Время ответа чата GigaChat, с")
+    parser.add_argument("--model-latency", type=parse_model_latency, default={},
+                        help="Время ответа по моделям, например GigaChat=0.3,GigaChat-Pro=0.8 (иначе --gigachat-latency)")
+    parser.add_argument("--model-routes", default=None,
+                        help="GIGACHAT_MODEL_ROUTES (по умолчанию — как в боте; пустая строка — модель по умолчанию везде)")
+    parser.add_argument("--image-latency", type=float, default=1.0, help="Дополнительное время на изображение, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля случайных ответов 429")
+    parser.add_argument("--gigachat-concurrency", type=int, default=1,
+                        help="Одновременных запросов до ответа 429 (0 — без ограничения)")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="Время ответа Bot API, с")
+    parser.add_argument("--own-key-share", type=float, default=0.0, help="Доля пользователей со своим ключом")
+    parser.add_argument("--quotas", default="", help="GENERATION_QUOTAS (по умолчанию квоты выключены)")
+    parser.add_argument("--database-url", default=None, help="БД (по умолчанию — временная SQLite)")
+    parser.add_argument("--redis-url", default=None, help="Redis для FSM и общей очереди (например, fakeredis://)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", default=None, help="Сохранить результат в JSON")
+    parser.add_argument("--compare", default=None, help="Сравнить с результатом из JSON")
+    parser.add_argument("--fast-runtime", action="store_true",
+                        help="Профиль FAST_RUNTIME: цикл событий uvloop и JSON через orjson (если установлены)")
+    parser.add_argument("--verbose", action="store_true", help="Логи бота уровня INFO")
+    return parser.parse_args(argv)
+
+
+def run(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    with asyncio.Runner(loop_factory=event_loop_factory(args.fast_runtime)) as runner:
+        result = runner.run(main(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    run()
@@ -1,11 +1,26 @@
 import os
+import re
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Optional, Tuple
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _parse_pairs(env_name: str, default: str) -> Tuple[Tuple[str, str], ...]:
+    """Список вида "имя=значение,имя=значение" из переменной окружения"""
+    pairs = []
+    for item in os.getenv(env_name, default).split(","):
+        if not item.strip():
+            continue
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip() or not value.strip():
+            raise ValueError(f"Неверный формат {env_name}: {item}")
+        pairs.append((name.strip(), value.strip()))
+    return tuple(pairs)
+
+
 @dataclass(frozen=True)
 class Config:
     BOT_TOKEN: str
@@ -13,6 +28,83 @@ class Config:
     ENCRYPTION_KEY: str
     GIGACHAT_CREDENTIALS: str
     ADMIN_IDS: Tuple[int, ...]
+    # Адреса API GigaChat (например, локальная заглушка для нагрузочных тестов); None — адреса по умолчанию
+    GIGACHAT_BASE_URL: Optional[str] = None
+    GIGACHAT_AUTH_URL: Optional[str] = None
+    # Redis для общего состояния между несколькими экземплярами бота (FSM и т.д.).
+    # Без него всё хранится в памяти процесса. "fakeredis://" — локальная замена Redis для тестов
+    REDIS_URL: Optional[str] = None
+    FSM_STATE_TTL: Optional[int] = None  # Время жизни состояния FSM в Redis, секунды
+    FSM_DATA_TTL: Optional[int] = None  # Время жизни данных FSM в Redis, секунды
+    # Очередь генерации: "local" — в памяти процесса, "redis" — общая для всех экземпляров бота
+    GENERATION_QUEUE_BACKEND: str = "local"
+    GENERATION_MAX_CONCURRENCY: int = 1  # Одновременных запросов к GigaChat на один API-ключ (для общей очереди)
+    GENERATION_LEASE_TTL: float = 30.0  # Через сколько секунд освобождаются заявки упавшего экземпляра
+    GENERATION_QUEUE_IDLE_TTL: float = 600.0  # Через сколько секунд простоя удаляется очередь ключа (0 — никогда)
+    # Постоянное имя экземпляра бота: после перезапуска он продолжит свои незавершённые задачи генерации.
+    # При нескольких репликах у каждой должно быть своё имя
+    INSTANCE_NAME: str = "default"
+    # Режим получения обновлений: "polling" (для разработки) или "webhook"
+    RUN_MODE: str = "polling"
+    DROP_PENDING_UPDATES: bool = False  # Отбрасывать обновления, накопившиеся пока бот был остановлен
+    WEBHOOK_BASE_URL: Optional[str] = None  # Публичный адрес бота, например https://bot.example.com
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: Optional[str] = None  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+    WEBAPP_HOST: str = "0.0.0.0"
+    WEBAPP_PORT: int = 8080
+    WEBHOOK_QUEUE_SIZE: int = 1000  # Сколько обновлений может ждать и выполняться одновременно, дальше — ответ 503
+    WEBHOOK_DRAIN_TIMEOUT: float = 30.0  # Сколько секунд дообрабатывать очередь при остановке
+    # Обработка обновлений: разные чаты параллельно, один чат — по очереди
+    MAX_CONCURRENT_UPDATES: int = 100  # Всего обновлений одновременно
+    CHAT_MAX_CONCURRENCY: int = 1  # Обновлений одного чата одновременно (1 — строго по порядку)
+    MAX_PENDING_UPDATES_PER_CHAT: int = 10  # Дальше новые обновления чата отбрасываются
+    # Квоты пользователей на общем ключе: тип генерации -> (запросов, окно в секундах)
+    GENERATION_QUOTAS: Tuple[Tuple[str, Tuple[int, float]], ...] = ()
+    GENERATION_MAX_INFLIGHT_PER_USER: int = 0  # Одновременных запросов пользователя (0 — без ограничения)
+    # Крайний срок задачи генерации по типам, секунд с постановки в очередь (0 — без срока)
+    GENERATION_DEADLINES: Tuple[Tuple[str, float], ...] = ()
+    # Ключи бота для пользователей без своего ключа: GIGACHAT_CREDENTIALS и дополнительные из GIGACHAT_CREDENTIALS_POOL
+    GIGACHAT_CREDENTIALS_POOL: Tuple[str, ...] = ()
+    GIGACHAT_EXHAUSTED_COOLDOWN: float = 3600.0  # Сколько секунд не использовать ключ, у которого закончились токены
+    # Предохранитель GigaChat: после стольких сбоев подряд (таймауты, 5xx, ошибки соединения) запросы
+    # к ключу сразу отклоняются, через CIRCUIT_BREAKER_RESET_TIMEOUT секунд пропускается пробный (0 — выключен)
+    CIRCUIT_BREAKER_FAILURES: int = 5
+    CIRCUIT_BREAKER_RESET_TIMEOUT: float = 30.0
+    # Дублирование текстовых генераций: если ответа нет дольше p90, запрос повторяется с другим ключом
+    GENERATION_HEDGING: bool = False
+    GENERATION_HEDGE_USER_KEYS: bool = False  # Дублировать и запросы со своим ключом пользователя (на ключ бота)
+    # Обновление позиции и оценки времени в статус-сообщениях ожидающих задач: раз в столько секунд (0 — выключено)
+    GENERATION_PROGRESS_INTERVAL: float = 5.0
+    GENERATION_PROGRESS_BATCH: int = 20  # Не больше стольких правок сообщений за один шаг
+    # Модель GigaChat по операциям сервиса (без записи — модель клиента по умолчанию, GIGACHAT_MODEL)
+    GIGACHAT_MODEL_ROUTES: Tuple[Tuple[str, str], ...] = ()
+    # Понижение модели, если ожидаемое время ответа превышает бюджет операции: модель -> более быстрая
+    GIGACHAT_MODEL_DOWNGRADES: Tuple[Tuple[str, str], ...] = ()
+    # Бюджет времени ответа по операциям, секунд (без записи — модель не понижается)
+    GIGACHAT_LATENCY_BUDGETS: Tuple[Tuple[str, float], ...] = ()
+    # Маршрутизация задач: ключ выбирается по доступности и очереди, после 401/402/429 задача переходит на запасной
+    GENERATION_FAILOVER: bool = True
+    # Использовать отключённый ключ пользователя, когда ключи бота перегружены
+    GENERATION_FAILOVER_DISCONNECTED_KEYS: bool = False
+    # Метрики Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (без METRICS_PORT сервер не запускается)
+    METRICS_PORT: Optional[int] = None
+    METRICS_HOST: str = "127.0.0.1"
+    # Трассировка OpenTelemetry: "" — выключена, "console" — в stdout, "otlp" — в коллектор (OTEL_EXPORTER_OTLP_ENDPOINT)
+    TRACING_EXPORTER: str = ""
+    TRACING_SAMPLE_RATIO: float = 0.1  # Доля сохраняемых трасс
+    # Монитор цикла событий: период замера задержки (0 — выключен), порог блокировки, отладочный режим asyncio
+    LOOP_MONITOR_INTERVAL: float = 0.5
+    LOOP_STALL_THRESHOLD: float = 0.1
+    LOOP_DEBUG: bool = False
+    # Логирование: формат text или json, общий уровень, уровни модулей ("модуль=УРОВЕНЬ,..."),
+    # выборка частых записей ниже WARNING ("модуль=доля,...": 0.1 — каждая десятая запись)
+    LOG_FORMAT: str = "text"
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: Tuple[Tuple[str, str], ...] = ()
+    LOG_SAMPLING: Tuple[Tuple[str, float], ...] = ()
+    DB_ECHO: bool = False  # Логировать все SQL-запросы (только для отладки)
+    # Быстрая среда выполнения: цикл событий uvloop и сериализация orjson (если пакеты установлены)
+    FAST_RUNTIME: bool = False
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -28,6 +120,12 @@ class Config:
         if not gigachat_credentials:
             raise ValueError("GIGACHAT_CREDENTIALS не установлены!")
 
+        # Основной ключ всегда первый, повторы убираются
+        credentials_pool = tuple(dict.fromkeys(
+            [gigachat_credentials]
+            + [item.strip() for item in os.getenv("GIGACHAT_CREDENTIALS_POOL", "").split(",") if item.strip()]
+        ))
+
         database = os.getenv("DATABASE_URL","sqlite+aiosqlite:///./nko_bot.db")
 
         admins_env = os.getenv("ADMIN_IDS", "")
@@ -37,12 +135,140 @@ class Config:
             if tg_id.strip().isdigit()
         )
 
+        redis_url = os.getenv("REDIS_URL") or None
+        fsm_state_ttl = int(os.getenv("FSM_STATE_TTL", "86400")) or None
+        fsm_data_ttl = int(os.getenv("FSM_DATA_TTL", "86400")) or None
+
+        queue_backend = os.getenv("GENERATION_QUEUE_BACKEND", "local").lower()
+        if queue_backend not in ("local", "redis"):
+            raise ValueError("GENERATION_QUEUE_BACKEND должен быть local или redis!")
+        if queue_backend == "redis" and not redis_url:
+            raise ValueError("Для GENERATION_QUEUE_BACKEND=redis нужно указать REDIS_URL!")
+
+        run_mode = os.getenv("RUN_MODE", "polling").lower()
+        if run_mode not in ("polling", "webhook"):
+            raise ValueError("RUN_MODE должен быть polling или webhook!")
+        webhook_base_url = os.getenv("WEBHOOK_BASE_URL") or None
+        webhook_secret = os.getenv("WEBHOOK_SECRET") or None
+        if run_mode == "webhook":
+            if not webhook_base_url:
+                raise ValueError("Для RUN_MODE=webhook нужно указать WEBHOOK_BASE_URL!")
+            # Telegram допускает в секрете только A-Z, a-z, 0-9, _ и - (1-256 символов)
+            if not webhook_secret or not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", webhook_secret):
+                raise ValueError("Для RUN_MODE=webhook нужно указать WEBHOOK_SECRET (A-Z, a-z, 0-9, _ и -)!")
+
+        tracing_exporter = os.getenv("TRACING_EXPORTER", "").lower()
+        if tracing_exporter not in ("", "console", "otlp"):
+            raise ValueError("TRACING_EXPORTER должен быть console или otlp!")
+
+        log_format = os.getenv("LOG_FORMAT", "text").lower()
+        if log_format not in ("text", "json"):
+            raise ValueError("LOG_FORMAT должен быть text или json!")
+        log_levels = tuple((name, level.upper()) for name, level in _parse_pairs(
+            "LOG_LEVELS", "sqlalchemy.engine=WARNING,httpx=WARNING,aiohttp.access=WARNING"
+        ))
+        try:
+            log_sampling = tuple((name, float(rate)) for name, rate in _parse_pairs(
+                "LOG_SAMPLING", "aiogram.event=0.01,utils.generation_queue=0.1"
+            ))
+        except ValueError:
+            raise ValueError("Неверный формат LOG_SAMPLING: доля записей должна быть числом от 0 до 1")
+
+        # Формат: "text=20/3600,image=5/3600" — не больше 20 текстов и 5 картинок в час
+        quotas_env = os.getenv("GENERATION_QUOTAS", "text=20/3600,image=5/3600,content_plan=3/3600,enhance_prompt=10/3600")
+        generation_quotas = []
+        for item in quotas_env.split(","):
+            if not item.strip():
+                continue
+            try:
+                generation_type, quota = item.split("=")
+                limit, window = quota.split("/")
+                generation_quotas.append((generation_type.strip(), (int(limit), float(window))))
+            except ValueError:
+                raise ValueError(f"Неверный формат GENERATION_QUOTAS: {item}")
+
+        try:
+            generation_deadlines = tuple((name, float(seconds)) for name, seconds in _parse_pairs(
+                "GENERATION_DEADLINES", "text=120,image=180,content_plan=180,enhance_prompt=60"
+            ))
+        except ValueError:
+            raise ValueError("Неверный формат GENERATION_DEADLINES: срок должен быть числом секунд")
+
+        # Формат: "операция=модель"; операции — методы GigaChatService (free_text, edit_text, image и т.д.)
+        model_routes = _parse_pairs(
+            "GIGACHAT_MODEL_ROUTES",
+            "enhance_prompt=GigaChat,image_prompt=GigaChat,edit_text=GigaChat,validation=GigaChat,"
+            "free_text=GigaChat-Pro,structured_post=GigaChat-Pro,examples=GigaChat-Pro,"
+            "edit_text_with_wishes=GigaChat-Pro,content_plan=GigaChat-Pro",
+        )
+        model_downgrades = _parse_pairs("GIGACHAT_MODEL_DOWNGRADES", "GigaChat-Max=GigaChat-Pro,GigaChat-Pro=GigaChat")
+        try:
+            latency_budgets = tuple((name, float(seconds)) for name, seconds in _parse_pairs(
+                "GIGACHAT_LATENCY_BUDGETS",
+                "free_text=20,structured_post=20,examples=20,edit_text_with_wishes=20,content_plan=40",
+            ))
+        except ValueError:
+            raise ValueError("Неверный формат GIGACHAT_LATENCY_BUDGETS: бюджет должен быть числом секунд")
+
         return cls(
             BOT_TOKEN=token,
             DATABASE_URL=database,
             ENCRYPTION_KEY=encryption_key,
             GIGACHAT_CREDENTIALS=gigachat_credentials,
+            GIGACHAT_BASE_URL=os.getenv("GIGACHAT_BASE_URL") or None,
+            GIGACHAT_AUTH_URL=os.getenv("GIGACHAT_AUTH_URL") or None,
             ADMIN_IDS=admin_ids,
+            REDIS_URL=redis_url,
+            FSM_STATE_TTL=fsm_state_ttl,
+            FSM_DATA_TTL=fsm_data_ttl,
+            GENERATION_QUEUE_BACKEND=queue_backend,
+            GENERATION_MAX_CONCURRENCY=int(os.getenv("GENERATION_MAX_CONCURRENCY", "1")),
+            GENERATION_LEASE_TTL=float(os.getenv("GENERATION_LEASE_TTL", "30")),
+            GENERATION_QUEUE_IDLE_TTL=float(os.getenv("GENERATION_QUEUE_IDLE_TTL", "600")),
+            INSTANCE_NAME=os.getenv("INSTANCE_NAME") or "default",
+            RUN_MODE=run_mode,
+            DROP_PENDING_UPDATES=os.getenv("DROP_PENDING_UPDATES", "false").lower() in ("1", "true", "yes"),
+            WEBHOOK_BASE_URL=webhook_base_url,
+            WEBHOOK_PATH=os.getenv("WEBHOOK_PATH", "/webhook"),
+            WEBHOOK_SECRET=webhook_secret,
+            WEBAPP_HOST=os.getenv("WEBAPP_HOST", "0.0.0.0"),
+            WEBAPP_PORT=int(os.getenv("WEBAPP_PORT", "8080")),
+            WEBHOOK_QUEUE_SIZE=int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000")),
+            WEBHOOK_DRAIN_TIMEOUT=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")),
+            MAX_CONCURRENT_UPDATES=int(os.getenv("MAX_CONCURRENT_UPDATES", "100")),
+            CHAT_MAX_CONCURRENCY=int(os.getenv("CHAT_MAX_CONCURRENCY", "1")),
+            MAX_PENDING_UPDATES_PER_CHAT=int(os.getenv("MAX_PENDING_UPDATES_PER_CHAT", "10")),
+            GENERATION_QUOTAS=tuple(generation_quotas),
+            GENERATION_MAX_INFLIGHT_PER_USER=int(os.getenv("GENERATION_MAX_INFLIGHT_PER_USER", "2")),
+            GENERATION_DEADLINES=generation_deadlines,
+            GIGACHAT_CREDENTIALS_POOL=credentials_pool,
+            GIGACHAT_EXHAUSTED_COOLDOWN=float(os.getenv("GIGACHAT_EXHAUSTED_COOLDOWN", "3600")),
+            CIRCUIT_BREAKER_FAILURES=int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5")),
+            CIRCUIT_BREAKER_RESET_TIMEOUT=float(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", "30")),
+            GENERATION_HEDGING=os.getenv("GENERATION_HEDGING", "false").lower() in ("1", "true", "yes"),
+            GENERATION_HEDGE_USER_KEYS=os.getenv("GENERATION_HEDGE_USER_KEYS", "false").lower() in ("1", "true", "yes"),
+            GENERATION_PROGRESS_INTERVAL=float(os.getenv("GENERATION_PROGRESS_INTERVAL", "5")),
+            GENERATION_PROGRESS_BATCH=int(os.getenv("GENERATION_PROGRESS_BATCH", "20")),
+            GIGACHAT_MODEL_ROUTES=model_routes,
+            GIGACHAT_MODEL_DOWNGRADES=model_downgrades,
+            GIGACHAT_LATENCY_BUDGETS=latency_budgets,
+            GENERATION_FAILOVER=os.getenv("GENERATION_FAILOVER", "true").lower() in ("1", "true", "yes"),
+            GENERATION_FAILOVER_DISCONNECTED_KEYS=(
+                os.getenv("GENERATION_FAILOVER_DISCONNECTED_KEYS", "false").lower() in ("1", "true", "yes")
+            ),
+            METRICS_PORT=int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None,
+            METRICS_HOST=os.getenv("METRICS_HOST", "127.0.0.1"),
+            TRACING_EXPORTER=tracing_exporter,
+            TRACING_SAMPLE_RATIO=float(os.getenv("TRACING_SAMPLE_RATIO", "0.1")),
+            LOOP_MONITOR_INTERVAL=float(os.getenv("LOOP_MONITOR_INTERVAL", "0.5")),
+            LOOP_STALL_THRESHOLD=float(os.getenv("LOOP_STALL_THRESHOLD", "0.1")),
+            LOOP_DEBUG=os.getenv("LOOP_DEBUG", "false").lower() in ("1", "true", "yes"),
+            LOG_FORMAT=log_format,
+            LOG_LEVEL=os.getenv("LOG_LEVEL", "INFO").upper(),
+            LOG_LEVELS=log_levels,
+            LOG_SAMPLING=log_sampling,
+            DB_ECHO=os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes"),
+            FAST_RUNTIME=os.getenv("FAST_RUNTIME", "false").lower() in ("1", "true", "yes"),
         )
 
 config = Config.from_env()
\ No newline at end of file
@@ -2,10 +2,13 @@ import logging
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
+from sqlalchemy import delete, func, inspect, select
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 
 from config import config
 from database.models import Base
+from utils.metrics import instrument_engine
+from utils.runtime import json_functions
 
 
 logger = logging.getLogger(__name__)
@@ -13,16 +16,46 @@ logger = logging.getLogger(__name__)
 DATABASE_URL = config.DATABASE_URL
 
 
+def _drop_duplicates(sync_conn, index):
+    """
+    Удаляет строки, которые не дают создать уникальный индекс: из каждой группы дублей остаётся
+    самая новая (с наибольшим id). Дубли могли остаться с тех пор, как индекса не было
+    (например, два одновременных сохранения контент-плана одного пользователя).
+    """
+    table = index.table
+    newest = select(func.max(table.c.id)).group_by(*index.columns)
+    result = sync_conn.execute(delete(table).where(table.c.id.not_in(newest)))
+    if result.rowcount:
+        logger.warning(f"Перед созданием индекса {index.name} удалено дублей в {table.name}: {result.rowcount}")
+
+
+def _create_missing_indexes(sync_conn):
+    """Создаёт индексы, объявленные в моделях, если их ещё нет в БД"""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.tables.values():
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique and "id" in table.c:
+                _drop_duplicates(sync_conn, index)
+            index.create(sync_conn)
+
+
 class DatabaseManager:
     """менеджер для работы с базой данных (единая точка входа для БД)"""
 
     def __init__(self, database_url: str = None):
         self.database_url = database_url or DATABASE_URL
+        json_dumps, json_loads = json_functions(config.FAST_RUNTIME)  # JSON-колонки (orjson при FAST_RUNTIME)
         self.engine = create_async_engine(
             self.database_url,
-            echo=True,  # Логирование запросов
-            future=True
+            echo=config.DB_ECHO,  # Логирование всех запросов (DB_ECHO, только для отладки)
+            future=True,
+            json_serializer=json_dumps,
+            json_deserializer=json_loads,
         )
+        instrument_engine(self.engine.sync_engine)  # Время SQL-запросов в метриках
         self.session_factory = async_sessionmaker(
             self.engine,
             class_=AsyncSession,
@@ -32,7 +65,8 @@ class DatabaseManager:
 
     @asynccontextmanager
     async def get_session(self) -> AsyncGenerator[AsyncSession, None]:
-        """получение сессии БД как контекстного менеджера(для транзакций)"""
+        """получение сессии БД как контекстного менеджера(для транзакций).
+        Репозитории только делают flush — commit выполняется здесь один раз в конце единицы работы"""
         session = self.session_factory()
         try:
             yield session
@@ -47,6 +81,8 @@ class DatabaseManager:
         """создание таблиц"""
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            # create_all не добавляет новые индексы в уже существующие таблицы — создаём их отдельно
+            await conn.run_sync(_create_missing_indexes)
 
     async def close(self):
         """закрытие соединений с БД"""
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import String, Text, DateTime, BigInteger, Integer, func, Boolean, ForeignKey, JSON
+from sqlalchemy import String, Text, DateTime, BigInteger, Integer, func, Boolean, ForeignKey, JSON, Index
 from sqlalchemy.orm import mapped_column, DeclarativeBase, Mapped, relationship
 
 
@@ -12,6 +12,8 @@ class Base(DeclarativeBase):
 class ContentPlanModel(Base):
     """Модель для хранения принятых контент-планов"""
     __tablename__ = "content_plans"
+    # У пользователя может быть только один принятый план (нужно для upsert по tg_id)
+    __table_args__ = (Index("uq_content_plans_tg_id", "tg_id", unique=True),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     tg_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.tg_id"), nullable=False, index=True)
@@ -150,4 +152,39 @@ class ContentHistoryModel(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
     # Связь
-    user: Mapped["UserModel"] = relationship("UserModel", back_populates="content_history")
\ No newline at end of file
+    user: Mapped["UserModel"] = relationship("UserModel", back_populates="content_history")
+
+class GenerationJobStatus:
+    """Статусы задачи генерации"""
+    PENDING = "pending"  # Ожидает выполнения
+    RUNNING = "running"  # Запрос к модели выполняется
+    GENERATED = "generated"  # Результат сохранён в историю, но ещё не отправлен пользователю
+    DONE = "done"  # Результат отправлен пользователю
+    FAILED = "failed"  # Генерация завершилась ошибкой
+    CANCELLED = "cancelled"  # Отменена пользователем или более новым запросом
+    EXPIRED = "expired"  # Не уложилась в крайний срок; пользователь может повторить её кнопкой
+
+    UNFINISHED = (PENDING, RUNNING, GENERATED)
+    FINISHED = (DONE, FAILED, CANCELLED, EXPIRED)
+
+
+class GenerationJobModel(Base):
+    """Задача генерации, сохранённая в БД, чтобы её можно было продолжить после перезапуска бота"""
+    __tablename__ = "generation_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.tg_id"), nullable=False, index=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    status_message_id: Mapped[int] = mapped_column(Integer, nullable=False)  # Сообщение, которое заменяется результатом
+    operation: Mapped[str] = mapped_column(String(50), nullable=False)  # Имя операции из реестра utils.generation_jobs
+    params: Mapped[dict] = mapped_column(JSON, nullable=False)  # Аргументы операции
+    history_params: Mapped[dict] = mapped_column(JSON, nullable=True)  # Поля записи истории генераций
+    progress_text: Mapped[str] = mapped_column(Text, nullable=True)  # Текст статус-сообщения во время генерации
+    # Сам ключ не сохраняется: "user" — ключ пользователя из таблицы aiapi, "default" — ключ бота
+    credential_ref: Mapped[str] = mapped_column(String(20), nullable=False, default="default")
+    owner: Mapped[str] = mapped_column(String(64), nullable=False, default="default")  # INSTANCE_NAME экземпляра бота
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default=GenerationJobStatus.PENDING, index=True)
+    history_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("content_history.id"), nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
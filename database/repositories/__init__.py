@@ -5,4 +5,5 @@ from database.repositories.nko_repository import NKORepository
 from database.repositories.users_repository import UserRepository
 from database.repositories.ai_api_repository import AIAPIRepository
 from database.repositories.content_plan_repository import ContentPlanRepository
-from database.repositories.notification_repository import NotificationRepository
\ No newline at end of file
+from database.repositories.notification_repository import NotificationRepository
+from database.repositories.generation_job_repository import GenerationJobRepository
@@ -6,8 +6,10 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.models import AccessLinksModel
+from utils.tracing import traced_repository
 
 
+@traced_repository
 class AccessLinksRepository:
     def __init__(self, db_session: AsyncSession):
         self.db_session = db_session
@@ -46,8 +48,8 @@ class AccessLinksRepository:
             expires_at=expires_at,
         )
         self.db_session.add(link)
-        await self.db_session.commit()
-        await self.db_session.refresh(link)
+        # code и created_at заполняются при flush (created_at — через RETURNING)
+        await self.db_session.flush()
         return link
 
     async def get_by_code(self, code: str) -> Optional[AccessLinksModel]:
@@ -63,8 +65,8 @@ class AccessLinksRepository:
         return result.scalar_one_or_none()
 
     async def save(self, link: AccessLinksModel) -> AccessLinksModel:
-        await self.db_session.commit()
-        await self.db_session.refresh(link)
+        """Сбросить изменения ссылки в БД (фиксирует транзакцию middleware в конце обработки)"""
+        await self.db_session.flush()
         return link
 
     async def register_activation(self, link: AccessLinksModel) -> AccessLinksModel:
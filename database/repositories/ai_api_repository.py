@@ -4,8 +4,10 @@ from sqlalchemy import delete
 from typing import Optional, List
 
 from database.models import AIAPIModel
+from utils.tracing import traced_repository
 
 
+@traced_repository
 class AIAPIRepository:
     """Класс-репозиторий для работы с API-ключами ИИ-моделей"""
     
@@ -39,8 +41,7 @@ class AIAPIRepository:
         new_api_key.api_key = api_key  # Используем property-сеттер для шифрования
         
         self.db_session.add(new_api_key)
-        await self.db_session.commit()
-        await self.db_session.refresh(new_api_key)
+        await self.db_session.flush()
         return new_api_key
 
     async def update_api_key(self, tg_id: int, model_name: str, api_key: str) -> Optional[AIAPIModel]:
@@ -49,24 +50,18 @@ class AIAPIRepository:
         if api_key_obj:
             api_key_obj.api_key = api_key  # Используем property-сеттер для шифрования
             api_key_obj.connected = True
-            await self.db_session.commit()
-            await self.db_session.refresh(api_key_obj)
+            await self.db_session.flush()
             return api_key_obj
         return None
 
     async def delete_api_key(self, tg_id: int, model_name: str) -> bool:
         """Удалить API-ключ пользователя"""
-        api_key_obj = await self.get_user_api_key(tg_id, model_name)
-        if not api_key_obj:
-            return False
-            
-        await self.db_session.execute(
+        result = await self.db_session.execute(
             delete(AIAPIModel)
             .where(AIAPIModel.tg_id == tg_id)
             .where(AIAPIModel.model_name == model_name)
         )
-        await self.db_session.commit()
-        return True
+        return result.rowcount > 0
 
     async def get_all_api_keys(self) -> List[AIAPIModel]:
         """Получить все API-ключи"""
@@ -3,8 +3,10 @@ from sqlalchemy.future import select
 from typing import List, Optional
 
 from database.models import ContentHistoryModel
+from utils.tracing import traced_repository
 
 
+@traced_repository
 class ContentHistoryRepository:
     """Класс-репозиторйи для работы с историей"""
     def __init__(self, db_session: AsyncSession):
@@ -31,8 +33,8 @@ class ContentHistoryRepository:
             additional_params=additional_params
         )
         self.db_session.add(history)
-        await self.db_session.commit()
-        await self.db_session.refresh(history)
+        # flush вместо commit: id и created_at возвращаются через RETURNING, фиксирует транзакцию middleware
+        await self.db_session.flush()
         return history
 
     async def get_user_content_history(
@@ -1,9 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import delete
 from typing import Optional, List
 
 from database.models import ContentPlanModel
+from database.upsert import build_upsert
+from utils.tracing import traced_repository
 
+@traced_repository
 class ContentPlanRepository:
     """Репозиторий для работы с контент-планами"""
     
@@ -15,29 +19,15 @@ class ContentPlanRepository:
         tg_id: int, 
         plan_content: str
     ) -> ContentPlanModel:
-        """Добавить или обновить контент-план для пользователя"""
-        # Проверяем, есть ли уже план у пользователя
-        result = await self.db_session.execute(
-            select(ContentPlanModel).where(ContentPlanModel.tg_id == tg_id)
+        """Добавить или обновить контент-план для пользователя (одним upsert-запросом)"""
+        stmt = build_upsert(
+            self.db_session,
+            ContentPlanModel,
+            values={"tg_id": tg_id, "plan_content": plan_content},
+            conflict_columns=["tg_id"],
         )
-        existing_plan = result.scalar_one_or_none()
-        
-        if existing_plan:
-            # Обновляем существующий план
-            existing_plan.plan_content = plan_content
-            await self.db_session.commit()
-            await self.db_session.refresh(existing_plan)
-            return existing_plan
-        else:
-            # Создаем новый план
-            new_plan = ContentPlanModel(
-                tg_id=tg_id,
-                plan_content=plan_content
-            )
-            self.db_session.add(new_plan)
-            await self.db_session.commit()
-            await self.db_session.refresh(new_plan)
-            return new_plan
+        result = await self.db_session.scalars(stmt)
+        return result.one()
     
     async def get_plan_by_user_id(self, tg_id: int) -> Optional[ContentPlanModel]:
         """Получить контент-план по ID пользователя"""
@@ -49,12 +39,6 @@ class ContentPlanRepository:
     async def remove_plan(self, tg_id: int) -> bool:
         """Удалить контент-план пользователя"""
         result = await self.db_session.execute(
-            select(ContentPlanModel).where(ContentPlanModel.tg_id == tg_id)
+            delete(ContentPlanModel).where(ContentPlanModel.tg_id == tg_id)
         )
-        plan = result.scalar_one_or_none()
-        
-        if plan:
-            self.db_session.delete(plan)
-            await self.db_session.commit()
-            return True
-        return False
\ No newline at end of file
+        return result.rowcount > 0
\ No newline at end of file
@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from database.models import GenerationJobModel, GenerationJobStatus
+from utils.tracing import traced_repository
+
+
+@traced_repository
+class GenerationJobRepository:
+    """Класс-репозиторий для работы с сохранёнными задачами генерации"""
+
+    def __init__(self, db_session: AsyncSession):
+        self.db_session = db_session
+
+    async def create(
+            self,
+            tg_id: int,
+            chat_id: int,
+            status_message_id: int,
+            operation: str,
+            params: dict,
+            history_params: dict = None,
+            progress_text: str = None,
+            credential_ref: str = "default",
+            owner: str = "default",
+    ) -> GenerationJobModel:
+        """Сохранить новую задачу генерации"""
+        job = GenerationJobModel(
+            tg_id=tg_id,
+            chat_id=chat_id,
+            status_message_id=status_message_id,
+            operation=operation,
+            params=params,
+            history_params=history_params,
+            progress_text=progress_text,
+            credential_ref=credential_ref,
+            owner=owner,
+            status=GenerationJobStatus.PENDING,
+        )
+        self.db_session.add(job)
+        await self.db_session.flush()
+        return job
+
+    async def get_unfinished(self, owner: str) -> List[GenerationJobModel]:
+        """Получить задачи экземпляра бота, которые не были доведены до конца (в порядке создания)"""
+        result = await self.db_session.execute(
+            select(GenerationJobModel)
+            .where(GenerationJobModel.owner == owner)
+            .where(GenerationJobModel.status.in_(GenerationJobStatus.UNFINISHED))
+            .order_by(GenerationJobModel.id)
+        )
+        return list(result.scalars().all())
+
+    async def set_status(
+            self,
+            job_id: int,
+            status: str,
+            history_id: Optional[int] = None,
+            error: Optional[str] = None,
+    ) -> None:
+        """Обновить статус задачи"""
+        values = {"status": status}
+        if history_id is not None:
+            values["history_id"] = history_id
+        if error is not None:
+            values["error"] = error
+        await self.db_session.execute(
+            update(GenerationJobModel)
+            .where(GenerationJobModel.id == job_id)
+            .values(**values)
+        )
+
+    async def claim_expired(self, job_id: int, tg_id: int, owner: str) -> Optional[GenerationJobModel]:
+        """
+        Вернуть просроченную задачу пользователя в ожидание (для повтора) и передать её экземпляру owner.
+        Статус меняется одним UPDATE, поэтому повторное нажатие кнопки не запустит задачу дважды.
+        """
+        result = await self.db_session.execute(
+            update(GenerationJobModel)
+            .where(GenerationJobModel.id == job_id)
+            .where(GenerationJobModel.tg_id == tg_id)
+            .where(GenerationJobModel.status == GenerationJobStatus.EXPIRED)
+            .values(status=GenerationJobStatus.PENDING, error=None, owner=owner)
+        )
+        if not result.rowcount:
+            return None
+        return await self.db_session.get(GenerationJobModel, job_id, populate_existing=True)
+
+    async def delete_finished_before(self, moment: datetime) -> int:
+        """Удалить завершённые задачи, созданные раньше указанного момента"""
+        result = await self.db_session.execute(
+            delete(GenerationJobModel)
+            .where(GenerationJobModel.status.in_(GenerationJobStatus.FINISHED))
+            .where(GenerationJobModel.created_at < moment)
+        )
+        return result.rowcount
@@ -1,14 +1,17 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import delete, update
 from datetime import datetime, date
 from typing import List
 import logging
 import re
 
 from database.models import UserNotificationModel
+from utils.tracing import traced_repository
 
 logger = logging.getLogger(__name__)
 
+@traced_repository
 class NotificationRepository:
     """Репозиторий для работы с уведомлениями"""
     
@@ -85,21 +88,15 @@ class NotificationRepository:
                 continue
         
         if notifications:
-            await self.db_session.commit()
+            await self.db_session.flush()
             
         return notifications
     
     async def remove_user_notifications(self, tg_id: int) -> bool:
         """Удалить все уведомления пользователя"""
-        result = await self.db_session.execute(
-            select(UserNotificationModel).where(UserNotificationModel.tg_id == tg_id)
+        await self.db_session.execute(
+            delete(UserNotificationModel).where(UserNotificationModel.tg_id == tg_id)
         )
-        notifications = result.scalars().all()
-        
-        for notification in notifications:
-            self.db_session.delete(notification)
-            
-        await self.db_session.commit()
         return True
     
     async def get_pending_notifications(self, current_datetime: datetime) -> List[UserNotificationModel]:
@@ -117,16 +114,11 @@ class NotificationRepository:
     async def mark_as_sent(self, notification_id: int) -> bool:
         """Отметить уведомление как отправленное"""
         result = await self.db_session.execute(
-            select(UserNotificationModel).where(UserNotificationModel.id == notification_id)
+            update(UserNotificationModel)
+            .where(UserNotificationModel.id == notification_id)
+            .values(sent=True, sent_at=datetime.now())
         )
-        notification = result.scalar_one_or_none()
-        
-        if notification:
-            notification.sent = True
-            notification.sent_at = datetime.now()
-            await self.db_session.commit()
-            return True
-        return False
+        return result.rowcount > 0
     
     async def get_user_notifications(self, tg_id: int) -> List[UserNotificationModel]:
         """Получить все уведомления пользователя (отсортированные по дате)"""
@@ -7,8 +7,11 @@ from sqlalchemy.orm import selectinload
 
 from config import config
 from database.models import UserModel
+from database.upsert import build_upsert
+from utils.tracing import traced_repository
 
 
+@traced_repository
 class UserRepository:
     def __init__(self, db_session: AsyncSession):
         self.db_session = db_session
@@ -25,25 +28,17 @@ class UserRepository:
         return result.scalar_one_or_none()
 
     async def create_user(self, tg_id: int) -> UserModel:
-        """Добавление пользователя в бд"""
-        existing_user = await self.db_session.execute(
-            select(UserModel).where(UserModel.tg_id == tg_id)
-        )
-        user = existing_user.scalar_one_or_none()
-        if user:
-            return user  # Возвращаем существующего
-
-        # Создаём нового пользователя
+        """Добавление пользователя в бд (если он уже есть — возвращается существующий без изменений)"""
         role = "admin" if tg_id in config.ADMIN_IDS else "guest"
-        new_user = UserModel(
-            tg_id=tg_id,
-            role=role,
-            access=role == "admin"
+        stmt = build_upsert(
+            self.db_session,
+            UserModel,
+            values={"tg_id": tg_id, "role": role, "access": role == "admin"},
+            conflict_columns=["tg_id"],
+            update_columns=[],  # существующего пользователя не трогаем
         )
-        self.db_session.add(new_user)
-        await self.db_session.commit()
-        await self.db_session.refresh(new_user)
-        return new_user
+        result = await self.db_session.scalars(stmt)
+        return result.one()
 
     async def set_access_and_role(
         self,
@@ -64,9 +59,7 @@ class UserRepository:
             .values(**values)
             .returning(UserModel)
         )
-        user = result.scalar_one()
-        await self.db_session.commit()
-        return user
+        return result.scalar_one()
 
     async def _update_access(self, tg_id: int, new_access: bool) -> bool:
         """Обновляет статус доступа и возвращает новое значение"""
@@ -77,7 +70,6 @@ class UserRepository:
             .returning(UserModel.access)
         )
         row = result.fetchone()
-        await self.db_session.commit()
 
         if row is None:
             raise ValueError(f"Пользователь с tg_id {tg_id} не найден")
@@ -101,7 +93,6 @@ class UserRepository:
             .returning(UserModel.access)
         )
         row = result.fetchone()
-        await self.db_session.commit()
 
         if row is None:
             raise ValueError(f"Пользователь с tg_id {tg_id} не найден")
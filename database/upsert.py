@@ -0,0 +1,49 @@
+from typing import Any, Iterable, Type
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Base
+
+
+# Диалекты, которые поддерживают INSERT ... ON CONFLICT ... RETURNING (SQLite >= 3.35 и PostgreSQL)
+_DIALECT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def build_upsert(
+        session: AsyncSession,
+        model: Type[Base],
+        values: dict[str, Any],
+        conflict_columns: Iterable[str],
+        update_columns: Iterable[str] | None = None,
+):
+    """
+    Формирует upsert-запрос (INSERT ... ON CONFLICT DO UPDATE ... RETURNING) для диалекта текущей БД.
+
+    :param session: Сессия, по движку которой определяется диалект
+    :param model: ORM-модель, в таблицу которой выполняется вставка
+    :param values: Значения для вставки
+    :param conflict_columns: Колонки уникального ограничения, по которому определяется конфликт
+    :param update_columns: Колонки, обновляемые при конфликте (по умолчанию — все из values, кроме конфликтных)
+    :return: Запрос, возвращающий ORM-объект модели
+    """
+    dialect_name = session.bind.dialect.name
+    insert = _DIALECT_INSERTS.get(dialect_name)
+    if insert is None:
+        raise NotImplementedError(f"Upsert не поддерживается для диалекта {dialect_name}")
+
+    conflict_columns = list(conflict_columns)
+    if update_columns is None:
+        update_columns = [column for column in values if column not in conflict_columns]
+    update_columns = list(update_columns)
+
+    stmt = insert(model).values(**values)
+    # Если обновлять нечего, делаем "пустое" обновление, чтобы RETURNING вернул существующую строку
+    set_ = {column: stmt.excluded[column] for column in (update_columns or conflict_columns)}
+    stmt = stmt.on_conflict_do_update(index_elements=conflict_columns, set_=set_)
+
+    # populate_existing обновляет объект в identity map, если он уже был загружен в этой сессии
+    return stmt.returning(model).execution_options(populate_existing=True)
@@ -1,6 +1,7 @@
 import logging
 
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
@@ -10,12 +11,16 @@ from keyboards.inline_keyboards import (
     access_admin_keyboard,
     access_nko_keyboard,
     access_link_inline_keyboard,
+    access_links_page_keyboard,
 )
+from utils.bot_identity import build_deeplink, get_bot_identity
 
 
 access_router = Router(name="Access links router")
 logger = logging.getLogger(__name__)
 
+LINKS_PAGE_SIZE = 5  # Ссылок на одной странице списка
+
 
 def _is_admin(user) -> bool:
     return bool(user and user.role == "admin")
@@ -33,10 +38,8 @@ async def _ensure_user(user_repo, tg_id: int):
 
 
 async def _build_deeplink(bot, code: str) -> str:
-    me = await bot.get_me()
-    if me.username:
-        return f"https://t.me/{me.username}?start={code}"
-    return code
+    # Данные бота берутся из кэша, а не запрашиваются у Bot API для каждой ссылки
+    return build_deeplink(await get_bot_identity(bot), code)
 
 
 def _format_link_info(link, include_creator: bool = False) -> str:
@@ -150,62 +153,84 @@ async def nko_create_link(message: Message, state: FSMContext, user_repo, access
     await state.clear()
 
 
-async def _send_links_list(
-    target_message,
-    links,
-    *,
-    show_creator: bool = False,
-):
+def _can_view_links(user, scope: str) -> bool:
+    """own — свои ссылки (НКО и администраторы), all — все активные ссылки (только администраторы)"""
+    return _is_admin(user) if scope == "all" else _is_nko(user)
+
+
+async def _load_links_page(access_repo, scope: str, user_id: int, page: int):
+    """Ссылки страницы page и признак того, что есть следующая страница"""
+    while True:
+        links = await access_repo.list_links(
+            created_by=None if scope == "all" else user_id,
+            only_active=scope == "all",
+            limit=LINKS_PAGE_SIZE + 1,  # Лишняя ссылка показывает, есть ли следующая страница
+            offset=page * LINKS_PAGE_SIZE,
+        )
+        # Страница могла опустеть (например, после отключения последней ссылки в списке активных)
+        if links or page == 0:
+            return links[:LINKS_PAGE_SIZE], len(links) > LINKS_PAGE_SIZE, page
+        page -= 1
+
+
+async def _render_links_page(bot, access_repo, scope: str, user_id: int, page: int):
+    """Текст и клавиатура страницы списка ссылок: все ссылки страницы в одном сообщении"""
+    links, has_next, page = await _load_links_page(access_repo, scope, user_id, page)
     if not links:
-        await target_message.answer("Ссылок пока нет.")
-        return
+        return "Ссылок пока нет.", None
 
-    for link in links:
-        deeplink = await _build_deeplink(target_message.bot, link.code)
-        text = _format_link_info(link, include_creator=show_creator)
-        text = f"{text}\n{deeplink}"
-        keyboard = access_link_inline_keyboard(link.id, link.is_active)
-        await target_message.answer(text, reply_markup=keyboard)
+    identity = await get_bot_identity(bot)
+    blocks = [
+        f"<b>{number}.</b> {_format_link_info(link, include_creator=scope == 'all')}\n"
+        f"{build_deeplink(identity, link.code)}"
+        for number, link in enumerate(links, start=1)
+    ]
+    title = "🔗 Все активные ссылки" if scope == "all" else "🔗 Ваши ссылки"
+    text = f"{title} (страница {page + 1}):\n\n" + "\n\n".join(blocks)
+    return text, access_links_page_keyboard(links, scope, page, has_next)
 
 
-@access_router.callback_query(F.data == "access_admin_list")
-async def admin_list_links(cb: CallbackQuery, user_repo, access_repo):
+async def _show_links_page(cb: CallbackQuery, user_repo, access_repo, scope: str, page: int = 0,
+                           edit: bool = False, notice: str = None):
+    """Показать страницу списка ссылок новым сообщением или (edit=True) на месте текущего"""
     user = await _ensure_user(user_repo, cb.from_user.id)
-    if not _is_admin(user):
+    if not _can_view_links(user, scope):
         await cb.answer("Недостаточно прав", show_alert=True)
         return
 
-    links = await access_repo.list_links(created_by=cb.from_user.id, limit=20)
-    await _send_links_list(cb.message, links)
-    await cb.answer()
+    text, keyboard = await _render_links_page(cb.message.bot, access_repo, scope, cb.from_user.id, page)
+    if edit:
+        try:
+            await cb.message.edit_text(text, reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            # Содержимое страницы не изменилось — редактировать нечего
+            if "message is not modified" not in str(e):
+                raise
+    else:
+        await cb.message.answer(text, reply_markup=keyboard)
+    await cb.answer(notice)
+
+
+@access_router.callback_query(F.data.in_({"access_admin_list", "access_nko_list"}))
+async def own_links_list(cb: CallbackQuery, user_repo, access_repo):
+    await _show_links_page(cb, user_repo, access_repo, scope="own")
 
 
 @access_router.callback_query(F.data == "access_admin_list_all")
 async def admin_list_all_links(cb: CallbackQuery, user_repo, access_repo):
-    user = await _ensure_user(user_repo, cb.from_user.id)
-    if not _is_admin(user):
-        await cb.answer("Недостаточно прав", show_alert=True)
-        return
-    links = await access_repo.list_links(created_by=None, only_active=True, limit=20)
-    await _send_links_list(cb.message, links, show_creator=True)
-    await cb.answer()
-
+    await _show_links_page(cb, user_repo, access_repo, scope="all")
 
-@access_router.callback_query(F.data == "access_nko_list")
-async def nko_list_links(cb: CallbackQuery, user_repo, access_repo):
-    user = await _ensure_user(user_repo, cb.from_user.id)
-    if not _is_nko(user):
-        await cb.answer("Недостаточно прав", show_alert=True)
-        return
 
-    links = await access_repo.list_links(created_by=cb.from_user.id, limit=20)
-    await _send_links_list(cb.message, links)
-    await cb.answer()
+@access_router.callback_query(F.data.startswith("access_page:"))
+async def links_page(cb: CallbackQuery, user_repo, access_repo):
+    _, scope, page = cb.data.split(":")
+    await _show_links_page(cb, user_repo, access_repo, scope=scope, page=max(0, int(page)), edit=True)
 
 
 @access_router.callback_query(F.data.startswith("access_toggle:"))
 async def toggle_link(cb: CallbackQuery, user_repo, access_repo):
-    _, link_id, action = cb.data.split(":")
+    # access_toggle:<id>:<on|off>:<scope>:<page> — кнопка списка; без scope и page — кнопка старого сообщения об одной ссылке
+    _, link_id, action, *page_info = cb.data.split(":")
     link = await access_repo.get_by_id(int(link_id))
     if not link:
         await cb.answer("Ссылка не найдена", show_alert=True)
@@ -219,6 +244,11 @@ async def toggle_link(cb: CallbackQuery, user_repo, access_repo):
     desired_state = action == "on"
     link = await access_repo.toggle_link(link, desired_state)
     status = "активирована" if desired_state else "отключена"
+    if page_info:
+        scope, page = page_info
+        await _show_links_page(cb, user_repo, access_repo, scope=scope, page=int(page), edit=True,
+                               notice=f"Ссылка {status}")
+        return
     await cb.answer(f"Ссылка {status}")
     await cb.message.edit_reply_markup(
         reply_markup=access_link_inline_keyboard(link.id, link.is_active)
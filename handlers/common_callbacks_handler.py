@@ -9,9 +9,12 @@ import texts
 from fsm import ContentPlanState
 from keyboards import reply_kb
 from handlers.utils import build_user_main_keyboard
-from keyboards.inline_keyboards import get_regenerate_keyboard, get_accept_plan_keyboard, get_unaccept_plan_keyboard, get_daily_post_keyboard
+from keyboards.inline_keyboards import get_regenerate_keyboard, get_accept_plan_keyboard, get_unaccept_plan_keyboard, get_daily_post_keyboard, get_retry_keyboard
 from ai_service.gigachat_ai_service import get_gigachat_service
-from utils.generation_queue import get_generation_queue
+from utils.admission import GenerationRejected
+from utils.generation_jobs import RETRY_CALLBACK_PREFIX, retry_generation_job
+from utils.generation_queue import get_generation_queue, GenerationCancelled, GenerationExpired
+from utils.queue_progress import queue_status_updates
 
 
 gigachat_service = get_gigachat_service()
@@ -32,7 +35,7 @@ async def api_instruction(cb: CallbackQuery):
     await cb.message.answer(texts.API_HELP_TEXT)
     await cb.answer()
 
-@cb_router.callback_query(F.data.startswith("regenerate_"))
+@cb_router.callback_query(F.data.startswith("regenerate_"), flags={"generation": "regenerate"})
 async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo, ai_api_repo, user_repo):
     """Пересоздание контента"""
     try:
@@ -46,7 +49,7 @@ async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo,
         user_api_key = user_api.api_key if user_api and user_api.connected else None
 
         queue = get_generation_queue(user_api_key)
-        pending_tasks = queue.get_pending_tasks_count()
+        pending_tasks = await queue.count_pending_tasks()
         if pending_tasks > 0:
             queue_message = (
                 f"⏳ Ваш запрос поставлен в очередь (позиция: {pending_tasks + 1}). "
@@ -76,39 +79,43 @@ async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo,
         new_result = None
         regenerate_button = get_regenerate_keyboard(history_id)  # Это InlineKeyboard
 
-        # Создаём новую запись для пересозданного контента
-        new_history_entry = await content_history_repo.add_content_history(
-            tg_id=cb.from_user.id,
-            content_type=history_entry.content_type,
-            prompt=history_entry.prompt,
-            model=history_entry.model,
-            style=history_entry.style,
-            result=None,  # Результат будет добавлен позже
-            additional_params={
-                **(history_entry.additional_params or {}),
-                "regenerated_from": history_id  # Ссылка на оригинальную запись
-            }
-        )
-        
+        async def save_regenerated(result, extra_params=None):
+            """Создаёт запись для пересозданного контента — одна вставка уже с результатом генерации"""
+            return await content_history_repo.add_content_history(
+                tg_id=cb.from_user.id,
+                content_type=history_entry.content_type,
+                prompt=history_entry.prompt,
+                model=history_entry.model,
+                style=history_entry.style,
+                result=result,
+                additional_params={
+                    **(history_entry.additional_params or {}),
+                    **(extra_params or {}),
+                    "regenerated_from": history_id  # Ссылка на оригинальную запись
+                }
+            )
+
         if content_type == "text_generation" and history_entry.additional_params:
             style = history_entry.additional_params.get('style', '')
             description = history_entry.additional_params.get('description', history_entry.prompt)
             prompt_with_style = f"{description} (в {style} стиле)" if style else description
 
-            new_result, _ = await gigachat_service.generate_free_text(
-                user_idea=prompt_with_style,
-                nko_data=nko_data,
-                user_api_key=user_api_key
-            )
+            with queue_status_updates(cb.message.bot, cb.message.chat.id, cb.message.message_id):
+                new_result, _ = await gigachat_service.generate_free_text(
+                    user_idea=prompt_with_style,
+                    nko_data=nko_data,
+                    user_api_key=user_api_key
+                )
 
         elif content_type == "content_plan" and history_entry.additional_params:
-            new_result, _ = await gigachat_service.generate_content_plan(
-                period=history_entry.additional_params.get('period', 'неделя'),
-                frequency=history_entry.additional_params.get('frequency', 'ежедневно'),
-                nko_data=nko_data,
-                user_goal=history_entry.additional_params.get('user_goal'),  # Передаем user_goal если он был
-                user_api_key=user_api_key
-            )
+            with queue_status_updates(cb.message.bot, cb.message.chat.id, cb.message.message_id):
+                new_result, _ = await gigachat_service.generate_content_plan(
+                    period=history_entry.additional_params.get('period', 'неделя'),
+                    frequency=history_entry.additional_params.get('frequency', 'ежедневно'),
+                    nko_data=nko_data,
+                    user_goal=history_entry.additional_params.get('user_goal'),  # Передаем user_goal если он был
+                    user_api_key=user_api_key
+                )
 
         elif content_type == "image_generation":
             # Удаляем старое сообщение с изображением
@@ -135,33 +142,52 @@ async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo,
 
             # Генерируем изображение
             try:
-                success, new_result, _ = await gigachat_service.generate_image(
-                    prompt=prompt_to_use,
-                    style=style_to_use,
-                    credentials=user_api_key
-                )
+                with queue_status_updates(wait_msg.bot, wait_msg.chat.id, wait_msg.message_id):
+                    success, new_result, _ = await gigachat_service.generate_image(
+                        prompt=prompt_to_use,
+                        style=style_to_use,
+                        credentials=user_api_key
+                    )
                 if not success:
                     # new_result содержит сообщение об ошибке (может быть специальное сообщение для 429 или таймаута)
                     error_message = new_result if isinstance(new_result, str) else "❌ Не удалось создать изображение. Попробуйте позже или уточните запрос."
+                    # Запись без результата сохраняем - она может быть полезна для отладки
+                    await save_regenerated(None)
                     await wait_msg.edit_text(
                         error_message,
                         reply_markup=regenerate_button
                     )
-                    # НЕ удаляем запись из истории - она может быть полезна для отладки
-                    # await content_history_repo.db_session.delete(new_history_entry)
-                    # await content_history_repo.db_session.commit()
                     return
+            except GenerationCancelled:
+                # Сообщение могло быть удалено (из-за этого задача и отменена) — тогда сообщать некуда
+                try:
+                    await wait_msg.edit_text("🚫 Генерация отменена.")
+                except Exception:
+                    pass
+                return
+            except GenerationExpired as e:
+                # Сообщение с изображением уже удалено — кнопку повтора получает статус-сообщение
+                await wait_msg.edit_text(str(e), reply_markup=get_retry_keyboard(cb.data))
+                return
             except Exception as img_exc:
                 logger.error(f"Ошибка генерации изображения: {img_exc}", exc_info=True)
+                await save_regenerated(None)
                 await wait_msg.edit_text(
                     "❌ Не удалось создать изображение. Попробуйте позже или уточните запрос.",
                     reply_markup=regenerate_button
                 )
-                # НЕ удаляем запись из истории - она может быть полезна для отладки
-                # await content_history_repo.db_session.delete(new_history_entry)
-                # await content_history_repo.db_session.commit()
                 return
 
+            # Сохраняем промт и стиль в новой записи для возможности дальнейшей перегенерации
+            image_params = None
+            if history_entry.additional_params:
+                image_params = {
+                    "original_prompt": history_entry.additional_params.get('original_prompt', history_entry.prompt),
+                    "final_prompt": prompt_to_use,
+                    "style": style_to_use
+                }
+            new_history_entry = await save_regenerated(None, image_params)
+
             await wait_msg.delete()
             
             # Отправляем изображение
@@ -171,45 +197,34 @@ async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo,
                 reply_markup=get_regenerate_keyboard(new_history_entry.id)
             )
             
-            # Сохраняем file_id и коммитим
+            # Сохраняем file_id (запишется тем же commit в конце обработки)
             if sent_message.photo and len(sent_message.photo) > 0:
                 new_history_entry.result = sent_message.photo[-1].file_id
             else:
                 logger.error("Не удалось получить file_id из отправленного фото")
                 new_history_entry.result = "Ошибка сохранения изображения"
-            # Сохраняем промт и стиль в новой записи для возможности дальнейшей перегенерации
-            if history_entry.additional_params:
-                new_history_entry.additional_params = {
-                    **history_entry.additional_params,
-                    "original_prompt": history_entry.additional_params.get('original_prompt', history_entry.prompt),
-                    "final_prompt": prompt_to_use,
-                    "style": style_to_use
-                }
-            await content_history_repo.db_session.commit()
             
             os.remove(new_result) # Удаляем временный файл
             return
 
         else:
             # Для других типов контента
-            if content_type == "text_edit":
-                new_result, _ = await gigachat_service.edit_text(
-                    text=history_entry.additional_params.get('original_text', history_entry.prompt),
-                    user_api_key=user_api_key
-                )
-            else:
-                new_result, _ = await gigachat_service.generate_free_text(
-                    user_idea=history_entry.prompt,
-                    nko_data=nko_data,
-                    user_api_key=user_api_key
-                )
+            with queue_status_updates(cb.message.bot, cb.message.chat.id, cb.message.message_id):
+                if content_type == "text_edit":
+                    new_result, _ = await gigachat_service.edit_text(
+                        text=history_entry.additional_params.get('original_text', history_entry.prompt),
+                        user_api_key=user_api_key
+                    )
+                else:
+                    new_result, _ = await gigachat_service.generate_free_text(
+                        user_idea=history_entry.prompt,
+                        nko_data=nko_data,
+                        user_api_key=user_api_key
+                    )
 
-        # Сохраняем и редактируем текст
+        # Сохраняем и редактируем текст (запись пересозданного контента создаётся одной вставкой)
+        new_history_entry = await save_regenerated(new_result or None)
         if new_result:
-            # Обновляем результат для новой записи
-            new_history_entry.result = new_result
-            await content_history_repo.db_session.commit()
-            
             # Для контент-плана используем клавиатуру с кнопкой принятия плана
             if content_type == "content_plan":
                 new_keyboard = get_accept_plan_keyboard(new_history_entry.id)
@@ -228,9 +243,7 @@ async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo,
                     reply_markup=new_keyboard
                 )
         else:
-            # Если перегенерация не удалась, НЕ удаляем запись - она может быть полезна для отладки
-            # await content_history_repo.db_session.delete(new_history_entry)
-            # await content_history_repo.db_session.commit()
+            # Если перегенерация не удалась, запись без результата всё равно сохраняем - она может быть полезна для отладки
             await cb.message.edit_text(
                 "❌ Не удалось пересоздать контент. Попробуйте позже.",
                 reply_markup=regenerate_button
@@ -238,6 +251,17 @@ async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo,
 
     except ValueError:
         await cb.message.edit_text("⚠️ Некорректный идентификатор записи.")
+    except GenerationRejected as e:
+        await cb.message.answer(str(e))
+    except GenerationCancelled:
+        # Пересоздание отменено пользователем — сообщать об ошибке не нужно
+        pass
+    except GenerationExpired as e:
+        # Кнопка повторяет тот же запрос
+        try:
+            await cb.message.edit_text(str(e), reply_markup=get_retry_keyboard(cb.data))
+        except Exception:
+            await cb.message.answer(str(e), reply_markup=get_retry_keyboard(cb.data))
     except Exception as e:
         logger.error(f"Ошибка при пересоздании контента: {e}")
         keyboard = await build_user_main_keyboard(user_repo, cb.from_user.id)
@@ -254,6 +278,22 @@ async def regenerate_content(cb: CallbackQuery, nko_repo, content_history_repo,
             reply_markup=keyboard
         )
 
+@cb_router.callback_query(F.data.startswith(RETRY_CALLBACK_PREFIX), flags={"generation": "retry"})
+async def retry_expired_generation(cb: CallbackQuery):
+    """Повтор сохранённой задачи генерации, которая не уложилась в крайний срок"""
+    await cb.answer()
+    try:
+        job_id = int(cb.data.removeprefix(RETRY_CALLBACK_PREFIX))
+    except ValueError:
+        return
+    try:
+        await cb.message.edit_text("🔁 Повторяю запрос, ожидайте...", reply_markup=None)
+    except Exception:
+        pass
+    if not await retry_generation_job(cb.bot, job_id, cb.from_user.id):
+        await cb.message.edit_text("⚠️ Этот запрос уже нельзя повторить. Отправьте его заново.")
+
+
 @cb_router.callback_query(F.data == "accept_content_plan")
 async def accept_content_plan(cb: CallbackQuery, content_plan_repo, notification_repo, user_repo):
     """Обработка принятия контент-плана"""
@@ -386,7 +426,7 @@ async def unaccept_content_plan(cb: CallbackQuery, content_plan_repo, notificati
         )
 
 
-@cb_router.callback_query(F.data == "generate_daily_post")
+@cb_router.callback_query(F.data == "generate_daily_post", flags={"generation": "daily_post"})
 async def generate_daily_post(cb: CallbackQuery, nko_repo, content_history_repo, ai_api_repo):
     """Генерация поста на тему из уведомления контент-плана"""
     try:
@@ -427,7 +467,7 @@ async def generate_daily_post(cb: CallbackQuery, nko_repo, content_history_repo,
         
         # Проверяем размер очереди перед генерацией
         queue = get_generation_queue(user_api_key)
-        pending_tasks = queue.get_pending_tasks_count()
+        pending_tasks = await queue.count_pending_tasks()
         
         # Отправляем сообщение о начале генерации
         if pending_tasks > 0:
@@ -446,12 +486,13 @@ async def generate_daily_post(cb: CallbackQuery, nko_repo, content_history_repo,
                 pass
         
         # Генерируем пост на основе темы
-        result, position = await gigachat_service.generate_free_text(
-            user_idea=topic,
-            nko_data=nko_data,
-            user_api_key=user_api_key,
-            on_start_callback=update_message
-        )
+        with queue_status_updates(msg.bot, msg.chat.id, msg.message_id):
+            result, position = await gigachat_service.generate_free_text(
+                user_idea=topic,
+                nko_data=nko_data,
+                user_api_key=user_api_key,
+                on_start_callback=update_message
+            )
         
         # Сохраняем в историю
         history_entry = await content_history_repo.add_content_history(
@@ -479,6 +520,13 @@ async def generate_daily_post(cb: CallbackQuery, nko_repo, content_history_repo,
                 reply_markup=get_regenerate_keyboard(history_entry.id)
             )
         
+    except GenerationRejected as e:
+        await msg.edit_text(str(e))
+    except GenerationCancelled:
+        await msg.edit_text("🚫 Генерация отменена.")
+    except GenerationExpired as e:
+        # Тема берётся из текста уведомления, поэтому повторять нужно кнопкой под ним
+        await msg.edit_text(f"{e}\n\nЧтобы повторить, нажмите кнопку под уведомлением ещё раз.")
     except Exception as e:
         logger.error(f"Ошибка при генерации поста из уведомления: {e}", exc_info=True)
         await cb.message.answer("❌ Произошла ошибка при генерации поста. Попробуйте позже.")
@@ -2,12 +2,13 @@ import logging
 
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message
-from aiogram.filters import Command, CommandStart
+from aiogram.types import ChatMemberUpdated, Message
+from aiogram.filters import KICKED, ChatMemberUpdatedFilter, Command, CommandStart
 
 import texts
 from keyboards import reply_kb,inline_kb
 from handlers.utils import should_show_access_button, build_user_main_keyboard
+from utils.generation_queue import cancel_generations
 
 
 msg_router = Router(name="Message router")
@@ -75,11 +76,17 @@ async def help_cmd(message: Message):
 
 @msg_router.message(Command("отмена","cancel"))
 async def cancel_cmd(message: Message, state: FSMContext, user_repo):
-    """Обработка команды отмена"""
+    """Обработка команды отмена: сброс ввода и отмена запросов на генерацию, которые ещё не выполнены"""
+    cancelled = cancel_generations(message.from_user.id)
     keyboard = await build_user_main_keyboard(user_repo, message.from_user.id)
-    await message.answer("Ввод отменен",reply_markup=keyboard)
+    await message.answer("Ввод и генерация отменены" if cancelled else "Ввод отменен", reply_markup=keyboard)
     await state.clear()
 
+@msg_router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=KICKED))
+async def bot_blocked(event: ChatMemberUpdated):
+    """Пользователь заблокировал бота или удалил чат — его генерации больше некому показать"""
+    cancel_generations(event.from_user.id)
+
 @msg_router.message(Command("menu","меню"))
 async def menu_cmd(message: Message, user_repo):
     """Обработка команды меню"""
@@ -129,7 +136,7 @@ async def test_notifications_cmd(message: Message, notification_repo):
     
     try:
         # Создаем временный экземпляр ScheduledNotifications для отправки уведомлений
-        scheduler = ScheduledNotifications(notification_repo)
+        scheduler = ScheduledNotifications(bot=message.bot, notification_repo=notification_repo)
         
         # Отправляем уведомления
         await scheduler.send_daily_notifications()
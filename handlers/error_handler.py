@@ -4,10 +4,49 @@ from aiogram import Router
 from aiogram.types import ErrorEvent
 from aiogram.filters import ExceptionTypeFilter
 
+from utils.admission import GenerationRejected
+from keyboards.inline_keyboards import get_retry_keyboard
+from utils.generation_queue import GenerationCancelled, GenerationExpired
+
 
 errors_router = Router(name="Error router")
 logger = logging.getLogger(__name__)
 
+@errors_router.errors(ExceptionTypeFilter(GenerationRejected))
+async def handle_generation_rejected(event: ErrorEvent):
+    """Запрос на генерацию отклонён квотами — сообщаем пользователю причину"""
+    update = event.update
+    try:
+        if update.callback_query:
+            await update.callback_query.answer()
+            if update.callback_query.message:
+                await update.callback_query.message.answer(str(event.exception))
+        elif update.message:
+            await update.message.answer(str(event.exception))
+    except Exception as e:
+        logger.warning("Не удалось сообщить об отклонённом запросе: %s", e)
+
+@errors_router.errors(ExceptionTypeFilter(GenerationCancelled))
+async def handle_generation_cancelled(event: ErrorEvent):
+    """Генерация отменена (/cancel или более новый запрос) — это не ошибка, пользователю сообщать нечего"""
+    logger.info("Обработка обновления %s прервана: генерация отменена", event.update.update_id)
+
+@errors_router.errors(ExceptionTypeFilter(GenerationExpired))
+async def handle_generation_expired(event: ErrorEvent):
+    """Генерация не уложилась в крайний срок — сообщаем и (для кнопок) предлагаем повторить тот же запрос"""
+    update = event.update
+    try:
+        if update.callback_query:
+            await update.callback_query.answer()
+            if update.callback_query.message:
+                await update.callback_query.message.answer(
+                    str(event.exception), reply_markup=get_retry_keyboard(update.callback_query.data)
+                )
+        elif update.message:
+            await update.message.answer(f"{event.exception}\n\nОтправьте запрос ещё раз.")
+    except Exception as e:
+        logger.warning("Не удалось сообщить о просроченном запросе: %s", e)
+
 @errors_router.errors(ExceptionTypeFilter(Exception))
 async def handle_unexpected_error(event: ErrorEvent):
     """Глобальный обработчик непредвиденных ошибок."""
@@ -6,6 +6,7 @@ from fsm import ContentPlanState
 from keyboards.inline_keyboards import get_regenerate_keyboard, content_plan_type_keyboard, get_accept_plan_keyboard, \
     nko_add_info_keyboard
 from utils.generation_queue import get_generation_queue
+from utils.queue_progress import queue_status_updates
 
 cp_router = Router(name="AI Content Plan Router")
 
@@ -62,7 +63,7 @@ async def frequency_entered(message: Message, state: FSMContext):
     await state.set_state(ContentPlanState.choosing_plan_type)
 
 
-@cp_router.callback_query(F.data == "content_plan_from_data")
+@cp_router.callback_query(F.data == "content_plan_from_data", flags={"generation": "content_plan"})
 async def plan_from_data_selected(cb: CallbackQuery, state: FSMContext, nko_repo, content_history_repo, ai_api_repo,
                                   gigachat_service):
     """Обработка выбора создания плана на основе данных НКО"""
@@ -79,7 +80,7 @@ async def plan_from_data_selected(cb: CallbackQuery, state: FSMContext, nko_repo
     if nko_data and nko_data.name:
         # Проверяем размер очереди перед генерацией
         queue = get_generation_queue(user_api_key)
-        pending_tasks = queue.get_pending_tasks_count()
+        pending_tasks = await queue.count_pending_tasks()
         
         # Показываем статус генерации ПЕРЕД началом генерации
         if pending_tasks > 0:
@@ -98,13 +99,14 @@ async def plan_from_data_selected(cb: CallbackQuery, state: FSMContext, nko_repo
                 pass
         
         # Используем данные НКО для генерации плана
-        result, position = await gigachat_service.generate_content_plan(
-            period=data["period"],
-            frequency=data["frequency"],
-            nko_data=nko_data,
-            user_api_key=user_api_key,  # Используем ключ по умолчанию
-            on_start_callback=update_message
-        )
+        with queue_status_updates(msg.bot, msg.chat.id, msg.message_id):
+            result, position = await gigachat_service.generate_content_plan(
+                period=data["period"],
+                frequency=data["frequency"],
+                nko_data=nko_data,
+                user_api_key=user_api_key,  # Используем ключ по умолчанию
+                on_start_callback=update_message
+            )
 
         # Сохраняем результат в историю
         history_entry = await content_history_repo.add_content_history(
@@ -141,7 +143,7 @@ async def plan_with_goal_selected(cb: CallbackQuery, state: FSMContext):
     await state.set_state(ContentPlanState.entering_goal)
 
 
-@cp_router.message(ContentPlanState.entering_goal)
+@cp_router.message(ContentPlanState.entering_goal, flags={"generation": "content_plan"})
 async def goal_entered(message: Message, state: FSMContext, nko_repo, content_history_repo, ai_api_repo,
                        gigachat_service):
     """Обработка введенной цели контент-плана"""
@@ -155,7 +157,7 @@ async def goal_entered(message: Message, state: FSMContext, nko_repo, content_hi
 
     # Проверяем размер очереди перед генерацией
     queue = get_generation_queue(user_api_key)
-    pending_tasks = queue.get_pending_tasks_count()
+    pending_tasks = await queue.count_pending_tasks()
     
     # Показываем статус генерации ПЕРЕД началом генерации
     if pending_tasks > 0:
@@ -174,14 +176,15 @@ async def goal_entered(message: Message, state: FSMContext, nko_repo, content_hi
             pass
     
     # Генерируем контент-план с учетом цели
-    result, position = await gigachat_service.generate_content_plan(
-        period=data["period"],
-        frequency=data["frequency"],
-        nko_data=nko_data,
-        user_goal=data["goal"],
-        user_api_key=user_api_key,  # Используем ключ по умолчанию
-        on_start_callback=update_message
-    )
+    with queue_status_updates(msg.bot, msg.chat.id, msg.message_id):
+        result, position = await gigachat_service.generate_content_plan(
+            period=data["period"],
+            frequency=data["frequency"],
+            nko_data=nko_data,
+            user_goal=data["goal"],
+            user_api_key=user_api_key,  # Используем ключ по умолчанию
+            on_start_callback=update_message
+        )
 
     # Сохраняем результат в историю
     history_entry = await content_history_repo.add_content_history(
@@ -6,7 +6,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.filters import StateFilter
 
 from fsm import TextFromExamplesState
-from keyboards.inline_keyboards import get_regenerate_keyboard
+from utils.generation_jobs import run_generation_job, nko_snapshot
 from utils.generation_queue import get_generation_queue
 
 
@@ -28,7 +28,7 @@ async def handle_forwarded_message(message: Message, state: FSMContext):
     await state.set_state(TextFromExamplesState.entering_new_idea)
     await state.update_data(examples=[text.strip()])
     
-    logger.info(f"Пересланное сообщение сохранено как пример: {text[:50]}...")
+    logger.info("Пересланное сообщение сохранено как пример (%d символов)", len(text))
 
     await message.answer("✅ Пример получен. Введите идею для нового поста:")
 
@@ -53,9 +53,8 @@ async def examples_entered(message: Message, state: FSMContext):
     await message.answer("Введите идею для нового поста:")
     await state.set_state(TextFromExamplesState.entering_new_idea)
 
-@examples_gen_router.message(TextFromExamplesState.entering_new_idea)
-async def new_idea_entered(message: Message, state: FSMContext, nko_repo,
-                           content_history_repo, ai_api_repo, gigachat_service):
+@examples_gen_router.message(TextFromExamplesState.entering_new_idea, flags={"generation": "text_from_examples"})
+async def new_idea_entered(message: Message, state: FSMContext, nko_repo, ai_api_repo):
     """Обработка новой идеи и генерация поста по аналогии с примерами"""
     await state.update_data(new_idea=message.text)
     
@@ -67,7 +66,8 @@ async def new_idea_entered(message: Message, state: FSMContext, nko_repo,
         await state.clear()
         return
     
-    logger.info(f"Генерация поста на основе примеров: {len(data['examples'])} пример(ов), идея: {data['new_idea'][:50]}...")
+    logger.info("Генерация поста на основе примеров: %d пример(ов), идея: %d символов",
+                len(data['examples']), len(data['new_idea']))
     
     # Получаем данные НКО пользователя
     nko_data = await nko_repo.get_nko_data(message.from_user.id)
@@ -78,7 +78,7 @@ async def new_idea_entered(message: Message, state: FSMContext, nko_repo,
 
     # Информируем пользователя о статусе очереди
     queue = get_generation_queue(user_api_key)
-    queue_load = queue.get_pending_tasks_count()
+    queue_load = await queue.count_pending_tasks()
     if queue_load > 0:
         status_msg = await message.answer(
             f"⏳ Ваш запрос поставлен в очередь (позиция: {queue_load + 1}). "
@@ -88,42 +88,22 @@ async def new_idea_entered(message: Message, state: FSMContext, nko_repo,
         status_msg = await message.answer("✨ Генерирую пост по вашим примерам... Пожалуйста, подождите🔄️")
 
     # Генерируем пост по аналогии с примерами
-    try:
-        result = await gigachat_service.generate_text_from_examples(
-            example_posts=data["examples"],
-            new_idea=data["new_idea"],
-            user_api_key=user_api_key,
-            nko_data=nko_data
-        )
-    except Exception as e:
-        logger.error(f"Ошибка при генерации текста по примерам: {e}", exc_info=True)
-        await status_msg.edit_text("❌ Не удалось сгенерировать текст. Попробуйте позже.")
-        await state.clear()
-        return
-
-    # Сохраняем в историю
-    history_entry = await content_history_repo.add_content_history(
+    await run_generation_job(
+        bot=message.bot,
         tg_id=message.from_user.id,
-        content_type="text_from_examples",
-        prompt=f"Примеры: {data['examples']}, Новая идея: {data['new_idea']}",
-        result=result,
-        model="gigachat",
-        additional_params={
-            "examples": data["examples"],
-            "new_idea": data["new_idea"]
-        }
+        status_message=status_msg,
+        operation="text_from_examples",
+        params={"examples": data["examples"], "new_idea": data["new_idea"], "nko": nko_snapshot(nko_data)},
+        history_params={
+            "content_type": "text_from_examples",
+            "prompt": f"Примеры: {data['examples']}, Новая идея: {data['new_idea']}",
+            "additional_params": {
+                "examples": data["examples"],
+                "new_idea": data["new_idea"]
+            }
+        },
+        user_api_key=user_api_key,
+        progress_text="✨ Генерирую пост по вашим примерам... Пожалуйста, подождите🔄️"
     )
-
-    # Создаем инлайн-кнопку для перегенерации с ID записи
-    regenerate_keyboard = get_regenerate_keyboard(history_entry.id)
-
-    # Отправляем результат с кнопкой перегенерации
-    try:
-        await status_msg.edit_text(result, parse_mode="Markdown", reply_markup=regenerate_keyboard)
-    except:
-        if result:
-            await status_msg.edit_text(result, reply_markup=regenerate_keyboard)
-        else:
-            await status_msg.edit_text("Не удалось сгенерировать текст")
     
-    await state.clear()
\ No newline at end of file
+    await state.clear()
@@ -10,6 +10,7 @@ from keyboards.inline_keyboards import get_regenerate_keyboard, image_style_keyb
 from fsm import ImageGenerationState
 from texts import IMAGE_PROMPT_ENHANCEMENT
 from utils.generation_queue import get_generation_queue
+from utils.queue_progress import queue_status_updates
 
 
 image_gen_router = Router(name="API image generation")
@@ -55,7 +56,7 @@ async def prompt_original_selected(cb: CallbackQuery, state: FSMContext):
     await cb.message.answer("Выберите стиль для генерации изображения:", reply_markup=image_style_keyboard)
     await state.set_state(ImageGenerationState.style_selection)
 
-@image_gen_router.callback_query(ImageGenerationState.choosing_improvement, F.data == "image_prompt_enhance")
+@image_gen_router.callback_query(ImageGenerationState.choosing_improvement, F.data == "image_prompt_enhance", flags={"generation": "enhance_prompt"})
 async def prompt_enhance_selected(cb: CallbackQuery, state: FSMContext, ai_api_repo, gigachat_service):
     """Пользователь выбрал улучшить промт с помощью ИИ"""
     await cb.answer()
@@ -95,7 +96,7 @@ async def prompt_enhance_selected(cb: CallbackQuery, state: FSMContext, ai_api_r
     # Переходим к выбору стиля
     await state.set_state(ImageGenerationState.style_selection)
 
-@image_gen_router.callback_query(ImageGenerationState.style_selection, F.data.startswith("image_"))
+@image_gen_router.callback_query(ImageGenerationState.style_selection, F.data.startswith("image_"), flags={"generation": "image"})
 async def style_selected(cb: CallbackQuery, state: FSMContext, ai_api_repo, gigachat_service, content_history_repo):
     try:
         style = cb.data.split("_")[1]
@@ -114,7 +115,7 @@ async def style_selected(cb: CallbackQuery, state: FSMContext, ai_api_repo, giga
 
     # Проверяем размер очереди перед генерацией
     queue = get_generation_queue(user_api_key)
-    pending_tasks = queue.get_pending_tasks_count()
+    pending_tasks = await queue.count_pending_tasks()
     
     # Отправляем сообщение о начале генерации
     if pending_tasks > 0:
@@ -127,18 +128,17 @@ async def style_selected(cb: CallbackQuery, state: FSMContext, ai_api_repo, giga
     
     # Callback для обновления сообщения при начале обработки
     async def update_message():
-        try:
-            await msg.edit_text("Создаю изображение... Это может занять до 30 секунд. Подождите, пожалуйста... ⏳")
-        except:
-            pass
+        # Ошибки не глушим: если статус-сообщение удалено, очередь отменит задачу
+        await msg.edit_text("Создаю изображение... Это может занять до 30 секунд. Подождите, пожалуйста... ⏳")
 
     # Генерируем изображение
-    success, image_url, position = await gigachat_service.generate_image(
-        prompt=final_prompt, 
-        style=style, 
-        credentials=user_api_key,
-        on_start_callback=update_message
-    )
+    with queue_status_updates(msg.bot, msg.chat.id, msg.message_id):
+        success, image_url, position = await gigachat_service.generate_image(
+            prompt=final_prompt, 
+            style=style, 
+            credentials=user_api_key,
+            on_start_callback=update_message
+        )
 
     try:
         if success and image_url:
@@ -4,25 +4,23 @@ from aiogram import F, Router
 from aiogram.filters import StateFilter
 from aiogram.types import Message
 
-from keyboards.inline_keyboards import get_regenerate_keyboard
+from utils.generation_jobs import run_generation_job, nko_snapshot
 from utils.generation_queue import get_generation_queue
 
 
-onmsg_router = Router()
+onmsg_router = Router(name="AI On-message Generation")
 logger = logging.getLogger(__name__)
 
-@onmsg_router.message(F.text.len() > 10, StateFilter(None), ~F.text.startswith("/"))
-async def handle_non_command_messages(message: Message, nko_repo,
-                                      content_history_repo, ai_api_repo,
-                                      gigachat_service):
+@onmsg_router.message(F.text.len() > 10, StateFilter(None), ~F.text.startswith("/"), flags={"generation": "free_text"})
+async def handle_non_command_messages(message: Message, nko_repo, ai_api_repo):
     """генерация текста без контекста (игнорирует команды, начинающиеся с /)"""
     
     # Пропускаем пересланные сообщения - они обрабатываются в examples_gen_router
     if message.forward_date is not None:
-        logger.debug(f"Пропущено пересланное сообщение: {message.text[:50]}")
+        logger.debug("Пропущено пересланное сообщение (%d символов)", len(message.text))
         return
     
-    logger.info(f"Обработка обычного сообщения для генерации: {message.text[:50]}...")
+    logger.info("Обработка обычного сообщения для генерации (%d символов)", len(message.text))
     # Получаем данные НКО пользователя
     nko_data = await nko_repo.get_nko_data(message.from_user.id)
     
@@ -32,7 +30,7 @@ async def handle_non_command_messages(message: Message, nko_repo,
 
     # Проверяем размер очереди перед генерацией
     queue = get_generation_queue(user_api_key)
-    pending_tasks = queue.get_pending_tasks_count()
+    pending_tasks = await queue.count_pending_tasks()
     
     # Создаем сообщение о статусе
     if pending_tasks > 0:
@@ -43,39 +41,14 @@ async def handle_non_command_messages(message: Message, nko_repo,
     else:
         msg = await message.answer("Создаю текст... Пожалуйста, подождите 🔄")
     
-    # Callback для обновления сообщения при начале обработки
-    async def update_message():
-        try:
-            await msg.edit_text("Создаю текст... Пожалуйста, подождите 🔄")
-        except:
-            pass
-
-    # Генерируем текст
-    result, position = await gigachat_service.generate_free_text(
-        user_idea=message.text,
-        nko_data=nko_data,
-        user_api_key=user_api_key,
-        on_start_callback=update_message
-    )
-
-
-    # Сохраняем в историю
-    history_entry = await content_history_repo.add_content_history(
+    # Генерируем текст (задача сохраняется в БД и переживёт перезапуск бота)
+    await run_generation_job(
+        bot=message.bot,
         tg_id=message.from_user.id,
-        content_type="free_text",
-        prompt=message.text,
-        result=result,
-        model="gigachat"
+        status_message=msg,
+        operation="free_text",
+        params={"user_idea": message.text, "nko": nko_snapshot(nko_data)},
+        history_params={"content_type": "free_text", "prompt": message.text},
+        user_api_key=user_api_key,
+        progress_text="Создаю текст... Пожалуйста, подождите 🔄"
     )
-
-    # Создаем инлайн-кнопку для перегенерации с ID записи
-    regenerate_keyboard = get_regenerate_keyboard(history_entry.id)
-
-    # Отправляем результат с кнопкой перегенерации
-    try:
-        await msg.edit_text(result, parse_mode="Markdown", reply_markup=regenerate_keyboard)
-    except:
-        if result:
-            await msg.edit_text(result, reply_markup=regenerate_keyboard)
-        else:
-            await msg.edit_text("Не удалось создать текст. Попробуйте пересоздать!",reply_markup=regenerate_keyboard)
\ No newline at end of file
@@ -9,13 +9,16 @@ from aiogram.types import Message, FSInputFile
 from database.repositories import ContentHistoryRepository, AIAPIRepository
 from ai_service.gigachat_ai_service import get_gigachat_service
 from keyboards.inline_keyboards import get_regenerate_keyboard
-from utils.generation_queue import get_generation_queue
+from utils.admission import GenerationRejected
+from utils.generation_jobs import run_generation_job
+from utils.generation_queue import get_generation_queue, GenerationCancelled, GenerationExpired
+from utils.queue_progress import queue_status_updates
 
 reply_commands_router = Router(name="Reply Commands Router")
 logger = logging.getLogger(__name__)
 
 
-@reply_commands_router.message(Command("картинка", "image"))
+@reply_commands_router.message(Command("картинка", "image"), flags={"generation": "image"})
 async def create_image_from_text(message: Message, ai_api_repo: AIAPIRepository, 
                                   content_history_repo: ContentHistoryRepository, 
                                   gigachat_service=None):
@@ -49,7 +52,7 @@ async def create_image_from_text(message: Message, ai_api_repo: AIAPIRepository,
     
     # Проверяем размер очереди перед генерацией
     queue = get_generation_queue(user_api_key)
-    pending_tasks = queue.get_pending_tasks_count()
+    pending_tasks = await queue.count_pending_tasks()
     
     # Отправляем сообщение о начале генерации
     if pending_tasks > 0:
@@ -62,29 +65,29 @@ async def create_image_from_text(message: Message, ai_api_repo: AIAPIRepository,
     
     # Callback для обновления сообщения при начале обработки
     async def update_message():
-        try:
-            await msg.edit_text("🎨 Создаю изображение для поста... Это может занять до 30 секунд. Подождите, пожалуйста... ⏳")
-        except:
-            pass
+        # Ошибки не глушим: если статус-сообщение удалено, очередь отменит задачу
+        await msg.edit_text("🎨 Создаю изображение для поста... Это может занять до 30 секунд. Подождите, пожалуйста... ⏳")
     
     try:
-        # Сначала улучшаем промпт на основе текста поста
-        enhanced_prompt, _ = await gigachat_service.enhance_image_prompt(
-            user_prompt=f"Создай изображение для поста в соцсетях на тему: {post_text}",
-            user_api_key=user_api_key,
-            on_start_callback=update_message if pending_tasks == 0 else None
-        )
-        await msg.edit_text("Улучшаю промпт...")
-        await asyncio.sleep(3)
-        await msg.edit_text(" Создаю изображение для поста... Это может занять до 30 секунд. Подождите, пожалуйста... ⏳")
+        # Пока задачи ждут очереди, статус-сообщение показывает их позицию и оценку времени
+        with queue_status_updates(msg.bot, msg.chat.id, msg.message_id):
+            # Сначала улучшаем промпт на основе текста поста
+            enhanced_prompt, _ = await gigachat_service.enhance_image_prompt(
+                user_prompt=f"Создай изображение для поста в соцсетях на тему: {post_text}",
+                user_api_key=user_api_key,
+                on_start_callback=update_message if pending_tasks == 0 else None
+            )
+            await msg.edit_text("Улучшаю промпт...")
+            await asyncio.sleep(3)
+            await msg.edit_text(" Создаю изображение для поста... Это может занять до 30 секунд. Подождите, пожалуйста... ⏳")
 
-        # Генерируем изображение с улучшенным промптом (используем стиль по умолчанию - реализм)
-        success, image_url, position = await gigachat_service.generate_image(
-            prompt=enhanced_prompt,
-            style="реализм",
-            credentials=user_api_key,
-            on_start_callback=update_message if pending_tasks > 0 else None
-        )
+            # Генерируем изображение с улучшенным промптом (используем стиль по умолчанию - реализм)
+            success, image_url, position = await gigachat_service.generate_image(
+                prompt=enhanced_prompt,
+                style="реализм",
+                credentials=user_api_key,
+                on_start_callback=update_message if pending_tasks > 0 else None
+            )
         
         if success and image_url:
             await msg.delete()
@@ -128,21 +131,25 @@ async def create_image_from_text(message: Message, ai_api_repo: AIAPIRepository,
             error_message = image_url if isinstance(image_url, str) else "Не удалось создать изображение. Попробуйте еще раз."
             await msg.edit_text(error_message)
             
+    except GenerationRejected as e:
+        await msg.edit_text(str(e))
+    except GenerationCancelled:
+        # Сообщение могло быть удалено (из-за этого задача и отменена) — тогда сообщать некуда
+        try:
+            await msg.edit_text("🚫 Генерация отменена.")
+        except Exception:
+            pass
+    except GenerationExpired as e:
+        await msg.edit_text(f"{e}\n\nОтправьте команду ещё раз.")
     except Exception as e:
         logger.error(f"Ошибка при создании изображения для поста: {e}", exc_info=True)
         await msg.edit_text("❌ Произошла ошибка при создании изображения. Попробуйте позже.")
 
 
-@reply_commands_router.message(Command("измени", "edit", "edit_with_wishes"))
-async def edit_text_with_wishes(message: Message, ai_api_repo: AIAPIRepository,
-                                content_history_repo: ContentHistoryRepository,
-                                gigachat_service=None):
+@reply_commands_router.message(Command("измени", "edit", "edit_with_wishes"), flags={"generation": "edit_text_with_wishes"})
+async def edit_text_with_wishes(message: Message, ai_api_repo: AIAPIRepository):
     """Редактирование текста согласно пожеланиям пользователя (работает только на ответ на сообщение)"""
     
-    # Получаем gigachat_service если он не был передан
-    if gigachat_service is None:
-        gigachat_service = get_gigachat_service()
-    
     # Проверяем, что сообщение является ответом и содержит текст или подпись
     if not message.reply_to_message:
         await message.answer(
@@ -177,7 +184,7 @@ async def edit_text_with_wishes(message: Message, ai_api_repo: AIAPIRepository,
     
     # Проверяем размер очереди перед генерацией
     queue = get_generation_queue(user_api_key)
-    pending_tasks = queue.get_pending_tasks_count()
+    pending_tasks = await queue.count_pending_tasks()
     
     # Отправляем сообщение о начале редактирования
     if pending_tasks > 0:
@@ -188,42 +195,21 @@ async def edit_text_with_wishes(message: Message, ai_api_repo: AIAPIRepository,
     else:
         msg = await message.answer("✏️ Редактирую текст согласно вашим пожеланиям... Пожалуйста, подождите🔄️")
     
-    # Callback для обновления сообщения при начале обработки
-    async def update_message():
-        try:
-            await msg.edit_text("✏️ Редактирую текст согласно вашим пожеланиям... Пожалуйста, подождите🔄️")
-        except:
-            pass
-    
-    try:
-        # Редактируем текст с учетом пожеланий пользователя (используем специальный метод)
-        result, position = await gigachat_service.edit_text_with_wishes(
-            text=original_text,
-            user_wishes=user_wishes,
-            user_api_key=user_api_key,
-            on_start_callback=update_message
-        )
-        
-        # Сохраняем в историю
-        history_entry = await content_history_repo.add_content_history(
-            tg_id=message.from_user.id,
-            content_type="text_edit",
-            prompt=original_text,
-            result=result,
-            model="gigachat",
-            additional_params={
+    # Редактируем текст с учетом пожеланий пользователя (используем специальный метод)
+    await run_generation_job(
+        bot=message.bot,
+        tg_id=message.from_user.id,
+        status_message=msg,
+        operation="edit_text_with_wishes",
+        params={"text": original_text, "user_wishes": user_wishes},
+        history_params={
+            "content_type": "text_edit",
+            "prompt": original_text,
+            "additional_params": {
                 "original_text": original_text,
                 "user_wishes": user_wishes
             }
-        )
-        
-        # Отправляем результат
-        try:
-            await msg.edit_text(result, parse_mode="Markdown", reply_markup=get_regenerate_keyboard(history_entry.id))
-        except:
-            await msg.edit_text(result, reply_markup=get_regenerate_keyboard(history_entry.id))
-            
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании текста с пожеланиями: {e}", exc_info=True)
-        await msg.edit_text("❌ Произошла ошибка при редактировании текста. Попробуйте позже.")
-
+        },
+        user_api_key=user_api_key,
+        progress_text="✏️ Редактирую текст согласно вашим пожеланиям... Пожалуйста, подождите🔄️"
+    )
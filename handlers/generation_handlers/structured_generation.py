@@ -5,7 +5,7 @@ from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 
 from fsm import StructuredPostState
-from keyboards.inline_keyboards import get_regenerate_keyboard
+from utils.generation_jobs import run_generation_job, nko_snapshot
 from utils.generation_queue import get_generation_queue
 
 
@@ -40,9 +40,8 @@ async def invitees_entered(message: Message, state: FSMContext):
     await message.answer("Введите дополнительные детали о событии (например, программа, дресс-код, что взять с собой):")
     await state.set_state(StructuredPostState.entering_details)
 
-@structured_gen_router.message(StructuredPostState.entering_details)
-async def details_entered(message: Message, state: FSMContext, nko_repo,
-                          content_history_repo, ai_api_repo, gigachat_service):
+@structured_gen_router.message(StructuredPostState.entering_details, flags={"generation": "structured_post"})
+async def details_entered(message: Message, state: FSMContext, nko_repo, ai_api_repo):
     """Обработка дополнительных деталей и генерация поста"""
     await state.update_data(details=message.text)
     
@@ -66,7 +65,7 @@ async def details_entered(message: Message, state: FSMContext, nko_repo,
 
     # Информируем пользователя о статусе очереди
     queue = get_generation_queue(user_api_key)
-    queue_load = queue.get_pending_tasks_count()
+    queue_load = await queue.count_pending_tasks()
     if queue_load > 0:
         status_msg = await message.answer(
             f"⏳ Ваш запрос поставлен в очередь (позиция: {queue_load + 1}). "
@@ -76,40 +75,21 @@ async def details_entered(message: Message, state: FSMContext, nko_repo,
         status_msg = await message.answer("📝 Генерирую пост... Пожалуйста, подождите🔄️")
 
     # Генерируем пост на основе структурированных данных
-    try:
-        result = await gigachat_service.generate_structured_post(
-            event_info=event_info,
-            nko_data=nko_data,
-            user_api_key=user_api_key
-        )
-    except Exception as e:
-        logger.error(f"Ошибка при генерации структурированного поста: {e}", exc_info=True)
-        await status_msg.edit_text("❌ Не удалось сгенерировать пост. Попробуйте позже.")
-        await state.clear()
-        return
-
-    # Сохраняем в историю
-    history_entry = await content_history_repo.add_content_history(
+    await run_generation_job(
+        bot=message.bot,
         tg_id=message.from_user.id,
-        content_type="structured_post",
-        prompt=str(event_info),
-        result=result,
-        model="gigachat",
-        additional_params={
-            "event_info": event_info
-        }
+        status_message=status_msg,
+        operation="structured_post",
+        params={"event_info": event_info, "nko": nko_snapshot(nko_data)},
+        history_params={
+            "content_type": "structured_post",
+            "prompt": str(event_info),
+            "additional_params": {
+                "event_info": event_info
+            }
+        },
+        user_api_key=user_api_key,
+        progress_text="📝 Генерирую пост... Пожалуйста, подождите🔄️"
     )
-
-    # Создаем инлайн-кнопку для перегенерации с ID записи
-    regenerate_keyboard = get_regenerate_keyboard(history_entry.id)
-
-    # Отправляем результат с кнопкой перегенерации
-    try:
-        await status_msg.edit_text(result, parse_mode="Markdown", reply_markup=regenerate_keyboard)
-    except:
-        if result:
-            await status_msg.edit_text(result, reply_markup=regenerate_keyboard)
-        else:
-            await status_msg.edit_text("Не удалось сгенерировать текст")
     
-    await state.clear()
\ No newline at end of file
+    await state.clear()
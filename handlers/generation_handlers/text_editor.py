@@ -6,6 +6,7 @@ from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 
 from fsm import TextEditorState
+from utils.generation_jobs import run_generation_job
 from utils.generation_queue import get_generation_queue
 
 
@@ -18,8 +19,8 @@ async def text_editor_start(message: Message, state: FSMContext):
     await message.answer("Введите текст, который вы хотите отредактировать:")
     await state.set_state(TextEditorState.entering_text)
 
-@editor_router.message(TextEditorState.entering_text)
-async def text_to_edit_entered(message: Message, state: FSMContext, content_history_repo, ai_api_repo, gigachat_service):
+@editor_router.message(TextEditorState.entering_text, flags={"generation": "edit_text"})
+async def text_to_edit_entered(message: Message, state: FSMContext, ai_api_repo):
     """Обработка текста для редактирования"""
 
     # Получаем пользовательский API ключ
@@ -28,7 +29,7 @@ async def text_to_edit_entered(message: Message, state: FSMContext, content_hist
 
     # Информируем пользователя о статусе очереди
     queue = get_generation_queue(user_api_key)
-    queue_load = queue.get_pending_tasks_count()
+    queue_load = await queue.count_pending_tasks()
     if queue_load > 0:
         status_msg = await message.answer(
             f"⏳ Ваш запрос поставлен в очередь (позиция: {queue_load + 1}). "
@@ -37,49 +38,28 @@ async def text_to_edit_entered(message: Message, state: FSMContext, content_hist
     else:
         status_msg = await message.answer("✏️ Редактирую текст... Пожалуйста, подождите🔄️")
 
-    # Callback для обновления сообщения при старте
-    async def update_message():
-        try:
-            await status_msg.edit_text("✏️ Редактирую текст... Пожалуйста, подождите🔄️")
-        except:
-            pass
-
     # Редактируем текст
-    try:
-        result, _ = await gigachat_service.edit_text(
-            text=message.text,
-            user_api_key=user_api_key,
-            on_start_callback=update_message
-        )
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании текста: {e}", exc_info=True)
-        await status_msg.edit_text("❌ Не удалось отредактировать текст. Попробуйте еще раз.")
-        return
-
-    # Сохраняем в историю с дополнительными параметрами
-    history_entry = await content_history_repo.add_content_history(
+    await run_generation_job(
+        bot=message.bot,
         tg_id=message.from_user.id,
-        content_type="text_edit",
-        prompt=message.text,
-        result=result,
-        model="gigachat",
-        additional_params={
-            "original_text": message.text
-        }
+        status_message=status_msg,
+        operation="edit_text",
+        params={"text": message.text},
+        history_params={
+            "content_type": "text_edit",
+            "prompt": message.text,
+            "additional_params": {
+                "original_text": message.text
+            }
+        },
+        user_api_key=user_api_key,
+        progress_text="✏️ Редактирую текст... Пожалуйста, подождите🔄️"
     )
-
-    try:
-        await status_msg.edit_text(result, parse_mode="Markdown")
-    except:
-        if result:
-            await status_msg.edit_text(result)
-        else:
-            await status_msg.edit_text("Не удалось отредактировать текст. Попробуйте еще раз.")
     
     await state.clear()
 
-@editor_router.message(Command("проверить","check","fix"))
-async def handle_edit_command(message: Message, state: FSMContext, content_history_repo, ai_api_repo, gigachat_service):
+@editor_router.message(Command("проверить","check","fix"), flags={"generation": "edit_text"})
+async def handle_edit_command(message: Message, state: FSMContext, ai_api_repo):
     """Обработка команды /проверить для исправления ошибок"""
 
     # Проверяем, что сообщение является ответом и содержит текст
@@ -95,7 +75,7 @@ async def handle_edit_command(message: Message, state: FSMContext, content_histo
 
     # Информируем пользователя о статусе очереди
     queue = get_generation_queue(user_api_key)
-    queue_load = queue.get_pending_tasks_count()
+    queue_load = await queue.count_pending_tasks()
     if queue_load > 0:
         status_msg = await message.reply(
             f"⏳ Ваш запрос поставлен в очередь (позиция: {queue_load + 1}). "
@@ -104,37 +84,20 @@ async def handle_edit_command(message: Message, state: FSMContext, content_histo
     else:
         status_msg = await message.reply("✏️ Проверяю текст... Пожалуйста, подождите🔄️")
 
-    async def update_message():
-        try:
-            await status_msg.edit_text("✏️ Проверяю текст... Пожалуйста, подождите🔄️")
-        except:
-            pass
-
     # Редактируем текст
-    try:
-        result, _ = await gigachat_service.edit_text(
-            text=original_text,
-            user_api_key=user_api_key,
-            on_start_callback=update_message
-        )
-    except Exception:
-        await status_msg.edit_text("❌ Не удалось отредактировать текст. Попробуйте еще раз.")
-        return
-
-    # Сохраняем в историю
-    await content_history_repo.add_content_history(
+    await run_generation_job(
+        bot=message.bot,
         tg_id=message.from_user.id,
-        content_type="text_edit",
-        prompt=original_text,
-        result=result,
-        model="gigachat",
-        additional_params={
-            "original_text": original_text
-        }
+        status_message=status_msg,
+        operation="edit_text",
+        params={"text": original_text},
+        history_params={
+            "content_type": "text_edit",
+            "prompt": original_text,
+            "additional_params": {
+                "original_text": original_text
+            }
+        },
+        user_api_key=user_api_key,
+        progress_text="✏️ Проверяю текст... Пожалуйста, подождите🔄️"
     )
-
-    # Отправляем результат
-    try:
-        await status_msg.edit_text(result, parse_mode="Markdown")
-    except:
-        await status_msg.edit_text(result)
\ No newline at end of file
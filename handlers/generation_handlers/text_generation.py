@@ -5,8 +5,9 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
 
-from keyboards.inline_keyboards import models_select_keyboard, text_style_keyboard, get_regenerate_keyboard, text_generation_type_keyboard
+from keyboards.inline_keyboards import models_select_keyboard, text_style_keyboard, text_generation_type_keyboard
 from fsm import TextGenerationState, StructuredPostState, TextFromExamplesState
+from utils.generation_jobs import run_generation_job, nko_snapshot
 from utils.generation_queue import get_generation_queue
 
 
@@ -70,8 +71,8 @@ async def description_entered(message: Message, state: FSMContext):
     )
     await state.set_state(TextGenerationState.choosing_style)
 
-@text_gen_router.callback_query(TextGenerationState.choosing_style)
-async def style_chosen(cb: CallbackQuery, state: FSMContext, nko_repo, content_history_repo, ai_api_repo, gigachat_service):
+@text_gen_router.callback_query(TextGenerationState.choosing_style, flags={"generation": "free_text"})
+async def style_chosen(cb: CallbackQuery, state: FSMContext, nko_repo, ai_api_repo):
     """Обработчик выбора стиля и финальная генерация"""
     style_mapping = {
         "style_official": "официальный",
@@ -95,7 +96,7 @@ async def style_chosen(cb: CallbackQuery, state: FSMContext, nko_repo, content_h
 
     # Проверяем размер очереди перед генерацией
     queue = get_generation_queue(user_api_key)
-    pending_tasks = queue.get_pending_tasks_count()
+    pending_tasks = await queue.count_pending_tasks()
     
     # Создаем сообщение о статусе
     if pending_tasks > 0:
@@ -106,50 +107,28 @@ async def style_chosen(cb: CallbackQuery, state: FSMContext, nko_repo, content_h
     else:
         msg = await cb.message.answer("Генерация текста... Пожалуйста, подождите🔄️")
     
-    # Callback для обновления сообщения при начале обработки
-    async def update_message():
-        try:
-            await msg.edit_text("Генерация текста... Пожалуйста, подождите🔄️")
-        except:
-            pass
-    
     # Генерируем текст с учетом стиля
     prompt_with_style = f"{description} (в {style} стиле)"
-    
-    result, position = await gigachat_service.generate_free_text(
-        user_idea=prompt_with_style,
-        nko_data=nko_data,
-        user_api_key=user_api_key,
-        on_start_callback=update_message
-    )
 
-    # Сохраняем в историю с дополнительными параметрами
-    history_entry = await content_history_repo.add_content_history(
+    await run_generation_job(
+        bot=cb.bot,
         tg_id=cb.from_user.id,
-        content_type="text_generation",
-        prompt=description,
-        result=result,
-        model="gigachat",
-        style=style,
-        additional_params={
-            "model": "GigaChat",
+        status_message=msg,
+        operation="free_text",
+        params={"user_idea": prompt_with_style, "nko": nko_snapshot(nko_data)},
+        history_params={
+            "content_type": "text_generation",
+            "prompt": description,
             "style": style,
-            "description": description
-        }
+            "additional_params": {
+                "model": "GigaChat",
+                "style": style,
+                "description": description
+            }
+        },
+        user_api_key=user_api_key,
+        progress_text="Генерация текста... Пожалуйста, подождите🔄️"
     )
 
-    # Создаем инлайн-кнопку для перегенерации с ID записи
-    regenerate_keyboard = get_regenerate_keyboard(history_entry.id)
-
-    # Отправляем результат с кнопкой перегенерации
-    try:
-        await msg.edit_text(result, parse_mode="Markdown", reply_markup=regenerate_keyboard)
-    except:
-        if result:
-            await msg.edit_text(result, reply_markup=regenerate_keyboard)
-        else:
-            await msg.edit_text("Не удалось сгенерировать текст. "
-                                "Попробуйте пересоздать или попробуйте позже.",reply_markup=regenerate_keyboard)
-
     await state.clear()
     await cb.answer()
\ No newline at end of file
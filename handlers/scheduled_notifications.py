@@ -1,8 +1,10 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime
+from typing import Optional
 import logging
 
+from database import db_manager
 from database.repositories import NotificationRepository
 from keyboards.inline_keyboards import get_daily_post_keyboard
 
@@ -11,7 +13,13 @@ logger = logging.getLogger(__name__)
 class ScheduledNotifications:
     """Класс для управления запланированными уведомлениями"""
     
-    def __init__(self, notification_repo: NotificationRepository):
+    def __init__(self, bot=None, notification_repo: Optional[NotificationRepository] = None):
+        """
+        :param bot: Бот для отправки уведомлений
+        :param notification_repo: Репозиторий уже открытой сессии (например, из middleware).
+                                  Если не передан, каждый запуск открывает свою сессию и сам фиксирует транзакцию
+        """
+        self.bot = bot or (notification_repo.bot if notification_repo else None)
         self.notification_repo = notification_repo
         self.scheduler = AsyncIOScheduler()
     
@@ -36,9 +44,19 @@ class ScheduledNotifications:
     
     async def send_daily_notifications(self):
         """Отправка ежедневных уведомлений"""
+        if self.notification_repo is not None:
+            await self._send_notifications(self.notification_repo)
+            return
+
+        # Запуск по расписанию — отдельная единица работы со своим commit
+        async with db_manager.get_session() as session:
+            await self._send_notifications(NotificationRepository(session, bot=self.bot))
+
+    async def _send_notifications(self, notification_repo: NotificationRepository):
+        """Отправка уведомлений через репозиторий указанной сессии"""
         try:
             # Получаем все неотправленные уведомления на текущую дату
-            pending_notifications = await self.notification_repo.get_pending_notifications(
+            pending_notifications = await notification_repo.get_pending_notifications(
                 current_datetime=datetime.now()
             )
             
@@ -46,11 +64,10 @@ class ScheduledNotifications:
             
             for notification in pending_notifications:
                 try:
-                    # Получаем бота из хранилища (предполагается, что он будет добавлен в репозиторий)
-                    bot = self.notification_repo.bot
+                    bot = self.bot
                     
                     if not bot:
-                        logger.error("Бот не найден в репозитории уведомлений")
+                        logger.error("Бот для отправки уведомлений не задан")
                         continue
                     
                     # Отправляем уведомление пользователю (без системного текста)
@@ -62,7 +79,7 @@ class ScheduledNotifications:
                     )
                     
                     # Отмечаем уведомление как отправленное
-                    await self.notification_repo.mark_as_sent(notification.id)
+                    await notification_repo.mark_as_sent(notification.id)
                     logger.info(f"Уведомление отправлено пользователю {notification.tg_id}")
                     
                 except Exception as e:
@@ -80,6 +80,17 @@ def get_regenerate_keyboard(history_id: int) -> InlineKeyboardMarkup:
         ]
     )
 
+def get_retry_keyboard(callback_data: str) -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой повтора запроса, не выполненного вовремя"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(
+                text="🔁 Повторить",
+                callback_data=callback_data
+            )]
+        ]
+    )
+
 def get_accept_plan_keyboard(history_id: int) -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой принятия контент-плана"""
     return InlineKeyboardMarkup(
@@ -140,4 +151,27 @@ def access_link_inline_keyboard(link_id: int, is_active: bool) -> InlineKeyboard
                 callback_data=f"access_toggle:{link_id}:{action}"
             )]
         ]
-    )
\ No newline at end of file
+    )
+
+def access_links_page_keyboard(links, scope: str, page: int, has_next: bool) -> InlineKeyboardMarkup:
+    """
+    Клавиатура страницы списка ссылок: кнопка включения/отключения для каждой ссылки (по номеру в списке)
+    и навигация по страницам. scope — какой список показан: own (свои ссылки) или all (все активные).
+    """
+    rows = []
+    for number, link in enumerate(links, start=1):
+        action = "off" if link.is_active else "on"
+        text = f"{number}. Деактивировать" if link.is_active else f"{number}. Активировать"
+        rows.append([InlineKeyboardButton(
+            text=text,
+            callback_data=f"access_toggle:{link.id}:{action}:{scope}:{page}"
+        )])
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"access_page:{scope}:{page - 1}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="Далее ▶️", callback_data=f"access_page:{scope}:{page + 1}"))
+    if navigation:
+        rows.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -1,50 +1,94 @@
-import asyncio
 import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import config
 from database import db_manager
-from database.repositories import NotificationRepository
 from handlers import msg_router, cb_router, settings_router, fsm_router, errors_router, history_router, access_router
 from handlers.generation_handlers import (text_gen_router, image_gen_router, cp_router,
                                           editor_router, structured_gen_router, examples_gen_router, onmsg_router, reply_commands_router)
 from middleware.di_middleware import InjectionMiddleware
+from middleware.ordering_middleware import ChatOrderingMiddleware, GenerationGuardMiddleware
+from utils.metrics import HandlerMetricsMiddleware, start_metrics_server
 from handlers.scheduled_notifications import ScheduledNotifications
+from utils.generation_jobs import resume_generation_jobs
 from utils.generation_queue import get_generation_queue, stop_all_generation_queues
+from utils.bot_identity import get_bot_identity
+from utils.fsm_storage import build_fsm_storage
+from utils.logging_setup import setup_logging
+from utils.loop_monitor import LoopMonitor
+from utils.redis_client import close_redis
+from utils.runtime import json_functions, run
+from utils.tracing import TracingRequestMiddleware, setup_tracing, shutdown_tracing
+from utils.webhook_server import run_webhook
 
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования (формат, уровни модулей, выборка частых записей, скрытие секретов — см. config)
+setup_logging()
 logger = logging.getLogger(__name__) # Для удобства указываем имя модуля
 
-# Основная функция запуска
-async def main():
-    bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(
-        parse_mode=ParseMode.HTML))
-
-    await db_manager.init_db()
 
-    dp = Dispatcher(storage=MemoryStorage()) # Можно будет потом заменить на Redis для более быстрого доступа и надежности
+def build_dispatcher(bot: Bot) -> Dispatcher:
+    """Диспетчер со всеми middleware и роутерами бота (используется и в нагрузочных тестах benchmarks/)"""
+    dp = Dispatcher(storage=build_fsm_storage()) # Redis, если задан REDIS_URL (общий для нескольких экземпляров), иначе память
 
+    # Обновления одного чата обрабатываются по очереди, разных чатов — параллельно (до открытия сессии БД)
+    dp.update.outer_middleware(ChatOrderingMiddleware(
+        max_concurrent_updates=config.MAX_CONCURRENT_UPDATES,
+        chat_concurrency=config.CHAT_MAX_CONCURRENCY,
+        max_pending_per_chat=config.MAX_PENDING_UPDATES_PER_CHAT,
+    ))
     dp.update.middleware(InjectionMiddleware(bot=bot)) # подключаем middleware (пост обработчик)
-    # Создаем и подключаем репозитории
-    notification_repo = NotificationRepository(db_manager.session_factory, bot)
-    
-    # Создаем и запускаем планировщик уведомлений
-    scheduler = ScheduledNotifications(notification_repo)
-    
+    # Время работы обработчиков по роутерам (для метрик)
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    # Повторные запросы на генерацию, пока такая же генерация ещё выполняется, отбрасываются
+    generation_guard = GenerationGuardMiddleware()
+    dp.message.middleware(generation_guard)
+    dp.callback_query.middleware(generation_guard)
+
     # Подключаем роутеры
     dp.include_routers(msg_router, settings_router, access_router, fsm_router, cb_router, text_gen_router, image_gen_router,
                        cp_router, editor_router, structured_gen_router, examples_gen_router,
                        errors_router, history_router, onmsg_router, reply_commands_router)
 
+    return dp
+
+
+# Основная функция запуска
+async def main():
+    setup_tracing()
+
+    # Сериализация запросов и ответов Bot API (orjson при FAST_RUNTIME)
+    json_dumps, json_loads = json_functions(config.FAST_RUNTIME)
+    bot = Bot(token=config.BOT_TOKEN, session=AiohttpSession(json_loads=json_loads, json_dumps=json_dumps),
+              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(TracingRequestMiddleware())  # Span на каждый вызов Bot API
+
+    await db_manager.init_db()
+
+    if config.METRICS_PORT:
+        start_metrics_server(config.METRICS_PORT, config.METRICS_HOST)
+
+    dp = build_dispatcher(bot)
+
+    # Создаем планировщик уведомлений (сессию БД он открывает сам на каждый запуск)
+    scheduler = ScheduledNotifications(bot=bot)
+
+    # Замер задержки цикла событий и поиск синхронного кода, который его блокирует
+    loop_monitor = None
+    if config.LOOP_MONITOR_INTERVAL > 0:
+        loop_monitor = LoopMonitor(
+            interval=config.LOOP_MONITOR_INTERVAL,
+            threshold=config.LOOP_STALL_THRESHOLD,
+            debug=config.LOOP_DEBUG,
+        )
+        await loop_monitor.start()
+    
     logger.info("Инициализация базы данных...")
 
     logger.info("✅ Таблицы созданы успешно")
@@ -52,7 +96,9 @@ async def main():
     # ЖЦ бота
     try:
         logger.info("🚀 Бот запущен.")
-        await bot.delete_webhook(drop_pending_updates=True)
+
+        # Данные бота (username для ссылок-приглашений) запрашиваются один раз и кэшируются
+        await get_bot_identity(bot)
         
         # Запускаем планировщик уведомлений
         await scheduler.start()
@@ -60,15 +106,22 @@ async def main():
         # Запускаем очередь генерации
         generation_queue = get_generation_queue()
         await generation_queue.start()
+
+        # Продолжаем задачи генерации, прерванные предыдущим перезапуском
+        await resume_generation_jobs(bot)
         
-        # Запускаем поллинг
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if config.RUN_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # Поллинг (для разработки). Накопившиеся обновления отбрасываются только при DROP_PENDING_UPDATES
+            await bot.delete_webhook(drop_pending_updates=config.DROP_PENDING_UPDATES)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
         
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки (Ctrl+C)")
         
     except Exception as e:
-        logger.critical("Непредвиденная ошибка в polling: %s", e, exc_info=True)
+        logger.critical("Непредвиденная ошибка при работе бота: %s", e, exc_info=True)
         
     finally:
         logger.info("🔴 Бот останавливается...")
@@ -80,8 +133,13 @@ async def main():
         await stop_all_generation_queues()
         
         await bot.session.close()
+        await dp.storage.close()
+        await close_redis()
         await db_manager.close()
+        if loop_monitor is not None:
+            await loop_monitor.stop()
+        shutdown_tracing()
         logger.info("✅ Успешное завершение работы.")
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    run(main(), fast=config.FAST_RUNTIME)  # uvloop при FAST_RUNTIME, иначе стандартный цикл asyncio
\ No newline at end of file
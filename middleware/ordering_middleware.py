@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from utils.generation_queue import cancel_generations, current_generation_operation
+
+
+logger = logging.getLogger(__name__)
+
+BUSY_TEXT = "⏳ Предыдущий такой запрос ещё выполняется. Дождитесь результата, пожалуйста."
+
+
+def _chat_key(data: Dict[str, Any]) -> Optional[int]:
+    """Чат обновления (или пользователь, если чата нет)"""
+    chat = data.get("event_chat")
+    if chat is not None:
+        return chat.id
+    user = data.get("event_from_user")
+    return user.id if user is not None else None
+
+
+class _ChatSlot:
+    """Очередь обновлений одного чата"""
+    __slots__ = ("semaphore", "pending")
+
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending = 0  # Обновления чата, которые выполняются или ждут своей очереди
+
+
+class ChatOrderingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для обновлений: обновления одного чата обрабатываются по очереди
+    (не больше chat_concurrency одновременно), разные чаты — параллельно, всего не больше
+    max_concurrent_updates обновлений одновременно. Если у чата скопилось больше
+    max_pending_per_chat обновлений, новые отбрасываются.
+
+    В data передаётся release_update_slot — обработчик может досрочно освободить место
+    (так делает GenerationGuardMiddleware для долгих генераций).
+    """
+
+    def __init__(self, max_concurrent_updates: int = 100, chat_concurrency: int = 1, max_pending_per_chat: int = 10):
+        self._global = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_concurrency = chat_concurrency
+        self._max_pending_per_chat = max_pending_per_chat
+        self._slots: Dict[int, _ChatSlot] = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        key = _chat_key(data)
+        if key is None:
+            async with self._global:
+                return await handler(event, data)
+
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _ChatSlot(self._chat_concurrency)
+        if slot.pending >= self._max_pending_per_chat:
+            logger.warning(f"Чат {key}: слишком много необработанных обновлений ({slot.pending}), обновление отброшено")
+            return None
+
+        slot.pending += 1
+        releases = []
+
+        def release():
+            while releases:
+                releases.pop()()
+
+        try:
+            # Сначала очередь чата, потом общий лимит — ожидающие своей очереди чаты не занимают общие места
+            await slot.semaphore.acquire()
+            releases.append(slot.semaphore.release)
+            await self._global.acquire()
+            releases.append(self._global.release)
+
+            data["release_update_slot"] = release
+            return await handler(event, data)
+        finally:
+            release()
+            slot.pending -= 1
+            if slot.pending == 0:
+                self._slots.pop(key, None)
+
+
+class GenerationGuardMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware для обработчиков с флагом generation.
+
+    Пока генерация выполняется, такой же запрос из того же чата отбрасывается (например, повторная
+    отправка текста, пока пост ещё генерируется). Другой запрос той же операции заменяет
+    предыдущий: его задача в очереди генерации отменяется, и место достаётся новому запросу.
+    Место в очереди чата освобождается сразу, чтобы на время долгой генерации не блокировать
+    остальные команды пользователя (в том числе /cancel).
+    """
+
+    def __init__(self):
+        # (чат, операция) -> (текст или данные запроса, метка обработчика)
+        self._busy: Dict[Tuple[int, str], Tuple[str, object]] = {}
+
+    @staticmethod
+    def _fingerprint(event: TelegramObject) -> str:
+        if isinstance(event, Message):
+            return event.text or event.caption or ""
+        if isinstance(event, CallbackQuery):
+            return event.data or ""
+        return ""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        operation = get_flag(data, "generation")
+        chat_key = _chat_key(data)
+        if operation is None or chat_key is None:
+            return await handler(event, data)
+
+        key = (chat_key, operation)
+        fingerprint = self._fingerprint(event)
+        busy = self._busy.get(key)
+        if busy is not None:
+            if busy[0] == fingerprint:
+                logger.info("Чат %s: повторный запрос %s во время генерации отброшен", chat_key, operation)
+                await self._notify_busy(event)
+                return None
+            # Новый запрос той же операции: предыдущий результат уже никому не нужен
+            user = data.get("event_from_user")
+            if user is not None:
+                cancel_generations(user.id, operation)
+            logger.info("Чат %s: запрос %s заменён более новым", chat_key, operation)
+
+        marker = object()
+        self._busy[key] = (fingerprint, marker)
+        release = data.get("release_update_slot")
+        if release is not None:
+            release()
+        token = current_generation_operation.set(operation)
+        try:
+            return await handler(event, data)
+        finally:
+            current_generation_operation.reset(token)
+            # Запись могла уже принадлежать более новому запросу
+            if self._busy.get(key, (None, None))[1] is marker:
+                del self._busy[key]
+
+    @staticmethod
+    async def _notify_busy(event: TelegramObject):
+        try:
+            if isinstance(event, (Message, CallbackQuery)):
+                await event.answer(BUSY_TEXT)
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить о выполняющемся запросе: {e}")
@@ -90,7 +90,7 @@ HELP_TEXT="""
 /start — начать работу
 /help — это руководство
 /menu — главное меню
-/cancel — отмена действия
+/cancel — отмена действия и незавершённой генерации
 /edit или /измени — редактировать пост с пожеланиями (ответьте на сообщение)
 /check или /проверить — проверить и исправить ошибки (ответьте на сообщение)
 /image — создать изображение из текста (ответьте на пост)
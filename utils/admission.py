@@ -0,0 +1,184 @@
+import logging
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from config import config
+from utils.redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Пользователь, от имени которого выполняется текущее обновление (устанавливается InjectionMiddleware)
+current_generation_user: ContextVar[Optional[int]] = ContextVar("current_generation_user", default=None)
+
+_TYPE_NAMES = {
+    "text": "текстовых генераций",
+    "image": "генераций изображений",
+    "content_plan": "контент-планов",
+    "enhance_prompt": "улучшений промта",
+}
+
+_OWN_KEY_HINT = "\n\n💡 Чтобы снять ограничения, добавьте свой API-ключ GigaChat в настройках бота."
+
+
+class GenerationRejected(Exception):
+    """Запрос на генерацию отклонён до постановки в очередь. Текст исключения показывается пользователю"""
+
+
+def _format_window(seconds: float) -> str:
+    if seconds >= 3600 and seconds % 3600 == 0:
+        return f"{int(seconds // 3600)} ч."
+    if seconds >= 60:
+        return f"{int(seconds // 60)} мин."
+    return f"{int(seconds)} сек."
+
+
+class MemoryAdmissionStore:
+    """Состояние квот в памяти процесса (для одного экземпляра бота)"""
+
+    def __init__(self):
+        self._windows: Dict[Tuple[int, str], Deque[float]] = defaultdict(deque)
+        self._in_flight: Dict[int, int] = defaultdict(int)
+
+    async def try_admit(self, user_id: int, generation_type: str, limit: int, window: float,
+                        max_in_flight: int) -> Tuple[int, float]:
+        """
+        Проверить квоты и занять место.
+
+        :return: (0, 0) — допущен; (1, через сколько секунд освободится квота); (2, 0) — превышен лимит одновременных
+        """
+        now = time.monotonic()
+        timestamps = self._windows[(user_id, generation_type)]
+        while timestamps and timestamps[0] <= now - window:
+            timestamps.popleft()
+        if limit > 0 and len(timestamps) >= limit:
+            return 1, timestamps[0] + window - now
+        if max_in_flight > 0 and self._in_flight[user_id] >= max_in_flight:
+            return 2, 0
+        timestamps.append(now)
+        self._in_flight[user_id] += 1
+        return 0, 0
+
+    async def release(self, user_id: int):
+        self._in_flight[user_id] -= 1
+        if self._in_flight[user_id] <= 0:
+            del self._in_flight[user_id]
+
+
+# KEYS: окно (ZSET), счётчик одновременных; ARGV: window_ms, limit, max_in_flight, member, in_flight_ttl_ms
+_ADMIT_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local max_in_flight = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if limit > 0 and redis.call('ZCARD', KEYS[1]) >= limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {1, tonumber(oldest[2]) + window - now}
+end
+local in_flight = tonumber(redis.call('GET', KEYS[2]) or '0')
+if max_in_flight > 0 and in_flight >= max_in_flight then
+    return {2, 0}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+redis.call('INCR', KEYS[2])
+redis.call('PEXPIRE', KEYS[2], ARGV[5])
+return {0, 0}
+"""
+
+# KEYS: счётчик одновременных
+_RELEASE_SCRIPT = """
+local value = redis.call('DECR', KEYS[1])
+if value <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return value
+"""
+
+
+class RedisAdmissionStore:
+    """Состояние квот в Redis — лимиты общие для всех экземпляров бота"""
+
+    # Счётчик одновременных запросов упавшего экземпляра не должен блокировать пользователя навсегда
+    IN_FLIGHT_TTL_MS = 60 * 60 * 1000
+
+    def __init__(self, redis: Redis, prefix: str = "nko_admission"):
+        self._prefix = prefix
+        self._admit = redis.register_script(_ADMIT_SCRIPT)
+        self._release = redis.register_script(_RELEASE_SCRIPT)
+
+    async def try_admit(self, user_id: int, generation_type: str, limit: int, window: float,
+                        max_in_flight: int) -> Tuple[int, float]:
+        code, retry_after_ms = await self._admit(
+            keys=[f"{self._prefix}:{user_id}:{generation_type}", f"{self._prefix}:{user_id}:in_flight"],
+            args=[int(window * 1000), limit, max_in_flight, uuid.uuid4().hex, self.IN_FLIGHT_TTL_MS],
+        )
+        return int(code), int(retry_after_ms) / 1000
+
+    async def release(self, user_id: int):
+        await self._release(keys=[f"{self._prefix}:{user_id}:in_flight"])
+
+
+class AdmissionController:
+    """
+    Контроль допуска к очереди генерации: скользящее окно запросов на пользователя для каждого
+    типа генерации и ограничение числа одновременных запросов пользователя.
+    """
+
+    def __init__(self, store, quotas: Dict[str, Tuple[int, float]], max_in_flight: int):
+        self._store = store
+        self._quotas = quotas
+        self._max_in_flight = max_in_flight
+
+    @asynccontextmanager
+    async def admit(self, user_id: int, generation_type: str) -> AsyncIterator[None]:
+        """Занять место на время выполнения запроса или выбросить GenerationRejected"""
+        limit, window = self._quotas.get(generation_type, (0, 0))
+        code, retry_after = await self._store.try_admit(user_id, generation_type, limit, window, self._max_in_flight)
+        if code == 1:
+            logger.info("Пользователь %s: превышена квота %s (%d за %s сек.)", user_id, generation_type, limit, window)
+            minutes = max(1, int(retry_after // 60) + (1 if retry_after % 60 else 0))
+            raise GenerationRejected(
+                f"⛔ Лимит исчерпан: не больше {limit} {_TYPE_NAMES.get(generation_type, 'запросов')} "
+                f"за {_format_window(window)} Попробуйте снова примерно через {minutes} мин.{_OWN_KEY_HINT}"
+            )
+        if code == 2:
+            logger.info("Пользователь %s: превышено число одновременных запросов (%d)", user_id, self._max_in_flight)
+            raise GenerationRejected(
+                "⛔ У вас уже выполняются другие запросы. Дождитесь их результата и попробуйте снова."
+                f"{_OWN_KEY_HINT}"
+            )
+        try:
+            yield
+        finally:
+            try:
+                await self._store.release(user_id)
+            except Exception as e:
+                logger.error(f"Не удалось освободить место пользователя {user_id} в контроле допуска: {e}")
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Общий контроль допуска (None, если квоты отключены)"""
+    global _admission_controller
+    if not config.GENERATION_QUOTAS and not config.GENERATION_MAX_INFLIGHT_PER_USER:
+        return None
+    if _admission_controller is None:
+        redis = get_redis()
+        store = RedisAdmissionStore(redis) if redis is not None else MemoryAdmissionStore()
+        _admission_controller = AdmissionController(
+            store,
+            quotas=dict(config.GENERATION_QUOTAS),
+            max_in_flight=config.GENERATION_MAX_INFLIGHT_PER_USER,
+        )
+    return _admission_controller
@@ -0,0 +1,38 @@
+import asyncio
+import logging
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.types import User
+
+
+logger = logging.getLogger(__name__)
+
+# Данные бота (id, username) по id бота: запрашиваются у Bot API один раз и дальше берутся из памяти
+_identities: Dict[int, User] = {}
+_lock = asyncio.Lock()
+
+
+async def get_bot_identity(bot: Bot, refresh: bool = False) -> User:
+    """
+    Данные бота из кэша. Первый вызов (обычно при запуске) запрашивает getMe.
+    refresh=True запрашивает их заново — например, после смены username бота.
+    """
+    identity = _identities.get(bot.id)
+    if identity is not None and not refresh:
+        return identity
+    async with _lock:
+        identity = _identities.get(bot.id)
+        # Пока ждали блокировку, данные мог загрузить другой обработчик
+        if identity is None or refresh:
+            identity = await bot.get_me()
+            _identities[bot.id] = identity
+            logger.info("Данные бота загружены: @%s (id %s)", identity.username, identity.id)
+    return identity
+
+
+def build_deeplink(identity: User, payload: str) -> str:
+    """Ссылка t.me на запуск бота с параметром start (без username — сам параметр)"""
+    if identity.username:
+        return f"https://t.me/{identity.username}?start={payload}"
+    return payload
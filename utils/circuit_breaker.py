@@ -0,0 +1,166 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Tuple
+
+import httpx
+from gigachat.exceptions import ResponseError
+
+from config import config
+from utils import metrics
+from utils.admission import GenerationRejected
+from utils.gigachat_clients import credentials_key
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"  # Запросы идут как обычно
+OPEN = "open"  # Сервис недоступен: запросы сразу отклоняются
+HALF_OPEN = "half_open"  # Пробный запрос: по его результату цепь замыкается или снова размыкается
+
+# Значения состояний в метрике
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+UNAVAILABLE_TEXT = (
+    "⚠️ GigaChat сейчас не отвечает, поэтому мы временно не отправляем ему запросы. "
+    "Пожалуйста, попробуйте снова через пару минут."
+)
+
+
+class UpstreamUnavailable(GenerationRejected):
+    """Запрос не отправлен: цепь GigaChat для ключа разомкнута. Текст исключения показывается пользователю"""
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Ошибки, говорящие о сбое GigaChat: таймауты, ошибки соединения и ответы 5xx (но не 4xx и не 429)"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, ResponseError) and error.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для одного API-ключа и одного метода GigaChat.
+
+    После failure_threshold сбоев подряд цепь размыкается: запросы сразу получают UpstreamUnavailable
+    и не занимают очередь таймаутами. Через reset_timeout секунд пропускается один пробный запрос:
+    успех замыкает цепь, сбой снова размыкает её на reset_timeout.
+    """
+
+    def __init__(self, name: str, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self._name = name  # Метка очереди ключа в метриках
+        self._endpoint = endpoint
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._set_metric()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _set_metric(self):
+        metrics.CIRCUIT_STATE.labels(self._name, self._endpoint).set(_STATE_VALUES[self._state])
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        logger.warning("Цепь GigaChat %s/%s: %s -> %s", self._name, self._endpoint, self._state, state)
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        self._set_metric()
+
+    def _reject(self):
+        metrics.CIRCUIT_REJECTED.labels(self._name, self._endpoint).inc()
+        raise UpstreamUnavailable(UNAVAILABLE_TEXT)
+
+    def ensure_available(self):
+        """Отклонить запрос заранее (до постановки в очередь), если цепь разомкнута и пробовать ещё рано"""
+        if self._state == OPEN and time.monotonic() - self._opened_at < self._reset_timeout:
+            self._reject()
+
+    def _before_call(self):
+        if self._state == OPEN:
+            if time.monotonic() - self._opened_at < self._reset_timeout:
+                self._reject()
+            self._transition(HALF_OPEN)
+        if self._state == HALF_OPEN:
+            # Пока идёт пробный запрос, остальные не ждут его таймаута, а сразу получают отказ
+            if self._probe_in_flight:
+                self._reject()
+            self._probe_in_flight = True
+
+    def _record_success(self):
+        self._failures = 0
+        self._transition(CLOSED)
+
+    def _record_failure(self):
+        self._failures += 1
+        if self._state == HALF_OPEN or self._failures >= self._failure_threshold:
+            self._transition(OPEN)
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """
+        Выполнить запрос под защитой предохранителя.
+        Ошибки 4xx, 429 и отмена запроса на состояние цепи не влияют.
+        """
+        if self._failure_threshold <= 0:
+            yield
+            return
+        self._before_call()
+        probe = self._probe_in_flight
+        try:
+            yield
+        except BaseException as e:
+            if is_upstream_failure(e):
+                self._record_failure()
+            raise
+        else:
+            self._record_success()
+        finally:
+            if probe:
+                self._probe_in_flight = False
+
+    def forget_metrics(self):
+        try:
+            metrics.CIRCUIT_STATE.remove(self._name, self._endpoint)
+        except KeyError:
+            pass
+
+
+class CircuitBreakerRegistry:
+    """Предохранители по (хеш API-ключа, метод); создаются при первом обращении"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, key: str, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get((key, endpoint))
+        if breaker is None:
+            breaker = CircuitBreaker(key[:12], endpoint, self._failure_threshold, self._reset_timeout)
+            self._breakers[(key, endpoint)] = breaker
+        return breaker
+
+    def forget(self, key: str):
+        """Убрать предохранители ключа (вместе с удалением его простаивающей очереди)"""
+        for breaker_key in [breaker_key for breaker_key in self._breakers if breaker_key[0] == key]:
+            self._breakers.pop(breaker_key).forget_metrics()
+
+
+_registry = CircuitBreakerRegistry(config.CIRCUIT_BREAKER_FAILURES, config.CIRCUIT_BREAKER_RESET_TIMEOUT)
+
+
+def get_circuit_breaker_registry() -> CircuitBreakerRegistry:
+    return _registry
+
+
+def get_circuit_breaker(credentials: str, endpoint: str) -> CircuitBreaker:
+    """Предохранитель для API-ключа credentials и метода GigaChat endpoint ("chat", "files")"""
+    return _registry.get(credentials_key(credentials), endpoint)
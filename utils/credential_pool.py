@@ -0,0 +1,145 @@
+import itertools
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import config
+from utils import metrics
+from utils.circuit_breaker import OPEN, get_circuit_breaker
+from utils.gigachat_clients import credentials_key
+
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_COOLDOWN = 10.0  # На сколько секунд ключ выводится из балансировки после 429 без Retry-After
+UNAUTHORIZED_COOLDOWN = 600.0  # На сколько секунд не использовать ключ, отклонённый с 401
+
+
+class CredentialHealth:
+    """
+    Доступность API-ключей (ключей бота и пользователей) по последним ответам GigaChat.
+
+    После ответа 429 ключ отдыхает до Retry-After, после 402 (закончились токены) — exhausted_cooldown
+    секунд, после 401 — UNAUTHORIZED_COOLDOWN. Хранятся только ключи, которые сейчас отдыхают.
+    """
+
+    def __init__(self, exhausted_cooldown: float = 3600.0):
+        self._exhausted_cooldown = exhausted_cooldown
+        self._drained_until: Dict[str, float] = {}
+
+    def drained_for(self, credentials: str) -> float:
+        """Сколько ещё секунд ключ не стоит использовать (0 — доступен)"""
+        key = credentials_key(credentials)
+        until = self._drained_until.get(key)
+        if until is None:
+            return 0.0
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            self._restore(key)
+            return 0.0
+        return remaining
+
+    def _restore(self, key: str):
+        del self._drained_until[key]
+        if key in _pool_keys:
+            metrics.SHARED_KEY_AVAILABLE.labels(key[:12]).set(1)
+            logger.info("Ключ бота %s снова участвует в балансировке", key[:12])
+
+    def is_available(self, credentials: str) -> bool:
+        return self.drained_for(credentials) == 0 and get_circuit_breaker(credentials, "chat").state != OPEN
+
+    def _drain(self, credentials: str, seconds: float, reason: str):
+        key = credentials_key(credentials)
+        now = time.monotonic()
+        until = now + seconds
+        if until <= self._drained_until.get(key, 0.0):
+            return
+        # Заодно забываем ключи, которые уже отдохнули и больше не запрашивались
+        for expired in [expired for expired, expired_until in self._drained_until.items() if expired_until <= now]:
+            self._restore(expired)
+        self._drained_until[key] = until
+        if key in _pool_keys:
+            metrics.SHARED_KEY_AVAILABLE.labels(key[:12]).set(0)
+        logger.warning("Ключ %s выведен из использования на %.1f сек. (%s)", key[:12], seconds, reason)
+
+    def report_status(self, credentials: str, status_code: int, retry_after: Optional[float] = None):
+        """Учесть ответ GigaChat с ошибкой: 429 — перегрузка ключа, 402 — закончились токены, 401 — ключ отклонён"""
+        if status_code == 429:
+            self._drain(credentials, retry_after or RATE_LIMIT_COOLDOWN, "429")
+        elif status_code == 402:
+            self._drain(credentials, self._exhausted_cooldown, "402, исчерпан лимит")
+        elif status_code == 401:
+            self._drain(credentials, UNAUTHORIZED_COOLDOWN, "401, ключ отклонён")
+
+
+class SharedCredentialPool:
+    """
+    Ключи GigaChat бота (GIGACHAT_CREDENTIALS и GIGACHAT_CREDENTIALS_POOL) для пользователей без своего ключа.
+
+    Для каждой задачи выбирается наименее загруженный доступный ключ, при равной загрузке — тот,
+    в который дольше не ставились задачи. Ключ временно выводится из балансировки по ответам
+    GigaChat (см. CredentialHealth) и пока для него разомкнут предохранитель.
+    Если недоступны все ключи, выбирается тот, что освободится раньше других.
+
+    Выбор ключа ничего не меняет: обработчик, показывающий позицию в очереди, и сервис, который
+    затем ставит задачу, получают один и тот же ключ. Очерёдность обновляет только mark_placed.
+    """
+
+    def __init__(self, credentials: Tuple[str, ...], health: CredentialHealth):
+        self._credentials: List[str] = list(credentials)
+        self._keys: Dict[str, str] = {credentials_key(value): value for value in credentials}
+        self._health = health
+        self._placements = itertools.count()
+        self._placed_at: Dict[str, int] = {}  # Хеш ключа -> номер последней поставленной в него задачи
+        for key in self._keys:
+            metrics.SHARED_KEY_AVAILABLE.labels(key[:12]).set(1)
+
+    @property
+    def credentials(self) -> List[str]:
+        return list(self._credentials)
+
+    def __contains__(self, credentials: Optional[str]) -> bool:
+        return bool(credentials) and credentials_key(credentials) in self._keys
+
+    def is_available(self, credentials: str) -> bool:
+        return self._health.is_available(credentials)
+
+    def mark_placed(self, credentials: str):
+        """Учесть, что в ключ поставлена задача: при равной загрузке следующим будет выбран другой ключ"""
+        key = credentials_key(credentials)
+        if key in self._keys:
+            self._placed_at[key] = next(self._placements)
+
+    def _placed(self, credentials: str) -> int:
+        return self._placed_at.get(credentials_key(credentials), -1)
+
+    def choose(self, load: Callable[[str], int], exclude: Tuple[str, ...] = ()) -> Optional[str]:
+        """
+        Ключ для новой задачи.
+
+        :param load: Загрузка ключа (задачи в его очереди)
+        :param exclude: Ключи, которые не предлагать (например, уже занятые этим запросом)
+        :return: None, только если все ключи исключены
+        """
+        candidates = [value for value in self._credentials if value not in exclude]
+        if not candidates:
+            return None
+        available = [value for value in candidates if self.is_available(value)]
+        if available:
+            # При равной загрузке ключи нагружаются по очереди
+            return min(available, key=lambda value: (load(value), self._placed(value)))
+        return min(candidates, key=self._health.drained_for)
+
+
+# Хеши ключей бота: только по ним ведутся метрики доступности
+_pool_keys = {credentials_key(value) for value in config.GIGACHAT_CREDENTIALS_POOL}
+_health = CredentialHealth(config.GIGACHAT_EXHAUSTED_COOLDOWN)
+_pool = SharedCredentialPool(config.GIGACHAT_CREDENTIALS_POOL, _health)
+
+
+def get_credential_health() -> CredentialHealth:
+    return _health
+
+
+def get_shared_credential_pool() -> SharedCredentialPool:
+    return _pool
@@ -0,0 +1,137 @@
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from config import config
+from database import db_manager
+from database.repositories import AIAPIRepository
+from utils import metrics
+from utils.admission import current_generation_user
+from utils.credential_pool import get_credential_health
+from utils.generation_queue import GenerationFailover, credentials_load, select_shared_credentials
+from utils.gigachat_clients import credentials_key
+
+
+logger = logging.getLogger(__name__)
+
+# Ответы GigaChat, после которых задача переходит на следующий ключ: ключ отклонён, закончились токены, перегрузка
+FAILOVER_STATUSES = (401, 402, 429)
+
+USER = "user"  # Подключённый ключ пользователя
+SHARED = "shared"  # Ключ бота
+DISCONNECTED = "disconnected"  # Сохранённый, но отключённый ключ пользователя (GENERATION_FAILOVER_DISCONNECTED_KEYS)
+
+# При прочих равных: сначала ключ, который пользователь выбрал сам, отключённый — в последнюю очередь
+_PREFERENCE = {USER: 0, SHARED: 1, DISCONNECTED: 2}
+
+
+@dataclass(frozen=True)
+class Route:
+    """Ключ, с которым выполняется задача генерации, и откуда он взят"""
+    credentials: str
+    source: str
+
+    @property
+    def name(self) -> str:
+        """Метка ключа для логов (хеш, как у очередей в метриках)"""
+        return credentials_key(self.credentials)[:12]
+
+
+class CredentialFailover(GenerationFailover):
+    """Ключ маршрута отклонён GigaChat (401, 402 или 429): задача повторяется со следующим ключом"""
+
+    def __init__(self, route: Route, status_code: int):
+        super().__init__(f"{status_code} для ключа {route.name}")
+        self.route = route
+        self.status_code = status_code
+
+
+async def _disconnected_credentials(user_credentials: Optional[str]) -> Optional[str]:
+    """Отключённый пользователем ключ GigaChat (только если нет подключённого)"""
+    tg_id = current_generation_user.get()
+    if user_credentials or tg_id is None:
+        return None
+    async with db_manager.get_session() as session:
+        user_api = await AIAPIRepository(session).get_user_api_key(tg_id, "GigaChat")
+    return user_api.api_key if user_api and not user_api.connected else None
+
+
+def _is_saturated(credentials: Optional[str]) -> bool:
+    """Ключ бота не примет задачу сразу: недоступен или все его слоты заняты"""
+    if credentials is None:
+        return True
+    if not get_credential_health().is_available(credentials):
+        return True
+    return credentials_load(credentials) >= config.GENERATION_MAX_CONCURRENCY
+
+
+async def plan_routes(user_credentials: Optional[str], generation_type: str) -> List[Route]:
+    """
+    Ключи для задачи в порядке попыток.
+
+    Первым идёт самый быстрый путь: доступный ключ (не отдыхает после 401/402/429 и без разомкнутого
+    предохранителя) с наименьшей очередью, при равенстве — ключ пользователя. Остальные ключи —
+    запасные: на них задача переходит, если GigaChat отклонил предыдущий (см. CredentialFailover).
+    Без GENERATION_FAILOVER маршрут один — как раньше.
+    """
+    shared = select_shared_credentials()
+    if not config.GENERATION_FAILOVER:
+        return [Route(user_credentials or shared, USER if user_credentials else SHARED)]
+
+    candidates: List[Route] = []
+    if user_credentials:
+        candidates.append(Route(user_credentials, USER))
+    if shared is not None and shared != user_credentials:
+        candidates.append(Route(shared, SHARED))
+        spare = select_shared_credentials(exclude=(shared, user_credentials) if user_credentials else (shared,))
+        if spare is not None:
+            candidates.append(Route(spare, SHARED))
+    if config.GENERATION_FAILOVER_DISCONNECTED_KEYS and _is_saturated(shared):
+        disconnected = await _disconnected_credentials(user_credentials)
+        if disconnected:
+            candidates.append(Route(disconnected, DISCONNECTED))
+
+    health = get_credential_health()
+    routes = sorted(
+        candidates,
+        key=lambda route: (
+            not health.is_available(route.credentials),
+            credentials_load(route.credentials),
+            _PREFERENCE[route.source],
+        ),
+    )
+    primary = routes[0]
+    logger.info(
+        "Маршрут %s: ключ %s (%s), запасных ключей: %d",
+        generation_type, primary.name, primary.source, len(routes) - 1,
+        extra={
+            "event": "generation_route",
+            "user": current_generation_user.get(),
+            "generation_type": generation_type,
+            "routes": [f"{route.source}:{route.name}" for route in routes],
+        },
+    )
+    metrics.ROUTES.labels(generation_type, primary.source).inc()
+    return routes
+
+
+def log_failover(route: Route, next_route: Route, reason: str, generation_type: str):
+    """
+    Записать переход задачи на следующий ключ.
+
+    :param reason: Код ответа GigaChat ("401", "402", "429"), "circuit_open" — предохранитель ключа разомкнут,
+        "rejected" — задачу не приняла очередь ключа бота (квота пользователя)
+    """
+    logger.warning(
+        "Ключ %s (%s) недоступен (%s), задача %s переходит на ключ %s (%s)",
+        route.name, route.source, reason, generation_type, next_route.name, next_route.source,
+        extra={
+            "event": "generation_failover",
+            "user": current_generation_user.get(),
+            "generation_type": generation_type,
+            "from": f"{route.source}:{route.name}",
+            "to": f"{next_route.source}:{next_route.name}",
+            "reason": reason,
+        },
+    )
+    metrics.FAILOVERS.labels(route.source, next_route.source, reason).inc()
@@ -0,0 +1,37 @@
+import logging
+
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+
+from config import config
+from utils.redis_client import get_redis
+from utils.runtime import json_functions
+
+
+logger = logging.getLogger(__name__)
+
+FSM_KEY_PREFIX = "nko_fsm"
+
+
+def build_fsm_storage() -> BaseStorage:
+    """
+    Создаёт хранилище FSM: Redis (общий для всех экземпляров бота, с TTL ключей),
+    если задан REDIS_URL, иначе — хранилище в памяти процесса.
+    """
+    redis = get_redis()
+    if redis is None:
+        logger.info("FSM хранится в памяти процесса")
+        return MemoryStorage()
+
+    logger.info("FSM хранится в Redis")
+    # Компактный JSON без экранирования кириллицы (orjson при FAST_RUNTIME)
+    json_dumps, json_loads = json_functions(config.FAST_RUNTIME)
+    return RedisStorage(
+        redis,
+        key_builder=DefaultKeyBuilder(prefix=FSM_KEY_PREFIX),
+        state_ttl=config.FSM_STATE_TTL,
+        data_ttl=config.FSM_DATA_TTL,
+        json_dumps=json_dumps,
+        json_loads=json_loads,
+    )
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from ai_service.gigachat_ai_service import GigaChatService, get_gigachat_service
+from config import config
+from database import db_manager
+from database.models import GenerationJobModel, GenerationJobStatus
+from database.repositories import AIAPIRepository, ContentHistoryRepository, GenerationJobRepository
+from keyboards.inline_keyboards import get_regenerate_keyboard, get_retry_keyboard
+from utils.admission import GenerationRejected
+from utils.generation_queue import GenerationCancelled, GenerationExpired
+from utils.queue_progress import queue_status_updates
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько хранить завершённые задачи в БД
+FINISHED_JOBS_RETENTION = timedelta(days=7)
+
+RESUMED_TEXT = "♻️ Бот был перезапущен. Ваш запрос не потерян — продолжаю генерацию, подождите🔄️"
+CANCELLED_TEXT = "🚫 Генерация отменена."
+RETRY_CALLBACK_PREFIX = "generation_retry:"
+
+
+@dataclass(frozen=True)
+class JobOperation:
+    """Операция генерации, которую можно выполнить заново по сохранённым параметрам"""
+    run: Callable[[GigaChatService, Dict[str, Any], Optional[str], Callable[[], Awaitable[None]]], Awaitable[str]]
+    error_text: str
+    empty_text: str = "Не удалось сгенерировать текст. Попробуйте пересоздать или попробуйте позже."
+    regenerate: bool = True  # Добавлять к результату кнопку перегенерации
+
+
+def nko_snapshot(nko_data) -> Optional[Dict[str, Any]]:
+    """Данные НКО в виде словаря, чтобы сохранить их вместе с задачей"""
+    if not nko_data:
+        return None
+    return {
+        "name": nko_data.name,
+        "description": nko_data.description,
+        "activities": nko_data.activities,
+        "organization_size": nko_data.organization_size,
+    }
+
+
+def _nko(args: Dict[str, Any]):
+    nko = args.get("nko")
+    return SimpleNamespace(**nko) if nko else None
+
+
+async def _free_text(service: GigaChatService, args, user_api_key, on_start) -> str:
+    result, _ = await service.generate_free_text(
+        user_idea=args["user_idea"],
+        nko_data=_nko(args),
+        user_api_key=user_api_key,
+        on_start_callback=on_start
+    )
+    return result
+
+
+async def _structured_post(service: GigaChatService, args, user_api_key, on_start) -> str:
+    return await service.generate_structured_post(
+        event_info=args["event_info"],
+        nko_data=_nko(args),
+        user_api_key=user_api_key
+    )
+
+
+async def _text_from_examples(service: GigaChatService, args, user_api_key, on_start) -> str:
+    return await service.generate_text_from_examples(
+        example_posts=args["examples"],
+        new_idea=args["new_idea"],
+        user_api_key=user_api_key,
+        nko_data=_nko(args)
+    )
+
+
+async def _edit_text(service: GigaChatService, args, user_api_key, on_start) -> str:
+    result, _ = await service.edit_text(
+        text=args["text"],
+        user_api_key=user_api_key,
+        on_start_callback=on_start
+    )
+    return result
+
+
+async def _edit_text_with_wishes(service: GigaChatService, args, user_api_key, on_start) -> str:
+    result, _ = await service.edit_text_with_wishes(
+        text=args["text"],
+        user_wishes=args["user_wishes"],
+        user_api_key=user_api_key,
+        on_start_callback=on_start
+    )
+    return result
+
+
+# Реестр операций: имя операции сохраняется в задаче и по нему задача выполняется после перезапуска
+OPERATIONS: Dict[str, JobOperation] = {
+    "free_text": JobOperation(
+        run=_free_text,
+        error_text="❌ Не удалось создать текст. Попробуйте позже.",
+    ),
+    "structured_post": JobOperation(
+        run=_structured_post,
+        error_text="❌ Не удалось сгенерировать пост. Попробуйте позже.",
+    ),
+    "text_from_examples": JobOperation(
+        run=_text_from_examples,
+        error_text="❌ Не удалось сгенерировать текст. Попробуйте позже.",
+    ),
+    "edit_text": JobOperation(
+        run=_edit_text,
+        error_text="❌ Не удалось отредактировать текст. Попробуйте еще раз.",
+        empty_text="Не удалось отредактировать текст. Попробуйте еще раз.",
+        regenerate=False,
+    ),
+    "edit_text_with_wishes": JobOperation(
+        run=_edit_text_with_wishes,
+        error_text="❌ Произошла ошибка при редактировании текста. Попробуйте позже.",
+        empty_text="Не удалось отредактировать текст. Попробуйте еще раз.",
+    ),
+}
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_jobs: Set[asyncio.Task] = set()
+
+
+async def _edit_status(bot: Bot, job: GenerationJobModel, text: str, reply_markup=None, markdown: bool = False):
+    """Заменить текст статус-сообщения задачи (с Markdown, если получится)"""
+    if markdown:
+        try:
+            await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.status_message_id,
+                                        parse_mode="Markdown", reply_markup=reply_markup)
+            return
+        except Exception:
+            pass
+    try:
+        await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.status_message_id,
+                                    reply_markup=reply_markup)
+    except Exception as e:
+        logger.warning(f"Не удалось обновить сообщение задачи генерации {job.id}: {e}")
+
+
+async def _set_status(job_id: int, status: str, error: Optional[str] = None):
+    async with db_manager.get_session() as session:
+        await GenerationJobRepository(session).set_status(job_id, status, error=error)
+
+
+async def _deliver(bot: Bot, job: GenerationJobModel, result: Optional[str], history_id: int):
+    """Отправить результат пользователю и завершить задачу"""
+    operation = OPERATIONS[job.operation]
+    reply_markup = get_regenerate_keyboard(history_id) if operation.regenerate else None
+    if result:
+        await _edit_status(bot, job, result, reply_markup=reply_markup, markdown=True)
+    else:
+        await _edit_status(bot, job, operation.empty_text, reply_markup=reply_markup)
+    await _set_status(job.id, GenerationJobStatus.DONE)
+
+
+async def _process_job(bot: Bot, job: GenerationJobModel, user_api_key: Optional[str]):
+    """Выполнить задачу: генерация, сохранение в историю и отправка результата"""
+    operation = OPERATIONS[job.operation]
+
+    async def on_start():
+        # Ошибки не глушим: если статус-сообщение удалено, очередь отменит задачу
+        if job.progress_text:
+            await bot.edit_message_text(job.progress_text, chat_id=job.chat_id, message_id=job.status_message_id)
+        else:
+            # Текст менять не нужно, но удаление сообщения всё равно должно отменить задачу
+            await bot.edit_message_reply_markup(chat_id=job.chat_id, message_id=job.status_message_id)
+
+    try:
+        await _set_status(job.id, GenerationJobStatus.RUNNING)
+        # Пока задача ждёт очереди, статус-сообщение показывает её позицию и оценку времени
+        with queue_status_updates(bot, job.chat_id, job.status_message_id):
+            result = await operation.run(get_gigachat_service(), job.params, user_api_key, on_start)
+    except GenerationRejected as e:
+        await _set_status(job.id, GenerationJobStatus.FAILED, error="rejected")
+        await _edit_status(bot, job, str(e))
+        return
+    except GenerationCancelled:
+        await _set_status(job.id, GenerationJobStatus.CANCELLED)
+        await _edit_status(bot, job, CANCELLED_TEXT)
+        return
+    except GenerationExpired as e:
+        await _set_status(job.id, GenerationJobStatus.EXPIRED)
+        await _edit_status(bot, job, str(e), reply_markup=get_retry_keyboard(f"{RETRY_CALLBACK_PREFIX}{job.id}"))
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении задачи генерации {job.id} ({job.operation}): {e}", exc_info=True)
+        await _set_status(job.id, GenerationJobStatus.FAILED, error=str(e))
+        await _edit_status(bot, job, operation.error_text)
+        return
+
+    # История и статус фиксируются одной транзакцией, чтобы после перезапуска не сгенерировать результат повторно
+    async with db_manager.get_session() as session:
+        history_entry = await ContentHistoryRepository(session).add_content_history(
+            tg_id=job.tg_id,
+            model="gigachat",
+            result=result,
+            **(job.history_params or {})
+        )
+        await GenerationJobRepository(session).set_status(
+            job.id, GenerationJobStatus.GENERATED, history_id=history_entry.id
+        )
+    await _deliver(bot, job, result, history_entry.id)
+
+
+async def run_generation_job(
+        bot: Bot,
+        tg_id: int,
+        status_message: Message,
+        operation: str,
+        params: Dict[str, Any],
+        history_params: Dict[str, Any],
+        user_api_key: Optional[str] = None,
+        progress_text: Optional[str] = None,
+) -> None:
+    """
+    Сохранить задачу генерации в БД и выполнить её.
+    Результат (или сообщение об ошибке) заменяет статус-сообщение status_message.
+
+    :param operation: Имя операции из OPERATIONS
+    :param params: Аргументы операции (должны сериализоваться в JSON)
+    :param history_params: Поля записи истории генераций (content_type, prompt, style, additional_params)
+    :param user_api_key: Ключ пользователя; в задаче сохраняется только признак того, что он был указан
+    :param progress_text: Текст статус-сообщения, когда задача дошла до начала очереди
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Неизвестная операция генерации: {operation}")
+
+    async with db_manager.get_session() as session:
+        job = await GenerationJobRepository(session).create(
+            tg_id=tg_id,
+            chat_id=status_message.chat.id,
+            status_message_id=status_message.message_id,
+            operation=operation,
+            params=params,
+            history_params=history_params,
+            progress_text=progress_text,
+            credential_ref="user" if user_api_key else "default",
+            owner=config.INSTANCE_NAME,
+        )
+    await _process_job(bot, job, user_api_key)
+
+
+async def _user_api_key(ai_api_repo: AIAPIRepository, job: GenerationJobModel) -> Optional[str]:
+    """Ключ для повторного выполнения задачи: ключ пользователя, если задача создавалась с ним и он ещё подключён"""
+    if job.credential_ref != "user":
+        return None
+    user_api = await ai_api_repo.get_user_api_key(job.tg_id, "GigaChat")
+    # Если пользователь отключил свой ключ, задача выполнится с ключом бота
+    return user_api.api_key if user_api and user_api.connected else None
+
+
+async def retry_generation_job(bot: Bot, job_id: int, tg_id: int) -> bool:
+    """
+    Повторить задачу, не уложившуюся в крайний срок (кнопка «Повторить» под статус-сообщением).
+    Параметры берутся из сохранённой задачи, результат заменяет то же статус-сообщение.
+
+    :return: False, если задача не найдена, чужая или уже не просрочена (например, кнопку нажали дважды)
+    """
+    async with db_manager.get_session() as session:
+        job = await GenerationJobRepository(session).claim_expired(job_id, tg_id, config.INSTANCE_NAME)
+        if job is None:
+            return False
+        user_api_key = await _user_api_key(AIAPIRepository(session), job)
+    if job.operation not in OPERATIONS:
+        await _set_status(job.id, GenerationJobStatus.FAILED, error="unknown operation")
+        return False
+    await _process_job(bot, job, user_api_key)
+    return True
+
+
+async def _resume_job(bot: Bot, job: GenerationJobModel, user_api_key: Optional[str], history_result: Optional[str]):
+    try:
+        if job.status == GenerationJobStatus.GENERATED:
+            # Результат уже получен и сохранён — осталось его отправить
+            await _deliver(bot, job, history_result, job.history_id)
+        else:
+            await _edit_status(bot, job, RESUMED_TEXT)
+            await _process_job(bot, job, user_api_key)
+    except Exception as e:
+        logger.error(f"Не удалось продолжить задачу генерации {job.id}: {e}", exc_info=True)
+
+
+async def resume_generation_jobs(bot: Bot) -> int:
+    """
+    Продолжить задачи генерации, прерванные перезапуском бота, и удалить старые завершённые задачи.
+    Возобновляются только задачи этого экземпляра (INSTANCE_NAME), чтобы не перехватить работу других реплик.
+
+    :return: Количество возобновлённых задач
+    """
+    resumed = []
+    async with db_manager.get_session() as session:
+        job_repo = GenerationJobRepository(session)
+        removed = await job_repo.delete_finished_before(datetime.now(timezone.utc) - FINISHED_JOBS_RETENTION)
+        if removed:
+            logger.info(f"Удалено завершённых задач генерации: {removed}")
+
+        ai_api_repo = AIAPIRepository(session)
+        history_repo = ContentHistoryRepository(session)
+        for job in await job_repo.get_unfinished(config.INSTANCE_NAME):
+            if job.operation not in OPERATIONS:
+                logger.error(f"Задача генерации {job.id}: неизвестная операция {job.operation}")
+                await job_repo.set_status(job.id, GenerationJobStatus.FAILED, error="unknown operation")
+                continue
+
+            user_api_key = await _user_api_key(ai_api_repo, job)
+
+            history_result = None
+            if job.status == GenerationJobStatus.GENERATED and job.history_id:
+                history_entry = await history_repo.get_by_id(job.history_id)
+                history_result = history_entry.result if history_entry else None
+
+            resumed.append((job, user_api_key, history_result))
+
+    for job, user_api_key, history_result in resumed:
+        task = asyncio.create_task(_resume_job(bot, job, user_api_key, history_result))
+        _background_jobs.add(task)
+        task.add_done_callback(_background_jobs.discard)
+
+    if resumed:
+        logger.info(f"Возобновлено задач генерации после перезапуска: {len(resumed)}")
+    return len(resumed)
@@ -1,14 +1,66 @@
 import asyncio
-import hashlib
+import heapq
+import itertools
 import logging
-from typing import Callable, Any, Awaitable, Optional, Dict
+import time
+from contextvars import ContextVar
+from typing import Callable, Any, Awaitable, Optional, Dict, List, Set, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 
+from aiogram.exceptions import TelegramBadRequest
+from opentelemetry import context as otel_context
+
 from config import config
+from utils import metrics
+from utils.tracing import start_span, tracer
+from utils.admission import AdmissionController, current_generation_user, get_admission_controller
+from utils.circuit_breaker import get_circuit_breaker_registry
+from utils.credential_pool import get_shared_credential_pool
+from utils.gigachat_clients import credentials_key, get_gigachat_client_pool
+from utils.rate_limiter import forget_key_limiter
+from utils.queue_backends import QueueBackend, RedisQueueBackend
+from utils.queue_progress import Progress, current_progress_callback, get_progress_notifier
+from utils.redis_client import get_redis
 
 logger = logging.getLogger(__name__)
 
+START_CALLBACK_TIMEOUT = 5.0  # Сколько ждать уведомления о начале обработки (правка сообщения в Telegram)
+SERVICE_TIME_ALPHA = 0.2  # Вес нового замера в скользящей (EWMA) оценке времени выполнения задачи
+
+# Операция генерации текущего обновления (флаг generation обработчика, устанавливается GenerationGuardMiddleware)
+current_generation_operation: ContextVar[Optional[str]] = ContextVar("current_generation_operation", default=None)
+
+
+# Крайний срок выполняемой задачи (time.monotonic); задаётся воркером на время шага задачи
+_task_deadline: ContextVar[Optional[float]] = ContextVar("generation_task_deadline", default=None)
+
+
+class GenerationCancelled(Exception):
+    """Задача генерации отменена: командой /cancel, более новым запросом той же операции или удалением статус-сообщения"""
+
+
+class GenerationExpired(Exception):
+    """Задача генерации не уложилась в крайний срок (GENERATION_DEADLINES). Текст исключения показывается пользователю"""
+
+
+class GenerationFailover(Exception):
+    """Задача должна перейти на другой ключ: исключение передаётся обработчику без записи об ошибке воркера"""
+
+
+EXPIRED_TEXT = "⌛ Запрос не удалось выполнить вовремя, и мы остановили его, чтобы не присылать устаревший ответ."
+
+
+def remaining_budget() -> Optional[float]:
+    """
+    Сколько секунд осталось до крайнего срока текущей задачи генерации (None — срока нет
+    или код выполняется не в задаче очереди). По нему ограничиваются таймауты HTTP-запросов.
+    """
+    deadline = _task_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
 
 class GenerationType(Enum):
     """Типы генерации"""
@@ -29,19 +81,105 @@ class GenerationTask:
     retry_delay: float = 2.0  # Задержка перед повтором в секундах
     future: asyncio.Future = field(default_factory=asyncio.Future)
     on_start_callback: Optional[Callable[[], Awaitable[None]]] = None  # Callback для обновления сообщения при начале обработки
+    enqueued_at: float = field(default_factory=time.monotonic)
+    deadline: Optional[float] = None  # Крайний срок (time.monotonic): позже задача не выполняется
+    started: bool = False  # Задача дошла до выполнения (для метрик глубины очереди)
+    trace_context: Any = None  # Контекст span задачи: воркер выполняет её в другой asyncio-задаче
+    wait_span: Any = None  # Span ожидания в очереди (завершается, когда задача дошла до выполнения)
+    start_notification: Optional[asyncio.Task] = None  # Фоновый вызов on_start_callback
+    user_id: Optional[int] = None  # Пользователь и операция — по ним задачу находят /cancel и более новый запрос
+    operation: Optional[str] = None
+    cancelled: bool = False  # Надгробие: отменённая задача остаётся в куче, воркер пропускает её
+    running: Optional[asyncio.Task] = None  # Ожидание общей очереди или запрос к модели (прерывается при отмене)
+    sequence: int = 0  # Порядок в куче готовых задач (по нему считается позиция в очереди)
+
+
+class TaskHandle:
+    """Ссылка на задачу в очереди генерации, через которую её можно отменить"""
+
+    def __init__(self, queue: "GenerationQueue", task: GenerationTask):
+        self._queue = queue
+        self._task = task
+
+    @property
+    def task_id(self) -> str:
+        return self._task.task_id
+
+    @property
+    def user_id(self) -> Optional[int]:
+        return self._task.user_id
+
+    @property
+    def operation(self) -> Optional[str]:
+        return self._task.operation
+
+    def done(self) -> bool:
+        return self._task.future.done()
+
+    def cancel(self) -> bool:
+        """
+        Отменить задачу: ожидающая задача помечается надгробием (без поиска в очереди),
+        выполняющаяся прерывается вместе с HTTP-запросом. Ожидающий результата обработчик
+        получает GenerationCancelled. Возвращает False, если задача уже завершилась.
+        """
+        return self._queue.cancel_task(self._task)
+
+
+# Незавершённые задачи пользователей: для /cancel и замены запроса более новым
+_user_tasks: Dict[int, Set[TaskHandle]] = {}
+
+# Оценки времени выполнения по типам генерации для всех ключей: с ними начинает новая очередь
+_service_times: Dict[str, float] = {}
+
+
+def _ewma(previous: Optional[float], value: float) -> float:
+    return value if previous is None else previous + SERVICE_TIME_ALPHA * (value - previous)
+
+
+def cancel_generations(user_id: int, operation: Optional[str] = None) -> int:
+    """
+    Отменить задачи генерации пользователя во всех очередях (только операции operation, если она указана).
+
+    :return: Количество отменённых задач
+    """
+    cancelled = 0
+    for handle in list(_user_tasks.get(user_id, ())):
+        if (operation is None or handle.operation == operation) and handle.cancel():
+            cancelled += 1
+    if cancelled:
+        logger.info("Пользователь %s: отменено задач генерации: %d", user_id, cancelled)
+    return cancelled
 
 
 class GenerationQueue:
     """
     Очередь для последовательной обработки запросов генерации.
     Обеспечивает обработку запросов один за другим и автоматический retry при ошибке 429.
+    Порядок и число одновременных запросов между экземплярами бота согласуются через backend.
+
+    Воркер не ждёт ни уведомления о начале обработки (оно отправляется в фоне), ни паузы перед
+    повтором: задача, получившая 429 или таймаут, откладывается до своего времени (куча отложенных
+    задач), а воркер тем временем выполняет другие готовые задачи.
     """
     
-    def __init__(self):
-        self._queue: asyncio.Queue[GenerationTask] = asyncio.Queue()
+    def __init__(self, backend: Optional[QueueBackend] = None, admission: Optional[AdmissionController] = None,
+                 name: str = "default"):
+        self._name = name  # Метка очереди в метриках (часть хеша ключа, не сам ключ)
+        self._backend = backend or QueueBackend()
+        self._admission = admission  # Квоты пользователей (только для очереди общего ключа)
+        # Готовые задачи по порядку постановки и отложенные до повтора (время, порядок, задача)
+        self._ready: List[Tuple[int, GenerationTask]] = []
+        self._delayed: List[Tuple[float, int, GenerationTask]] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._notifications: Set[asyncio.Task] = set()  # Ссылки на фоновые уведомления, чтобы их не собрал GC
         self._worker_task: Optional[asyncio.Task] = None
         self._is_running = False
         self._current_task: Optional[GenerationTask] = None
+        self._active = 0  # Вызовы add_task, которые ещё не завершились
+        self._idle_since = time.monotonic()
+        self._service_times: Dict[str, float] = {}  # EWMA времени выполнения задач этого ключа по типам
+        self._current_started_at: Optional[float] = None  # Когда текущая задача начала выполняться
         
     async def start(self):
         """Запуск воркера для обработки очереди"""
@@ -59,6 +197,7 @@ class GenerationQueue:
                 await self._worker_task
             except asyncio.CancelledError:
                 pass
+        await self._backend.close()
         logger.info("Очередь генерации остановлена")
     
     async def add_task(
@@ -76,147 +215,493 @@ class GenerationQueue:
         :param task_id: Уникальный ID задачи (опционально)
         :param on_start_callback: Callback для вызова при начале обработки задачи
         :return: Кортеж (результат выполнения корутины, позиция в очереди)
+        :raises GenerationRejected: Если пользователь превысил квоту (задача не ставится в очередь)
+        :raises GenerationCancelled: Если задачу отменили (см. cancel_generations)
+        :raises GenerationExpired: Если задача не уложилась в крайний срок своего типа (GENERATION_DEADLINES)
         """
         if not task_id:
             import uuid
             task_id = str(uuid.uuid4())
         
+        user_id = current_generation_user.get()
         task = GenerationTask(
             task_id=task_id,
             generation_type=generation_type,
             coro=coro,
-            on_start_callback=on_start_callback
+            on_start_callback=on_start_callback,
+            user_id=user_id,
+            operation=current_generation_operation.get(),
         )
         
-        # Future создается в __post_init__
-        future = task.future
-        
+        # Счётчик увеличивается до первого await: менеджер не удалит очередь, в которую уже ставят задачу
+        self._active += 1
+        try:
+            if self._admission is not None and user_id is not None:
+                async with self._admission.admit(user_id, generation_type.value):
+                    return await self._enqueue_and_wait(task)
+            return await self._enqueue_and_wait(task)
+        finally:
+            self._active -= 1
+            if not self._active:
+                self._idle_since = time.monotonic()
+
+    def idle_for(self) -> Optional[float]:
+        """Сколько секунд очередь простаивает; None — в ней есть задачи или фоновая работа"""
+        if self._active or self._ready or self._delayed or self._current_task is not None or self._notifications:
+            return None
+        return time.monotonic() - self._idle_since
+
+    async def _enqueue_and_wait(self, task: GenerationTask) -> tuple[Any, int]:
+        """Поставить задачу в очередь и дождаться результата"""
         if not self._is_running:
             await self.start()
 
-        queue_size = self.get_pending_tasks_count()
-        position = queue_size + 1
-        await self._queue.put(task)
-        logger.info(
-            f"Задача {task_id} добавлена в очередь (тип: {generation_type.value}, "
-            f"позиция в очереди: {position})"
-        )
-        
-        # Ждем результата
-        result = await future
-        return result, position
+        with start_span("generation.task", queue=self._name, generation_type=task.generation_type.value) as span:
+            queue_size = await self.count_pending_tasks()
+            position = queue_size + 1
+            span.set_attribute("generation.queue_position", position)
+            await self._backend.register(task.task_id)
+            task.enqueued_at = time.monotonic()
+            budget = dict(config.GENERATION_DEADLINES).get(task.generation_type.value)
+            if budget:
+                task.deadline = task.enqueued_at + budget
+            task.trace_context = otel_context.get_current()
+            task.wait_span = tracer.start_span("generation.queue_wait")
+            self._push_ready(task)
+            handle = None
+            if task.user_id is not None:
+                handle = TaskHandle(self, task)
+                _user_tasks.setdefault(task.user_id, set()).add(handle)
+            metrics.QUEUE_DEPTH.labels(self._name, task.generation_type.value).inc()
+            logger.info("Задача %s добавлена в очередь (тип: %s, позиция в очереди: %d)",
+                        task.task_id, task.generation_type.value, position)
+            progress_callback = current_progress_callback.get()
+            if progress_callback is not None:
+                get_progress_notifier().track(task.task_id, self.waiting_progress, progress_callback)
+
+            # Ждем результата
+            try:
+                result = await asyncio.shield(task.future)
+            except asyncio.CancelledError:
+                # Ожидание прервано (например, дубль запроса уже получил ответ) — задача не должна занимать очередь
+                if self.cancel_task(task):
+                    task.future.exception()
+                raise
+            finally:
+                if handle is not None:
+                    handles = _user_tasks.get(task.user_id)
+                    if handles is not None:
+                        handles.discard(handle)
+                        if not handles:
+                            del _user_tasks[task.user_id]
+                # Результат отправляется пользователю после уведомления о начале и правки позиции, а не наоборот
+                await get_progress_notifier().settle(task.task_id)
+                if task.start_notification is not None:
+                    await task.start_notification
+            span.set_attribute("generation.retries", task.retry_count)
+            return result, position
+
+    def _push_ready(self, task: GenerationTask):
+        task.sequence = next(self._sequence)
+        heapq.heappush(self._ready, (task.sequence, task))
+        self._wakeup.set()
+
+    def _schedule_retry(self, task: GenerationTask, delay: float):
+        """Отложить задачу до повтора; воркер вернётся к ней через delay секунд (если успеет до крайнего срока)"""
+        if task.deadline is not None and time.monotonic() + delay >= task.deadline:
+            self._expire(task, "retry")
+            return
+        heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), task))
+        self._wakeup.set()
+
+    async def _promote_due(self):
+        """
+        Перенести отложенные задачи, время которых пришло, в готовые.
+        В общую очередь backend они встают заново только сейчас: задачи, поставленные раньше,
+        выполняются раньше, и порядок локальной и общей очереди совпадает.
+        """
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, task = heapq.heappop(self._delayed)
+            if task.cancelled:
+                continue
+            try:
+                await self._backend.register(task.task_id)
+            except Exception as e:
+                logger.error("Не удалось вернуть задачу %s в общую очередь: %s", task.task_id, e)
+                if not task.future.done():
+                    task.future.set_exception(e)
+                continue
+            self._push_ready(task)
+
+    async def _next_task(self) -> Optional[GenerationTask]:
+        """
+        Следующая готовая задача; None, если воркер проснулся без неё (пришло время отложенной задачи).
+        Пустая очередь не опрашивается: воркер спит, пока задачу не поставят (или не остановят очередь).
+        """
+        await self._promote_due()
+        while self._ready:
+            task = heapq.heappop(self._ready)[1]
+            if not task.cancelled:
+                return task
+        self._wakeup.clear()
+        if not self._delayed:
+            await self._wakeup.wait()
+            return None
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, self._delayed[0][0] - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        return None
+
+    def _notify_started(self, task: GenerationTask):
+        """Уведомление о начале обработки в фоне: воркер не ждёт ответа Telegram"""
+        async def notify():
+            try:
+                # Начатая правка позиции в очереди не должна лечь поверх сообщения о начале обработки
+                await get_progress_notifier().settle(task.task_id)
+                await asyncio.wait_for(task.on_start_callback(), timeout=START_CALLBACK_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("on_start_callback задачи %s не уложился в %s сек.", task.task_id, START_CALLBACK_TIMEOUT)
+            except TelegramBadRequest as e:
+                error = str(e).lower()
+                # Сообщение уже показывает этот текст (задача началась сразу) — правка не нужна
+                if "message is not modified" in error:
+                    pass
+                # Статус-сообщение удалено — результат некому показывать, задача отменяется
+                elif "message to edit not found" in error:
+                    logger.info("Статус-сообщение задачи %s удалено, задача отменяется", task.task_id)
+                    self.cancel_task(task)
+                else:
+                    logger.error(f"Ошибка при вызове on_start_callback: {e}", exc_info=True)
+            except Exception as e:
+                logger.error(f"Ошибка при вызове on_start_callback: {e}", exc_info=True)
+
+        task.start_notification = asyncio.create_task(notify())
+        self._notifications.add(task.start_notification)
+        task.start_notification.add_done_callback(self._notifications.discard)
+
+    def _spawn(self, coro: Awaitable[Any]):
+        """Фоновая задача очереди (ссылка хранится, пока задача не завершится)"""
+        background = asyncio.create_task(coro)
+        self._notifications.add(background)
+        background.add_done_callback(self._notifications.discard)
+
+    def cancel_task(self, task: GenerationTask) -> bool:
+        """Отменить задачу (см. TaskHandle.cancel)"""
+        if task.cancelled or task.future.done():
+            return False
+        task.cancelled = True
+        if task.running is not None:
+            # Задача выполняется или ждёт своей очереди среди экземпляров — прерываем ожидание или запрос
+            stage = "running"
+            task.running.cancel()
+        else:
+            # Задача ещё в очереди: остаётся в куче надгробием, из общей очереди backend убирается сразу
+            stage = "queued"
+            self._mark_started(task, observe_wait=False)
+            self._spawn(self._backend.discard(task.task_id))
+        metrics.CANCELLED.labels(self._name, task.generation_type.value, stage).inc()
+        task.future.set_exception(GenerationCancelled("Генерация отменена"))
+        logger.info("Задача %s отменена (%s)", task.task_id, stage)
+        return True
+
+    async def _run_cancellable(self, task: GenerationTask, coro: Awaitable[Any]) -> Any:
+        """
+        Выполнить шаг задачи так, чтобы cancel_task мог его прервать; при отмене — GenerationCancelled.
+        Шаг прерывается и по крайнему сроку задачи (GenerationExpired), а сам срок доступен
+        коду шага через remaining_budget().
+        """
+        token = _task_deadline.set(task.deadline)
+        try:
+            task.running = asyncio.ensure_future(coro)  # Задача получает копию контекста вместе со сроком
+        finally:
+            _task_deadline.reset(token)
+        try:
+            if task.deadline is None:
+                return await task.running
+            return await asyncio.wait_for(task.running, timeout=max(0.0, task.deadline - time.monotonic()))
+        except asyncio.CancelledError:
+            # Отменили саму задачу, а не воркер (при остановке очереди CancelledError пробрасывается)
+            if task.cancelled and not asyncio.current_task().cancelling():
+                raise GenerationCancelled("Генерация отменена")
+            raise
+        except asyncio.TimeoutError:
+            if self._past_deadline(task):
+                raise GenerationExpired(EXPIRED_TEXT)
+            raise
+        finally:
+            task.running = None
+
+    @staticmethod
+    def _past_deadline(task: GenerationTask) -> bool:
+        return task.deadline is not None and time.monotonic() >= task.deadline
+
+    def _expire(self, task: GenerationTask, stage: str):
+        """Задача не уложилась в крайний срок: обработчик получает GenerationExpired"""
+        self._mark_started(task)
+        if task.future.done():
+            return
+        metrics.EXPIRED.labels(self._name, task.generation_type.value, stage).inc()
+        task.future.set_exception(GenerationExpired(EXPIRED_TEXT))
+        logger.info("Задача %s пропущена: истёк крайний срок (%s, ждала %.1f сек.)",
+                    task.task_id, stage, time.monotonic() - task.enqueued_at)
     
     async def _worker(self):
         """Воркер для обработки задач из очереди"""
         while self._is_running:
             task = None
             try:
-                # Получаем задачу из очереди (с таймаутом для возможности остановки)
-                try:
-                    task = await asyncio.wait_for(self._queue.get(), timeout=1.0)
-                except asyncio.TimeoutError:
+                task = await self._next_task()
+                if task is None:
                     continue
-                
+                if self._past_deadline(task):
+                    # Пользователь уже не ждёт ответа — место в очереди достаётся следующим задачам
+                    await self._backend.discard(task.task_id)
+                    self._expire(task, "queued")
+                    continue
+
                 self._current_task = task
-                logger.info(f"Обработка задачи {task.task_id} (тип: {task.generation_type.value})")
-                
-                # Вызываем callback при начале обработки (для обновления сообщения)
-                if task.on_start_callback:
+                # Ждём своей очереди среди всех экземпляров бота
+                try:
+                    await self._run_cancellable(task, self._backend.acquire(task.task_id))
+                except GenerationCancelled:
+                    # Задачу отменили, пока она ждала общей очереди
+                    self._mark_started(task, observe_wait=False)
+                    await self._backend.discard(task.task_id)
+                    self._current_task = None
+                    continue
+                except GenerationExpired:
+                    await self._backend.discard(task.task_id)
+                    self._expire(task, "queued")
+                    self._current_task = None
+                    continue
+                self._mark_started(task)
+                self._current_started_at = time.monotonic()
+                logger.info("Обработка задачи %s (тип: %s, попытка %d)",
+                            task.task_id, task.generation_type.value, task.retry_count + 1)
+
+                # Span выполнения — дочерний для span задачи из обработчика, вызовы GigaChat и Bot API попадают в него
+                retry_delay = None
+                failover = None
+                with start_span("generation.execute", context=task.trace_context, attempt=task.retry_count + 1):
+                    # Уведомляем о начале обработки (для обновления сообщения) только при первой попытке
+                    if task.on_start_callback and task.start_notification is None:
+                        self._notify_started(task)
+
+                    started_at = time.monotonic()
+                    outcome = "error"
                     try:
-                        await task.on_start_callback()
+                        result = await self._run_cancellable(task, task.coro())
+                        outcome = "ok"
+                    except GenerationCancelled:
+                        # Запрос к модели прерван отменой, обработчик уже получил GenerationCancelled
+                        outcome = "cancelled"
+                    except GenerationExpired:
+                        outcome = "expired"
+                    except GenerationFailover as e:
+                        # Ключ отклонил задачу — её повторит следующий маршрут, это не ошибка
+                        failover = e
+                        outcome = "failover"
                     except Exception as e:
-                        logger.error(f"Ошибка при вызове on_start_callback: {e}", exc_info=True)
-                
-                # Выполняем задачу с retry при ошибке 429
-                result = await self._execute_with_retry(task)
-                
+                        # Временная ошибка — задача откладывается, иначе исключение уходит в обработчик
+                        retry_delay = self._retry_delay(task, e)
+                        outcome = "retry"
+                    finally:
+                        elapsed = time.monotonic() - started_at
+                        metrics.EXECUTION_TIME.labels(self._name, task.generation_type.value, outcome).observe(elapsed)
+                        if outcome == "ok":
+                            self._observe_service_time(task.generation_type, elapsed)
+                        await self._backend.release(task.task_id)
+
+                self._current_task = None
+                self._current_started_at = None
+                if outcome == "cancelled":
+                    continue
+                if outcome == "expired":
+                    self._expire(task, "running")
+                    continue
+                if retry_delay is not None:
+                    self._schedule_retry(task, retry_delay)
+                    continue
+                if failover is not None:
+                    if not task.future.done():
+                        task.future.set_exception(failover)
+                    continue
+
                 # Отправляем результат в Future
                 if not task.future.done():
                     task.future.set_result(result)
-                
-                self._current_task = None
-                self._queue.task_done()
-                
+
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Ошибка в воркере очереди: {e}", exc_info=True)
+                if task:
+                    self._mark_started(task)
+                    try:
+                        await self._backend.discard(task.task_id)
+                    except Exception as discard_error:
+                        logger.error(f"Не удалось убрать задачу из общей очереди: {discard_error}")
                 if task and not task.future.done():
                     task.future.set_exception(e)
                 self._current_task = None
-    
-    async def _execute_with_retry(self, task: GenerationTask) -> Any:
-        """Выполнить задачу с автоматическим retry при ошибке 429 и таймаутах"""
+                self._current_started_at = None
+
+    def _mark_started(self, task: GenerationTask, observe_wait: bool = True):
+        """Задача покинула очередь: учитываем время ожидания в метриках (у отменённых задач — только глубину очереди)"""
+        if task.started:
+            return
+        task.started = True
+        if task.wait_span is not None:
+            task.wait_span.end()
+        generation_type = task.generation_type.value
+        metrics.QUEUE_DEPTH.labels(self._name, generation_type).dec()
+        if observe_wait:
+            metrics.QUEUE_WAIT.labels(self._name, generation_type).observe(time.monotonic() - task.enqueued_at)
+
+    def _retry_delay(self, task: GenerationTask, error: Exception) -> float:
+        """
+        Задержка перед повтором задачи после ошибки 429 или таймаута.
+        Если попытки исчерпаны — исключение с понятным пользователю текстом, другие ошибки пробрасываются как есть.
+        """
         from gigachat.exceptions import ResponseError
         import httpx
-        
-        while task.retry_count <= task.max_retries:
-            try:
-                # Выполняем корутину
-                result = await task.coro()
-                return result
-                
-            except (httpx.ReadTimeout, httpx.TimeoutException) as e:
-                # Если это таймаут, делаем retry
-                task.retry_count += 1
-                if task.retry_count <= task.max_retries:
-                    wait_time = task.retry_delay * task.retry_count
-                    logger.warning(
-                        f"Таймаут для задачи {task.task_id} (тип: {task.generation_type.value}). "
-                        f"Попытка {task.retry_count}/{task.max_retries}. "
-                        f"Ожидание {wait_time} сек..."
-                    )
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                    logger.error(f"Превышено количество попыток из-за таймаута для задачи {task.task_id}")
-                    raise Exception(
-                        "⏱ Генерация заняла слишком много времени. "
-                        "Пожалуйста, попробуйте снова позже.\n\n"
-                        "💡 Если проблема повторяется, попробуйте упростить запрос или добавить свой API-ключ GigaChat в настройках бота."
-                    )
-                
-            except ResponseError as e:
-                # Если это ошибка 429, делаем retry
-                if e.status_code == 429:
-                    task.retry_count += 1
-                    if task.retry_count <= task.max_retries:
-                        wait_time = task.retry_delay * task.retry_count  # Увеличиваем задержку с каждой попыткой
-                        logger.warning(
-                            f"Ошибка 429 для задачи {task.task_id}. "
-                            f"Попытка {task.retry_count}/{task.max_retries}. "
-                            f"Ожидание {wait_time} сек..."
-                        )
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"Превышено количество попыток для задачи {task.task_id}")
-                        raise Exception(
-                            "⏳ Слишком много одновременных запросов. "
-                            "Пожалуйста, подождите немного и попробуйте снова.\n\n"
-                            "💡 Чтобы избежать ожидания, добавьте свой API-ключ GigaChat в настройках бота."
-                        )
-                else:
-                    # Другие ошибки ResponseError пробрасываем дальше
-                    raise
-            except Exception as e:
-                # Все остальные ошибки пробрасываем дальше
-                raise
-    
+
+        if isinstance(error, (httpx.ReadTimeout, httpx.TimeoutException)):
+            # Если это таймаут, делаем retry
+            task.retry_count += 1
+            if task.retry_count <= task.max_retries:
+                metrics.RETRIES.labels(self._name, task.generation_type.value, "timeout").inc()
+                wait_time = task.retry_delay * task.retry_count
+                logger.warning(
+                    f"Таймаут для задачи {task.task_id} (тип: {task.generation_type.value}). "
+                    f"Попытка {task.retry_count}/{task.max_retries}. "
+                    f"Повтор через {wait_time} сек..."
+                )
+                return wait_time
+            logger.error(f"Превышено количество попыток из-за таймаута для задачи {task.task_id}")
+            metrics.UPSTREAM_FAILURES.labels(self._name, task.generation_type.value, "timeout").inc()
+            raise Exception(
+                "⏱ Генерация заняла слишком много времени. "
+                "Пожалуйста, попробуйте снова позже.\n\n"
+                "💡 Если проблема повторяется, попробуйте упростить запрос или добавить свой API-ключ GigaChat в настройках бота."
+            )
+
+        if isinstance(error, ResponseError) and error.status_code == 429:
+            # Если это ошибка 429, делаем retry
+            task.retry_count += 1
+            if task.retry_count <= task.max_retries:
+                metrics.RETRIES.labels(self._name, task.generation_type.value, "429").inc()
+                wait_time = task.retry_delay * task.retry_count  # Увеличиваем задержку с каждой попыткой
+                logger.warning(
+                    f"Ошибка 429 для задачи {task.task_id}. "
+                    f"Попытка {task.retry_count}/{task.max_retries}. "
+                    f"Повтор через {wait_time} сек..."
+                )
+                return wait_time
+            logger.error(f"Превышено количество попыток для задачи {task.task_id}")
+            metrics.UPSTREAM_FAILURES.labels(self._name, task.generation_type.value, "429").inc()
+            raise Exception(
+                "⏳ Слишком много одновременных запросов. "
+                "Пожалуйста, подождите немного и попробуйте снова.\n\n"
+                "💡 Чтобы избежать ожидания, добавьте свой API-ключ GigaChat в настройках бота."
+            )
+
+        # Все остальные ошибки пробрасываем дальше
+        raise error
+
+    def _observe_service_time(self, generation_type: GenerationType, seconds: float):
+        """Учесть время выполнения задачи в оценках этого ключа и общей для типа генерации"""
+        key = generation_type.value
+        self._service_times[key] = _ewma(self._service_times.get(key), seconds)
+        _service_times[key] = _ewma(_service_times.get(key), seconds)
+        metrics.SERVICE_TIME.labels(self._name, key).set(self._service_times[key])
+
+    def service_time(self, generation_type: GenerationType) -> Optional[float]:
+        """Ожидаемое время выполнения задачи типа generation_type; None — ещё нет ни одного замера"""
+        key = generation_type.value
+        estimate = self._service_times.get(key)
+        return estimate if estimate is not None else _service_times.get(key)
+
+    def _wait_ahead(self, ahead: List[GenerationTask]) -> Optional[float]:
+        """Сколько ждать, пока выполнятся текущая задача и задачи ahead; None — для какого-то типа нет оценки"""
+        total = 0.0
+        current = self._current_task
+        if current is not None:
+            estimate = self.service_time(current.generation_type)
+            if estimate is None:
+                return None
+            if self._current_started_at is not None:
+                estimate = max(0.0, estimate - (time.monotonic() - self._current_started_at))
+            total += estimate
+        for task in ahead:
+            estimate = self.service_time(task.generation_type)
+            if estimate is None:
+                return None
+            total += estimate
+        return total
+
+    def waiting_progress(self) -> Dict[str, Progress]:
+        """
+        Позиции ожидающих задач (1 — следующая, выполняемая задача тоже считается) и оценки времени
+        до их результата по EWMA времени выполнения — за один проход по очереди.
+        Учитываются только задачи этого экземпляра бота.
+        """
+        progress: Dict[str, Progress] = {}
+        position = 1 + (self._current_task is not None)
+        wait = self._wait_ahead([])
+        for _, task in sorted(self._ready, key=lambda item: item[0]):
+            if task.cancelled:
+                continue
+            own = self.service_time(task.generation_type)
+            wait = wait + own if wait is not None and own is not None else None
+            progress[task.task_id] = (position, wait)
+            position += 1
+        return progress
+
+    def estimate_wait(self) -> Optional[float]:
+        """Сколько новая задача прождёт до начала выполнения (None — оценки ещё нет)"""
+        return self._wait_ahead([task for _, task in self._ready if not task.cancelled])
+
+    def forget_metrics(self):
+        """Убрать из метрик глубину и оценки удалённой очереди, чтобы не копить ряды по неактивным ключам"""
+        for generation_type in GenerationType:
+            for gauge in (metrics.QUEUE_DEPTH, metrics.SERVICE_TIME):
+                try:
+                    gauge.remove(self._name, generation_type.value)
+                except KeyError:
+                    pass
+
     def get_queue_size(self) -> int:
-        """Получить количество задач, ожидающих в очереди (без учёта текущей обработки)"""
-        return self._queue.qsize()
+        """Получить количество задач, ожидающих в очереди, включая отложенные до повтора (без учёта текущей обработки и отменённых)"""
+        return (sum(1 for _, task in self._ready if not task.cancelled)
+                + sum(1 for _, _, task in self._delayed if not task.cancelled))
     
     def get_pending_tasks_count(self) -> int:
         """
         Получить количество задач, которые пользователь должен дождаться.
         Включает текущую выполняемую задачу (если есть) и все ожидающие в очереди.
         """
-        pending = self._queue.qsize()
+        pending = self.get_queue_size()
         if self._current_task is not None:
             pending += 1
         return pending
     
+    async def count_pending_tasks(self) -> int:
+        """
+        Количество задач, которые пользователь должен дождаться, с учётом всех экземпляров бота.
+        Без общего бэкенда совпадает с get_pending_tasks_count.
+        """
+        try:
+            pending = await self._backend.pending_count()
+        except Exception as e:
+            logger.error(f"Не удалось получить размер общей очереди: {e}")
+            pending = None
+        if pending is None:
+            return self.get_pending_tasks_count()
+        return pending
+
     def get_current_task(self) -> Optional[GenerationTask]:
         """Получить текущую выполняемую задачу"""
         return self._current_task
@@ -226,10 +711,18 @@ DEFAULT_QUEUE_KEY = "__default_queue__"
 
 
 class GenerationQueueManager:
-    """Менеджер, который хранит отдельные очереди для каждого API-ключа."""
+    """
+    Менеджер, который хранит отдельные очереди для каждого API-ключа.
+
+    Очередь (вместе с воркером, бэкендом и клиентом GigaChat ключа) создаётся при первом обращении
+    и удаляется, если простаивает дольше idle_ttl секунд, — память и фоновые задачи зависят
+    от числа активных ключей, а не от всех ключей, которые когда-либо использовались.
+    """
 
-    def __init__(self):
+    def __init__(self, idle_ttl: float = 0):
         self._queues: Dict[str, GenerationQueue] = {}
+        self._idle_ttl = idle_ttl  # 0 — очереди не удаляются
+        self._sweeper: Optional[asyncio.Task] = None
 
     @staticmethod
     def _normalize_key(queue_key: Optional[str]) -> str:
@@ -242,27 +735,125 @@ class GenerationQueueManager:
             # Для дефолтного ключа используем фактические креды из конфигурации.
             # Это гарантирует, что сообщения и сами задачи будут смотреть в одну очередь.
             resolved_key = config.GIGACHAT_CREDENTIALS or DEFAULT_QUEUE_KEY
-        return hashlib.sha256(resolved_key.encode("utf-8")).hexdigest()
+        return credentials_key(resolved_key)
+
+    @staticmethod
+    def _create_backend(normalized_key: str) -> QueueBackend:
+        """Бэкенд координации очереди согласно GENERATION_QUEUE_BACKEND"""
+        if config.GENERATION_QUEUE_BACKEND == "redis":
+            redis = get_redis()
+            if redis is None:
+                raise ValueError("Для GENERATION_QUEUE_BACKEND=redis нужно указать REDIS_URL!")
+            return RedisQueueBackend(
+                redis,
+                queue_id=normalized_key,
+                max_concurrency=config.GENERATION_MAX_CONCURRENCY,
+                lease_ttl=config.GENERATION_LEASE_TTL,
+            )
+        return QueueBackend()
+
+    def load(self, credentials: str) -> int:
+        """Задачи в очереди ключа, включая выполняемую (0 — очереди нет)"""
+        queue = self._queues.get(self._normalize_key(credentials))
+        return queue.get_pending_tasks_count() if queue is not None else 0
+
+    def wait(self, credentials: str) -> Optional[float]:
+        """Сколько новая задача прождёт в очереди ключа (0 — очереди нет, None — оценки ещё нет)"""
+        queue = self._queues.get(self._normalize_key(credentials))
+        return queue.estimate_wait() if queue is not None else 0.0
+
+    def shared_credentials(self, exclude: Tuple[str, ...] = ()) -> Optional[str]:
+        """Ключ бота для новой задачи: наименее загруженный из доступных (см. SharedCredentialPool)"""
+        return get_shared_credential_pool().choose(self.load, exclude)
 
     def get_queue(self, queue_key: Optional[str] = None) -> GenerationQueue:
+        # Без своего ключа пользователь попадает в очередь одного из ключей бота
+        queue_key = queue_key or self.shared_credentials()
         normalized_key = self._normalize_key(queue_key)
         if normalized_key not in self._queues:
-            self._queues[normalized_key] = GenerationQueue()
+            # Квоты нужны только ключам бота: пользователи со своим ключом ждут только себя
+            is_shared_key = queue_key in get_shared_credential_pool()
+            self._queues[normalized_key] = GenerationQueue(
+                self._create_backend(normalized_key),
+                admission=get_admission_controller() if is_shared_key else None,
+                name=normalized_key[:12],
+            )
+            metrics.QUEUES.set(len(self._queues))
+            self._ensure_sweeper()
         return self._queues[normalized_key]
 
+    def _ensure_sweeper(self):
+        if self._idle_ttl <= 0 or self._sweeper is not None:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Вне цикла событий (импорт модулей) — уборка начнётся со следующей очереди
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def _sweep(self):
+        """Периодически удаляет простаивающие очереди; когда очередей не остаётся, завершается"""
+        try:
+            while self._queues:
+                await asyncio.sleep(self._idle_ttl / 2)
+                try:
+                    await self.evict_idle()
+                except Exception as e:
+                    logger.error(f"Ошибка при удалении простаивающих очередей генерации: {e}", exc_info=True)
+        finally:
+            self._sweeper = None
+
+    async def evict_idle(self) -> int:
+        """Удалить очереди, простаивающие дольше idle_ttl, и закрыть их клиенты GigaChat"""
+        evicted = 0
+        for normalized_key, queue in list(self._queues.items()):
+            idle = queue.idle_for()
+            if idle is None or idle < self._idle_ttl or self._queues.get(normalized_key) is not queue:
+                continue
+            # Из словаря очередь убирается до первого await: новые запросы уже попадут в новую очередь
+            del self._queues[normalized_key]
+            metrics.QUEUES.set(len(self._queues))
+            await queue.stop()
+            await get_gigachat_client_pool().close(normalized_key)
+            get_circuit_breaker_registry().forget(normalized_key)
+            forget_key_limiter(normalized_key)
+            queue.forget_metrics()
+            evicted += 1
+        if evicted:
+            logger.info("Удалено простаивающих очередей генерации: %d (осталось %d)", evicted, len(self._queues))
+        return evicted
+
     async def stop_all(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
         for queue in self._queues.values():
             await queue.stop()
+        await get_gigachat_client_pool().close_all()
 
 
-_queue_manager = GenerationQueueManager()
+_queue_manager = GenerationQueueManager(idle_ttl=config.GENERATION_QUEUE_IDLE_TTL)
 
 
 def get_generation_queue(queue_key: Optional[str] = None) -> GenerationQueue:
-    """Получить очередь генерации для конкретного API-ключа."""
+    """Получить очередь генерации для конкретного API-ключа (без ключа — для ключа бота, выбранного балансировкой)."""
     return _queue_manager.get_queue(queue_key)
 
 
+def select_shared_credentials(exclude: Tuple[str, ...] = ()) -> Optional[str]:
+    """Ключ бота для задачи пользователя без своего ключа (None — если исключены все ключи)"""
+    return _queue_manager.shared_credentials(exclude)
+
+
+def credentials_load(credentials: str) -> int:
+    """Задачи в очереди ключа, включая выполняемые (0 — очереди нет)"""
+    return _queue_manager.load(credentials)
+
+
+def credentials_wait(credentials: str) -> Optional[float]:
+    """Оценка ожидания новой задачи в очереди ключа (см. GenerationQueue.estimate_wait)"""
+    return _queue_manager.wait(credentials)
+
+
 async def stop_all_generation_queues():
     """Остановить все активные очереди генерации."""
     await _queue_manager.stop_all()
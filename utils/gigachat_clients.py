@@ -0,0 +1,59 @@
+import hashlib
+import logging
+from typing import Any, Dict
+
+from gigachat import GigaChat
+
+
+logger = logging.getLogger(__name__)
+
+
+def credentials_key(credentials: str) -> str:
+    """Ключ API в виде хеша: по нему находятся очередь и клиент, а сам ключ нигде не хранится отдельно"""
+    return hashlib.sha256(credentials.encode("utf-8")).hexdigest()
+
+
+class GigaChatClientPool:
+    """
+    Долгоживущие клиенты GigaChat, по одному на API-ключ.
+
+    Клиент хранит токен доступа и HTTP-соединения, поэтому повторные запросы с тем же ключом
+    не получают токен заново (OAuth) и не открывают новое соединение. Клиенты простаивающих
+    ключей закрываются вместе с их очередями генерации (см. GenerationQueueManager).
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, GigaChat] = {}
+
+    def get(self, credentials: str, **options: Any) -> GigaChat:
+        """Клиент для ключа (создаётся при первом обращении; options — параметры конструктора GigaChat)"""
+        key = credentials_key(credentials)
+        client = self._clients.get(key)
+        if client is None:
+            client = GigaChat(credentials=credentials, **options)
+            self._clients[key] = client
+        return client
+
+    async def close(self, key: str):
+        """Закрыть клиент ключа с хешем key (следующий запрос создаст новый)"""
+        client = self._clients.pop(key, None)
+        if client is None:
+            return
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning("Не удалось закрыть клиент GigaChat: %s", e)
+
+    async def close_all(self):
+        for key in list(self._clients):
+            await self.close(key)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+_pool = GigaChatClientPool()
+
+
+def get_gigachat_client_pool() -> GigaChatClientPool:
+    return _pool
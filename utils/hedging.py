@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+HEDGE_QUANTILE = 0.9  # Дубль запускается, если запрос идёт дольше этой доли наблюдённых запросов
+MIN_SAMPLES = 20  # Пока замеров меньше, дубли не запускаются
+WINDOW = 200  # Сколько последних замеров учитывается
+
+
+class LatencyTracker:
+    """Время выполнения последних запросов по типам генерации (от вызова до результата)"""
+
+    def __init__(self, window: int = WINDOW):
+        self._samples: Dict[str, Deque[float]] = {}
+        self._window = window
+
+    def observe(self, generation_type: str, seconds: float):
+        self._samples.setdefault(generation_type, deque(maxlen=self._window)).append(seconds)
+
+    def quantile(self, generation_type: str, q: float = HEDGE_QUANTILE) -> Optional[float]:
+        """Квантиль времени выполнения; None, пока замеров меньше MIN_SAMPLES"""
+        samples = self._samples.get(generation_type)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _cancel(task: asyncio.Future):
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+async def hedged(
+        primary: Awaitable[Any],
+        start_hedge: Callable[[], Awaitable[Optional[Awaitable[Any]]]],
+        delay: float,
+        generation_type: str,
+) -> Tuple[Any, bool]:
+    """
+    Выполнить запрос с дублированием.
+
+    Если primary не завершился за delay секунд, start_hedge запускает дубль (или возвращает None,
+    если дублировать некуда). Возвращается первый успешный результат, второй запрос отменяется.
+    Если оба запроса завершились ошибкой, пробрасывается ошибка основного.
+
+    :return: (результат, True — результат получен дублем)
+    """
+    primary_task = asyncio.ensure_future(primary)
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done:
+            return primary_task.result(), False
+        hedge = await start_hedge()
+        if hedge is None:
+            return await primary_task, False
+    except BaseException:
+        await _cancel(primary_task)
+        raise
+
+    hedge_task = asyncio.ensure_future(hedge)
+    metrics.HEDGES.labels(generation_type, "started").inc()
+    pending = {primary_task, hedge_task}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = "hedge" if task is hedge_task else "primary"
+                    metrics.HEDGES.labels(generation_type, winner).inc()
+                    return task.result(), task is hedge_task
+                if task is hedge_task:
+                    logger.info("Дубль запроса завершился ошибкой: %s", task.exception())
+        return primary_task.result(), False
+    finally:
+        for task in pending:
+            await _cancel(task)
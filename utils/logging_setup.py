@@ -0,0 +1,120 @@
+import json
+import logging
+import re
+import sys
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+from config import config
+
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Стандартные атрибуты LogRecord; всё остальное — поля, переданные через extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+# Поля extra с пользовательскими данными и секретами: в лог попадает только их длина
+_REDACTED_FIELDS = {"prompt", "text", "user_idea", "user_wishes", "api_key", "credentials", "token"}
+
+# Секреты в тексте сообщения: заголовки авторизации, ключи в виде key=value, токен бота
+_SECRET_PATTERNS = (
+    (re.compile(r"\b(Bearer|Basic)\s+[A-Za-z0-9._~+/=-]+"), r"\1 ***"),
+    (re.compile(r"\b(api_key|credentials|access_token|password|secret_token)=([^\s,&'\"]+)", re.IGNORECASE), r"\1=***"),
+    (re.compile(r"\b\d{6,12}:[A-Za-z0-9_-]{30,}\b"), "***"),
+)
+
+
+def redact(text: str) -> str:
+    """Скрыть секреты в строке лога"""
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RedactionFilter(logging.Filter):
+    """Скрывает ключи и токены в сообщениях, а пользовательские тексты из extra заменяет их длиной"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Сообщение форматируется один раз здесь, форматтер использует готовую строку
+        record.msg, record.args = redact(record.getMessage()), None
+        for field in _REDACTED_FIELDS & vars(record).keys():
+            value = getattr(record, field)
+            if isinstance(value, str):
+                setattr(record, field, f"<{len(value)} символов>")
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает каждую N-ю запись ниже WARNING для логгеров из rates (N = 1 / доля).
+    Записи считаются по шаблону сообщения, поэтому редкие события логгера не теряются
+    из-за частых. Предупреждения и ошибки проходят всегда.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self._every = {name: max(1, round(1 / rate)) if rate > 0 else 0 for name, rate in rates.items()}
+        self._counters: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _rate_for(self, logger_name: str):
+        name = logger_name
+        while name:
+            if name in self._every:
+                return self._every[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        every = self._rate_for(record.name)
+        if every is None:
+            return True
+        if every == 0:
+            return False
+        key = (record.name, str(record.msg))
+        with self._lock:
+            count = self._counters[key]
+            self._counters[key] = count + 1
+        return count % every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """
+    Настройка логирования по конфигу: формат (LOG_FORMAT=text|json), общий уровень (LOG_LEVEL),
+    уровни отдельных модулей (LOG_LEVELS), выборка частых записей (LOG_SAMPLING) и скрытие секретов.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    # Фильтры на обработчике, а не на логгерах — действуют и на записи дочерних логгеров
+    if config.LOG_SAMPLING:
+        handler.addFilter(SamplingFilter(dict(config.LOG_SAMPLING)))
+    handler.addFilter(RedactionFilter())
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL)
+    for name, level in config.LOG_LEVELS:
+        logging.getLogger(name).setLevel(level)
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Корень проекта: по нему из стека выбираются кадры кода бота
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_STACK_DEPTH = 8
+
+# Сообщение asyncio в режиме отладки: "Executing <Task ... coro=<handler() running at ...>> took 0.250 seconds"
+_CORO_NAME = re.compile(r"coro=<([^\s(]+)")
+
+
+def _describe_stack(frame) -> Tuple[str, List[str]]:
+    """
+    Источник задержки (последняя функция кода бота в стеке) и хвост стека.
+    Стек потока цикла событий включает кадры выполняющейся корутины, поэтому виден обработчик.
+    """
+    stack = traceback.extract_stack(frame)
+    source = "external"
+    for entry in reversed(stack):
+        path = os.path.abspath(entry.filename)
+        if path.startswith(_PROJECT_ROOT) and path != os.path.abspath(__file__):
+            module = os.path.relpath(path, _PROJECT_ROOT).removesuffix(".py").replace(os.sep, ".")
+            source = f"{module}:{entry.name}"
+            break
+    tail = [f"{entry.filename}:{entry.lineno} in {entry.name}" for entry in stack[-_STACK_DEPTH:]]
+    return source, tail
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Перехватывает сообщения asyncio о медленных callback (режим отладки) и считает их в метриках"""
+
+    def emit(self, record: logging.LogRecord):
+        if not record.msg.startswith("Executing") or len(record.args or ()) < 2:
+            return
+        match = _CORO_NAME.search(repr(record.args[0]))
+        metrics.SLOW_CALLBACKS.labels(match.group(1) if match else "callback").inc()
+
+
+class LoopMonitor:
+    """
+    Монитор здоровья цикла событий.
+
+    Фоновая корутина раз в interval секунд измеряет задержку цикла (насколько позже запланированного
+    она просыпается) и пишет её в метрики. Сторожевой поток следит за этими отметками: если цикл
+    не отвечает дольше threshold, он снимает стек потока цикла — так видно, какой обработчик или
+    корутина выполняет синхронную работу. После того как цикл освободится, задержка пишется в лог
+    вместе с источником и стеком.
+
+    При debug=True включается отладочный режим asyncio: медленные callback (дольше threshold)
+    логируются самим asyncio и считаются в метриках. Режим отладки замедляет бота, включайте его временно.
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.1, debug: bool = False):
+        self._interval = interval
+        self._threshold = threshold
+        self._debug = debug
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = 0.0
+        self._captured: Optional[Tuple[str, List[str]]] = None  # Стек, снятый сторожевым потоком во время задержки
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._slow_callback_handler: Optional[_SlowCallbackHandler] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+        if self._debug:
+            self._loop.set_debug(True)
+            self._loop.slow_callback_duration = self._threshold
+            self._slow_callback_handler = _SlowCallbackHandler()
+            logging.getLogger("asyncio").addHandler(self._slow_callback_handler)
+        logger.info(f"Монитор цикла событий запущен (порог задержки {self._threshold} сек.)")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=self._interval + self._threshold)
+            self._thread = None
+        if self._slow_callback_handler is not None:
+            logging.getLogger("asyncio").removeHandler(self._slow_callback_handler)
+            self._slow_callback_handler = None
+            self._loop.set_debug(False)
+
+    async def _sample(self):
+        while True:
+            started = self._loop.time()
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, self._loop.time() - started - self._interval)
+            self._heartbeat = time.monotonic()
+            metrics.LOOP_LAG.observe(lag)
+            if lag >= self._threshold:
+                self._report(lag)
+
+    def _report(self, lag: float):
+        captured, self._captured = self._captured, None
+        source, stack = captured if captured else ("unknown", [])
+        metrics.LOOP_STALLS.labels(source).inc()
+        logger.warning(
+            f"Цикл событий был заблокирован на {lag:.3f} сек. (источник: {source})",
+            extra={"event": "loop_stall", "lag": round(lag, 3), "source": source, "stack": stack},
+        )
+
+    def _watch(self):
+        """Сторожевой поток: снимает стек потока цикла, пока тот заблокирован"""
+        while not self._stopped.wait(self._threshold / 2):
+            overdue = time.monotonic() - self._heartbeat - self._interval
+            if overdue < self._threshold or self._captured is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._captured = _describe_stack(frame)
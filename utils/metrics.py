@@ -0,0 +1,203 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+# Генерация может ждать в очереди минутами, поэтому границы шире стандартных
+_GENERATION_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+_DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+_LOOP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+QUEUE_DEPTH = Gauge(
+    "generation_queue_depth",
+    "Задачи, ожидающие выполнения в очереди генерации",
+    ["queue", "generation_type"],
+)
+SERVICE_TIME = Gauge(
+    "generation_service_time_seconds",
+    "Скользящая (EWMA) оценка времени выполнения задачи генерации, по ней считается ожидание в очереди",
+    ["queue", "generation_type"],
+)
+PROGRESS_UPDATES = Counter(
+    "generation_progress_updates_total",
+    "Правки статус-сообщений с позицией в очереди: ok, error, deferred — отложено до следующего шага",
+    ["outcome"],
+)
+QUEUES = Gauge(
+    "generation_queues",
+    "Очереди генерации в памяти (по одной на активный API-ключ)",
+)
+QUEUE_WAIT = Histogram(
+    "generation_queue_wait_seconds",
+    "Время от постановки задачи в очередь до начала выполнения",
+    ["queue", "generation_type"],
+    buckets=_GENERATION_BUCKETS,
+)
+EXECUTION_TIME = Histogram(
+    "generation_execution_seconds",
+    "Время выполнения задачи генерации (включая повторы)",
+    ["queue", "generation_type", "outcome"],
+    buckets=_GENERATION_BUCKETS,
+)
+RETRIES = Counter(
+    "generation_retries_total",
+    "Повторы задач генерации после 429 или таймаута",
+    ["queue", "generation_type", "reason"],
+)
+UPSTREAM_FAILURES = Counter(
+    "generation_upstream_failures_total",
+    "Задачи, которые не удалось выполнить после всех повторов",
+    ["queue", "generation_type", "reason"],
+)
+CANCELLED = Counter(
+    "generation_cancelled_total",
+    "Отменённые задачи генерации (stage: queued — ещё в очереди, running — во время запроса)",
+    ["queue", "generation_type", "stage"],
+)
+EXPIRED = Counter(
+    "generation_expired_total",
+    "Задачи генерации, не уложившиеся в крайний срок (stage: queued — в очереди, running — во время запроса, retry — перед повтором)",
+    ["queue", "generation_type", "stage"],
+)
+CIRCUIT_STATE = Gauge(
+    "gigachat_circuit_state",
+    "Состояние предохранителя GigaChat: 0 — замкнут, 1 — пробный запрос, 2 — разомкнут",
+    ["queue", "endpoint"],
+)
+CIRCUIT_REJECTED = Counter(
+    "gigachat_circuit_rejected_total",
+    "Запросы, отклонённые разомкнутым предохранителем GigaChat",
+    ["queue", "endpoint"],
+)
+HEDGES = Counter(
+    "generation_hedges_total",
+    "Дублированные запросы генерации: started — дубль запущен, primary/hedge — чей ответ получен первым",
+    ["generation_type", "outcome"],
+)
+SHARED_KEY_AVAILABLE = Gauge(
+    "gigachat_shared_key_available",
+    "Участвует ли ключ бота в балансировке (0 — выведен после 429 или 402)",
+    ["queue"],
+)
+ROUTES = Counter(
+    "generation_routes_total",
+    "Выбранные маршруты задач генерации: source — откуда первый ключ (user, shared, disconnected)",
+    ["generation_type", "source"],
+)
+FAILOVERS = Counter(
+    "generation_failovers_total",
+    "Переходы задач генерации на запасной ключ: с какого, на какой и почему (код ответа или circuit_open)",
+    ["from_source", "to_source", "reason"],
+)
+MODEL_REQUESTS = Counter(
+    "gigachat_model_requests_total",
+    "Запросы к GigaChat по операциям и выбранным моделям (default — модель клиента по умолчанию)",
+    ["operation", "model"],
+)
+MODEL_DOWNGRADES = Counter(
+    "gigachat_model_downgrades_total",
+    "Понижения модели: ожидаемое время ответа превысило бюджет операции",
+    ["operation", "from_model", "to_model"],
+)
+TOKENS = Counter(
+    "gigachat_tokens_total",
+    "Токены GigaChat по данным response.usage",
+    ["generation_type", "kind"],
+)
+DB_QUERY_TIME = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения SQL-запросов",
+    ["operation"],
+    buckets=_DB_BUCKETS,
+)
+HANDLER_TIME = Histogram(
+    "handler_duration_seconds",
+    "Время работы обработчиков по роутерам",
+    ["router", "event_type", "outcome"],
+    buckets=_GENERATION_BUCKETS,
+)
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Задержка цикла событий: насколько позже запланированного просыпается фоновая корутина",
+    buckets=_LOOP_BUCKETS,
+)
+LOOP_STALLS = Counter(
+    "event_loop_stalls_total",
+    "Блокировки цикла событий дольше порога по источнику (функция кода бота в стеке)",
+    ["source"],
+)
+SLOW_CALLBACKS = Counter(
+    "event_loop_slow_callbacks_total",
+    "Медленные callback по данным отладочного режима asyncio",
+    ["callback"],
+)
+
+
+def record_token_usage(usage: Any, generation_type: str):
+    """Учесть токены из response.usage ответа GigaChat"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = getattr(usage, kind, None)
+        if value:
+            TOKENS.labels(generation_type, kind.removesuffix("_tokens")).inc(value)
+
+
+def instrument_engine(engine: Engine):
+    """Подключить замер времени SQL-запросов к движку SQLAlchemy (для async-движка — engine.sync_engine)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_time"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        if operation not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            operation = "OTHER"
+        DB_QUERY_TIME.labels(operation).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        # Упавший запрос не доходит до after_cursor_execute — убираем его отметку времени
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время работы обработчиков по роутерам"""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        router = data.get("event_router")
+        router_name = router.name if router is not None else "unknown"
+        event_type = type(event).__name__
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            HANDLER_TIME.labels(router_name, event_type, outcome).observe(time.perf_counter() - started)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Запустить HTTP-сервер с метриками Prometheus (/metrics) в отдельном потоке"""
+    start_http_server(port, addr=host)
+    logger.info(f"Метрики Prometheus доступны на http://{host}:{port}/metrics")
@@ -0,0 +1,80 @@
+import logging
+from typing import Dict, Optional
+
+from config import config
+from utils import metrics
+from utils.hedging import LatencyTracker
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "default"  # Метка модели клиента по умолчанию (GIGACHAT_MODEL) в метриках и замерах
+
+
+class ModelRouter:
+    """
+    Модель GigaChat для каждой операции сервиса (GIGACHAT_MODEL_ROUTES).
+
+    Лёгкие операции (улучшение промпта, правка текста, проверка ключа) идут в быструю модель,
+    творческие генерации — в более сильную. Если у операции есть бюджет времени (GIGACHAT_LATENCY_BUDGETS)
+    и ожидаемое время ответа с учётом очереди ключа его превышает, модель понижается по цепочке
+    GIGACHAT_MODEL_DOWNGRADES (например, Max -> Pro -> Lite), пока оценка не уложится в бюджет.
+    """
+
+    def __init__(self, routes: Dict[str, str], downgrades: Dict[str, str], budgets: Dict[str, float]):
+        self._routes = routes
+        self._downgrades = downgrades
+        self._budgets = budgets
+        self._latency = LatencyTracker()  # Время ответа моделей (без ожидания в очереди)
+
+    def observe(self, model: Optional[str], seconds: float):
+        """Учесть время ответа модели (None — модель клиента по умолчанию)"""
+        self._latency.observe(model or DEFAULT_MODEL, seconds)
+
+    def estimate(self, model: Optional[str], queued: int, wait: Optional[float] = None) -> Optional[float]:
+        """
+        Ожидаемое время до ответа: ожидание в очереди ключа и сама задача по медиане времени ответа модели.
+        Если оценки ожидания нет, задачи в очереди считаются по той же медиане. None — замеров модели пока мало.
+        """
+        median = self._latency.quantile(model or DEFAULT_MODEL, 0.5)
+        if median is None:
+            return None
+        if wait is not None:
+            return wait + median
+        return median * (queued + 1)
+
+    def choose(self, operation: str, queued: int = 0, wait: Optional[float] = None) -> Optional[str]:
+        """
+        Модель для операции.
+
+        :param queued: Задачи в очереди ключа, в которую попадёт запрос
+        :param wait: Оценка ожидания в этой очереди по времени выполнения задач (GenerationQueue.estimate_wait)
+        :return: None — модель клиента по умолчанию
+        """
+        model = self._routes.get(operation)
+        budget = self._budgets.get(operation)
+        if budget:
+            seen = {model}
+            while True:
+                estimate = self.estimate(model, queued, wait)
+                fallback = self._downgrades.get(model or DEFAULT_MODEL)
+                if estimate is None or estimate <= budget or fallback is None or fallback in seen:
+                    break
+                logger.info("Операция %s: %s ответит примерно через %.1f сек. (бюджет %.1f), используем %s",
+                            operation, model or DEFAULT_MODEL, estimate, budget, fallback)
+                metrics.MODEL_DOWNGRADES.labels(operation, model or DEFAULT_MODEL, fallback).inc()
+                seen.add(fallback)
+                model = fallback
+        metrics.MODEL_REQUESTS.labels(operation, model or DEFAULT_MODEL).inc()
+        return model
+
+
+_router = ModelRouter(
+    dict(config.GIGACHAT_MODEL_ROUTES),
+    dict(config.GIGACHAT_MODEL_DOWNGRADES),
+    dict(config.GIGACHAT_LATENCY_BUDGETS),
+)
+
+
+def get_model_router() -> ModelRouter:
+    return _router
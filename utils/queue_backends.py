@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+from redis.asyncio import Redis
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueBackend:
+    """
+    Координация очереди генерации между экземплярами бота.
+
+    Базовая реализация работает в пределах одного процесса: порядок и число одновременных
+    запросов обеспечивает сама GenerationQueue, поэтому все методы ничего не делают.
+    """
+
+    async def register(self, ticket: str):
+        """Поставить заявку в общую очередь (порядок определяется моментом регистрации)"""
+
+    async def acquire(self, ticket: str):
+        """Дождаться очереди заявки и получить аренду на выполнение запроса"""
+
+    async def release(self, ticket: str):
+        """Освободить аренду после выполнения запроса"""
+
+    async def discard(self, ticket: str):
+        """Убрать заявку из очереди, если она так и не была выполнена"""
+
+    async def pending_count(self) -> Optional[int]:
+        """
+        Количество заявок во всех экземплярах (выполняемые + ожидающие).
+        None — общего счётчика нет, используется локальная очередь.
+        """
+        return None
+
+    async def close(self):
+        """Остановить фоновые задачи бэкенда"""
+
+
+# Скрипты выполняются атомарно на стороне Redis. Время берётся из TIME сервера,
+# чтобы сроки аренды не зависели от расхождения часов между экземплярами бота.
+_NOW_MS = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+# Удаление просроченных аренд и заявок экземпляров, которые перестали слать heartbeat
+_PURGE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+local dead = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, ticket in ipairs(dead) do
+    redis.call('ZREM', KEYS[1], ticket)
+    redis.call('ZREM', KEYS[2], ticket)
+end
+"""
+
+# KEYS: waiting, alive, seq; ARGV: ticket, ttl_ms
+_REGISTER_SCRIPT = _NOW_MS + """
+local seq = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[1], seq, ARGV[1])
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), ARGV[1])
+return seq
+"""
+
+# KEYS: waiting, alive, leases; ARGV: ticket, max_concurrency, ttl_ms
+# Возвращает 0, если аренда получена, -1, если заявки нет в очереди, иначе позицию заявки
+_ACQUIRE_SCRIPT = _NOW_MS + _PURGE + """
+local rank = redis.call('ZRANK', KEYS[1], ARGV[1])
+if not rank then
+    return -1
+end
+local active = redis.call('ZCARD', KEYS[3])
+if rank < tonumber(ARGV[2]) - active then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('ZADD', KEYS[3], now + tonumber(ARGV[3]), ARGV[1])
+    return 0
+end
+return rank + active + 1
+"""
+
+# KEYS: waiting, alive, leases
+_COUNT_SCRIPT = _NOW_MS + _PURGE + """
+return redis.call('ZCARD', KEYS[1]) + redis.call('ZCARD', KEYS[3])
+"""
+
+# KEYS: множество (alive или leases); ARGV: ttl_ms, заявки...
+# Продлевает срок только тем заявкам, которые ещё есть в множестве
+_HEARTBEAT_SCRIPT = _NOW_MS + """
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[1], 'XX', now + tonumber(ARGV[1]), ARGV[i])
+end
+return 1
+"""
+
+
+class RedisQueueBackend(QueueBackend):
+    """
+    Общая очередь генерации в Redis для нескольких экземпляров бота.
+
+    - порядок задаётся глобальным счётчиком заявок (ZSET waiting);
+    - одновременно выполняется не больше max_concurrency запросов на один API-ключ
+      (ZSET leases, значение — срок действия аренды);
+    - живые экземпляры продлевают свои заявки и аренды heartbeat'ом, поэтому заявки упавшего
+      экземпляра освобождаются сами через lease_ttl секунд;
+    - об освобождении аренды ожидающие узнают через pub/sub, а на случай потерянного
+      сообщения очередь дополнительно опрашивается каждые poll_interval секунд.
+
+    Сам запрос к GigaChat выполняет тот экземпляр, который поставил задачу в очередь,
+    поэтому результат передаётся обработчику локально.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            queue_id: str,
+            max_concurrency: int = 1,
+            lease_ttl: float = 30.0,
+            poll_interval: float = 1.0,
+    ):
+        self._redis = redis
+        self._max_concurrency = max(1, max_concurrency)
+        self._lease_ttl_ms = int(lease_ttl * 1000)
+        self._heartbeat_interval = lease_ttl / 3
+        self._poll_interval = poll_interval
+
+        prefix = f"nko_gen:{queue_id}"
+        self._waiting_key = f"{prefix}:waiting"
+        self._alive_key = f"{prefix}:alive"
+        self._leases_key = f"{prefix}:leases"
+        self._seq_key = f"{prefix}:seq"
+        self._channel = f"{prefix}:released"
+
+        self._register = redis.register_script(_REGISTER_SCRIPT)
+        self._acquire = redis.register_script(_ACQUIRE_SCRIPT)
+        self._count = redis.register_script(_COUNT_SCRIPT)
+        self._heartbeat = redis.register_script(_HEARTBEAT_SCRIPT)
+
+        # Заявки и аренды этого экземпляра, которые нужно продлевать
+        self._local_tickets: Set[str] = set()
+        self._local_leases: Set[str] = set()
+        self._released = asyncio.Event()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._listener_task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+            self._listener_task = asyncio.create_task(self._listen_releases())
+
+    async def register(self, ticket: str):
+        self._ensure_started()
+        await self._register(keys=[self._waiting_key, self._alive_key, self._seq_key],
+                             args=[ticket, self._lease_ttl_ms])
+        self._local_tickets.add(ticket)
+
+    async def acquire(self, ticket: str):
+        while True:
+            # Сбрасываем событие до проверки, чтобы не пропустить освобождение между проверкой и ожиданием
+            self._released.clear()
+            position = await self._acquire(keys=[self._waiting_key, self._alive_key, self._leases_key],
+                                           args=[ticket, self._max_concurrency, self._lease_ttl_ms])
+            if position == 0:
+                self._local_tickets.discard(ticket)
+                self._local_leases.add(ticket)
+                return
+            if position == -1:
+                # Заявка пропала (например, Redis перезапускался) — ставим её в очередь заново
+                logger.warning(f"Заявка {ticket} потеряна в общей очереди, повторная регистрация")
+                await self.register(ticket)
+                continue
+            try:
+                await asyncio.wait_for(self._released.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def release(self, ticket: str):
+        self._local_leases.discard(ticket)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._leases_key, ticket)
+            pipe.publish(self._channel, ticket)
+            await pipe.execute()
+
+    async def discard(self, ticket: str):
+        self._local_tickets.discard(ticket)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._waiting_key, ticket)
+            pipe.zrem(self._alive_key, ticket)
+            await pipe.execute()
+
+    async def pending_count(self) -> Optional[int]:
+        return int(await self._count(keys=[self._waiting_key, self._alive_key, self._leases_key]))
+
+    async def _heartbeat_loop(self):
+        """Продление заявок и аренд этого экземпляра"""
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            try:
+                if self._local_tickets:
+                    await self._heartbeat(keys=[self._alive_key],
+                                          args=[self._lease_ttl_ms, *self._local_tickets])
+                if self._local_leases:
+                    await self._heartbeat(keys=[self._leases_key],
+                                          args=[self._lease_ttl_ms, *self._local_leases])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка heartbeat общей очереди генерации: {e}", exc_info=True)
+
+    async def _listen_releases(self):
+        """Получение уведомлений об освобождении аренд от всех экземпляров"""
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self._channel)
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is not None:
+                        self._released.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Пока подписка недоступна, ожидающие продолжают опрашивать очередь
+                logger.error(f"Ошибка подписки на освобождение очереди генерации: {e}", exc_info=True)
+                await asyncio.sleep(self._poll_interval)
+            finally:
+                await pubsub.aclose()
+
+    async def close(self):
+        for task in (self._heartbeat_task, self._listener_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._heartbeat_task = None
+        self._listener_task = None
+        # Освобождаем то, что осталось за этим экземпляром, не дожидаясь истечения аренды
+        for ticket in list(self._local_leases):
+            await self.release(ticket)
+        for ticket in list(self._local_tickets):
+            await self.discard(ticket)
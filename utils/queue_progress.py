@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from config import config
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+SEND_TIMEOUT = 5.0  # Сколько ждать одной правки статус-сообщения
+ETA_MIN_CHANGE = 10.0  # Без смены позиции сообщение обновляется, если оценка изменилась хотя бы на столько секунд...
+ETA_MIN_CHANGE_SHARE = 0.25  # ...и на такую долю прежней оценки
+
+# Позиция задачи в очереди (1 — следующая) и оценка времени до результата в секундах (None — пока неизвестна)
+Progress = Tuple[int, Optional[float]]
+# Позиции всех ожидающих задач очереди по task_id (см. GenerationQueue.waiting_progress)
+ProgressSnapshot = Callable[[], Dict[str, Progress]]
+ProgressCallback = Callable[[int, Optional[float]], Awaitable[None]]
+
+# Куда сообщать позицию задачи, пока она ждёт очереди: задаётся обработчиком вокруг вызова сервиса
+current_progress_callback: ContextVar[Optional[ProgressCallback]] = ContextVar(
+    "current_progress_callback", default=None
+)
+
+
+def format_eta(seconds: float) -> str:
+    """Оценка времени для пользователя: до минуты — с шагом 5 секунд, дальше — в минутах"""
+    if seconds < 60:
+        return f"~{max(5, math.ceil(seconds / 5) * 5)} сек."
+    return f"~{math.ceil(seconds / 60)} мин."
+
+
+def queue_status_text(position: int, eta: Optional[float]) -> str:
+    """Текст статус-сообщения задачи, ожидающей очереди"""
+    eta_text = f", ответ {format_eta(eta)}" if eta is not None else ""
+    return (
+        f"⏳ Ваш запрос в очереди (позиция: {position}{eta_text}). Ожидайте...\n\n"
+        f"💡 Чтобы избежать ожидания, добавьте свой API-ключ GigaChat в настройках бота."
+    )
+
+
+@contextmanager
+def queue_status_updates(bot: Bot, chat_id: int, message_id: int) -> Iterator[None]:
+    """Пока задачи, поставленные внутри блока, ждут очереди, статус-сообщение показывает их позицию и оценку времени"""
+    async def update(position: int, eta: Optional[float]):
+        await bot.edit_message_text(queue_status_text(position, eta), chat_id=chat_id, message_id=message_id)
+
+    token = current_progress_callback.set(update)
+    try:
+        yield
+    finally:
+        current_progress_callback.reset(token)
+
+
+@dataclass
+class _Tracked:
+    snapshot: ProgressSnapshot
+    callback: ProgressCallback
+    sent: Optional[Progress] = None  # Что пользователь видит сейчас
+    sent_at: float = 0.0
+    sending: Optional[asyncio.Task] = None
+
+    def should_send(self, state: Progress) -> bool:
+        if self.sent is None:
+            return True
+        position, eta = state
+        sent_position, sent_eta = self.sent
+        if position != sent_position:
+            return True
+        if eta is None or sent_eta is None:
+            return (eta is None) != (sent_eta is None)
+        return abs(eta - sent_eta) >= max(ETA_MIN_CHANGE, ETA_MIN_CHANGE_SHARE * sent_eta)
+
+
+class ProgressNotifier:
+    """
+    Обновления позиции и оценки времени в статус-сообщениях ожидающих задач.
+
+    Сообщения не правятся на каждое движение очереди: раз в interval секунд один фоновый цикл
+    собирает изменившиеся позиции всех очередей и правит не больше batch_size сообщений
+    (сначала те, что дольше не обновлялись, остальные — на следующем шаге). Так очередь из сотен
+    пользователей не упирается в лимиты Bot API. Задачи, которые начали выполняться сразу, не правятся.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self._interval = interval  # 0 — обновления выключены
+        self._batch_size = batch_size
+        self._entries: Dict[str, _Tracked] = {}
+        self._loop: Optional[asyncio.Task] = None
+
+    def track(self, key: str, snapshot: ProgressSnapshot, callback: ProgressCallback):
+        """
+        Следить за задачей key.
+
+        :param snapshot: Позиции ожидающих задач очереди; задача, которой там нет, больше не ждёт
+            (и перестаёт отслеживаться). Вызывается один раз на очередь за шаг.
+        """
+        if self._interval <= 0:
+            return
+        self._entries[key] = _Tracked(snapshot, callback)
+        if self._loop is None:
+            self._loop = asyncio.create_task(self._run())
+
+    async def settle(self, key: str):
+        """Перестать следить за задачей и дождаться начатой правки, чтобы она не легла поверх следующего статуса"""
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.sending is not None:
+            await asyncio.wait({entry.sending})
+
+    async def _run(self):
+        try:
+            while self._entries:
+                await asyncio.sleep(self._interval)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Ошибка при обновлении позиций в очереди: {e}", exc_info=True)
+        finally:
+            self._loop = None
+
+    async def flush(self):
+        """Один шаг: править сообщения задач, позиция или оценка которых заметно изменилась"""
+        due = []
+        snapshots: Dict[ProgressSnapshot, Dict[str, Progress]] = {}
+        for key, entry in list(self._entries.items()):
+            if entry.snapshot not in snapshots:
+                snapshots[entry.snapshot] = entry.snapshot()
+            state = snapshots[entry.snapshot].get(key)
+            if state is None:
+                del self._entries[key]
+            elif entry.sending is None and entry.should_send(state):
+                due.append((entry, state))
+        due.sort(key=lambda item: item[0].sent_at)
+        batch = due[:self._batch_size]
+        if len(due) > len(batch):
+            metrics.PROGRESS_UPDATES.labels("deferred").inc(len(due) - len(batch))
+        for entry, state in batch:
+            entry.sent = state
+            entry.sent_at = time.monotonic()
+            entry.sending = asyncio.create_task(self._send(entry, state))
+        if batch:
+            await asyncio.wait({entry.sending for entry, _ in batch})
+
+    @staticmethod
+    async def _send(entry: _Tracked, state: Progress):
+        outcome = "ok"
+        try:
+            await asyncio.wait_for(entry.callback(*state), timeout=SEND_TIMEOUT)
+        except TelegramBadRequest as e:
+            # Текст совпал с текущим — не ошибка; остальное (например, сообщение удалено) выяснится при старте задачи
+            if "message is not modified" not in str(e).lower():
+                outcome = "error"
+                logger.info("Не удалось обновить позицию в очереди: %s", e)
+        except Exception as e:
+            outcome = "error"
+            logger.warning("Не удалось обновить позицию в очереди: %s", e)
+        finally:
+            entry.sending = None
+        metrics.PROGRESS_UPDATES.labels(outcome).inc()
+
+
+_notifier = ProgressNotifier(config.GENERATION_PROGRESS_INTERVAL, config.GENERATION_PROGRESS_BATCH)
+
+
+def get_progress_notifier() -> ProgressNotifier:
+    return _notifier
@@ -47,6 +47,9 @@ class RateLimiter:
 # Глобальный экземпляр RateLimiter с ограничением в 1 одновременный запрос
 _global_limiter = RateLimiter(max_concurrent=1)
 
+# Лимитеры отдельных API-ключей (по хешу ключа): запросы с разными ключами не ждут друг друга
+_key_limiters: Dict[str, RateLimiter] = {}
+
 
 def get_global_limiter() -> RateLimiter:
     """
@@ -54,4 +57,26 @@ def get_global_limiter() -> RateLimiter:
 
     :return: Экземпляр RateLimiter
     """
-    return _global_limiter
\ No newline at end of file
+    return _global_limiter
+
+
+def get_key_limiter(key: str) -> RateLimiter:
+    """
+    Возвращает RateLimiter API-ключа (1 одновременный запрос на ключ).
+
+    :param key: Хеш API-ключа (см. utils.gigachat_clients.credentials_key)
+    :return: Экземпляр RateLimiter
+    """
+    limiter = _key_limiters.get(key)
+    if limiter is None:
+        limiter = _key_limiters[key] = RateLimiter(max_concurrent=1)
+    return limiter
+
+
+def forget_key_limiter(key: str):
+    """
+    Удаляет RateLimiter ключа (вместе с простаивающей очередью ключа).
+
+    :param key: Хеш API-ключа
+    """
+    _key_limiters.pop(key, None)
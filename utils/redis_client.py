@@ -0,0 +1,41 @@
+import logging
+from typing import Optional
+
+from redis.asyncio import Redis
+
+from config import config
+
+
+logger = logging.getLogger(__name__)
+
+FAKE_REDIS_SCHEME = "fakeredis://"
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Optional[Redis]:
+    """
+    Возвращает общий клиент Redis (один на процесс) или None, если REDIS_URL не задан.
+
+    URL вида "fakeredis://" подключает fakeredis — локальную замену Redis для тестов
+    (пакет fakeredis в зависимости бота не входит и устанавливается отдельно).
+    """
+    global _redis
+    if not config.REDIS_URL:
+        return None
+    if _redis is None:
+        if config.REDIS_URL.startswith(FAKE_REDIS_SCHEME):
+            from fakeredis.aioredis import FakeRedis
+            _redis = FakeRedis()
+            logger.info("Используется fakeredis вместо Redis")
+        else:
+            _redis = Redis.from_url(config.REDIS_URL)
+    return _redis
+
+
+async def close_redis():
+    """Закрыть общий клиент Redis"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import logging
+from functools import partial
+from typing import Any, Callable, Coroutine, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # Необязательная зависимость профиля FAST_RUNTIME
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # Необязательная зависимость профиля FAST_RUNTIME (нет под Windows)
+    uvloop = None
+
+
+logger = logging.getLogger(__name__)
+
+JsonDumps = Callable[[Any], str]
+JsonLoads = Callable[[Any], Any]
+
+# Компактная сериализация: без пробелов и без \uXXXX-экранирования кириллицы
+# (для русских текстов это в ~3 раза меньше байт в Redis и в запросах Bot API)
+stdlib_json_dumps: JsonDumps = partial(json.dumps, ensure_ascii=False, separators=(",", ":"))
+stdlib_json_loads: JsonLoads = json.loads
+
+
+def orjson_dumps(obj: Any) -> str:
+    """orjson возвращает bytes, а aiogram, RedisStorage и SQLAlchemy ждут строку"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def json_functions(fast: bool) -> Tuple[JsonDumps, JsonLoads]:
+    """
+    Функции (dumps, loads) для сессии aiogram, хранилища FSM и JSON-колонок БД.
+    При fast=True и установленном orjson — orjson, иначе стандартный json.
+    Результат обоих вариантов одинаковый: компактный JSON с кириллицей без экранирования.
+    """
+    if fast and orjson is not None:
+        return orjson_dumps, orjson.loads
+    return stdlib_json_dumps, stdlib_json_loads
+
+
+def event_loop_factory(fast: bool) -> Optional[Callable[[], asyncio.AbstractEventLoop]]:
+    """Фабрика цикла событий uvloop при fast=True и установленном uvloop, иначе None (цикл asyncio)"""
+    if fast and uvloop is not None:
+        return uvloop.new_event_loop
+    return None
+
+
+def describe_runtime(fast: bool) -> str:
+    """Строка для лога: какие реализации цикла событий и JSON реально используются"""
+    loop = "uvloop" if event_loop_factory(fast) else "asyncio"
+    serializer = "orjson" if fast and orjson is not None else "json"
+    return f"цикл событий {loop}, JSON {serializer}"
+
+
+def run(main: Coroutine, fast: bool) -> Any:
+    """
+    Запуск корутины в новом цикле событий (аналог asyncio.run).
+    Если профиль включён, но uvloop или orjson не установлены, используется стандартная реализация.
+    """
+    if fast and (uvloop is None or orjson is None):
+        missing = ", ".join(name for name, module in (("uvloop", uvloop), ("orjson", orjson)) if module is None)
+        logger.warning("FAST_RUNTIME включён, но не установлены: %s — используется стандартная реализация", missing)
+    logger.info("Среда выполнения: %s", describe_runtime(fast))
+    with asyncio.Runner(loop_factory=event_loop_factory(fast)) as runner:
+        return runner.run(main)
@@ -0,0 +1,115 @@
+import functools
+import inspect
+import logging
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from opentelemetry.trace import Span, SpanKind
+
+from config import config
+
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "nko-content-bot"
+
+# Без настроенного провайдера (TRACING_EXPORTER не задан) API OpenTelemetry создаёт пустые span — накладных расходов почти нет
+tracer = trace.get_tracer("nko_content_bot")
+
+_provider = None
+
+
+def setup_tracing():
+    """
+    Настроить экспорт трассировки по TRACING_EXPORTER: "console" — в stdout, "otlp" — в коллектор
+    (адрес берётся из стандартной переменной OTEL_EXPORTER_OTLP_ENDPOINT).
+    Сохраняется доля TRACING_SAMPLE_RATIO новых трасс.
+    """
+    global _provider
+    if not config.TRACING_EXPORTER or _provider is not None:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if config.TRACING_EXPORTER == "otlp":
+        # Пакет opentelemetry-exporter-otlp-proto-http в зависимости бота не входит и устанавливается отдельно
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter()
+
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": SERVICE_NAME, "service.instance.id": config.INSTANCE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(config.TRACING_SAMPLE_RATIO)),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+
+    # HTTP-запросы GigaChat (в том числе получение токена) — если установлен пакет инструментирования httpx
+    try:
+        from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+        HTTPXClientInstrumentor().instrument()
+    except ImportError:
+        logger.info("opentelemetry-instrumentation-httpx не установлен, HTTP-запросы GigaChat трассируются целиком")
+
+    logger.info(f"Трассировка включена: {config.TRACING_EXPORTER}, доля трасс {config.TRACING_SAMPLE_RATIO}")
+
+
+def shutdown_tracing():
+    """Отправить накопленные span и остановить экспорт"""
+    global _provider
+    if _provider is not None:
+        _provider.shutdown()
+        _provider = None
+
+
+@contextmanager
+def start_span(name: str, kind: SpanKind = SpanKind.INTERNAL, context: Optional[otel_context.Context] = None,
+               **attributes: Any) -> Iterator[Span]:
+    """Span как текущий на время блока; атрибуты со значением None не записываются"""
+    with tracer.start_as_current_span(name, context=context, kind=kind) as span:
+        if span.is_recording():
+            for key, value in attributes.items():
+                if value is not None:
+                    span.set_attribute(key, value)
+        yield span
+
+
+def traced_repository(cls):
+    """Декоратор класса-репозитория: каждый публичный асинхронный метод выполняется в своём span"""
+    for attr_name, method in list(vars(cls).items()):
+        if attr_name.startswith("_") or not inspect.iscoroutinefunction(method):
+            continue
+        setattr(cls, attr_name, _traced_method(f"db.{cls.__name__}.{attr_name}", method))
+    return cls
+
+
+def _traced_method(span_name: str, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        with tracer.start_as_current_span(span_name):
+            return await method(*args, **kwargs)
+    return wrapper
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: span на каждый вызов Bot API"""
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ):
+        with start_span(f"telegram.{type(method).__name__}", kind=SpanKind.CLIENT,
+                        chat_id=getattr(method, "chat_id", None)):
+            return await make_request(bot, method)
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook с ограниченной очередью обновлений.
+
+    Telegram сразу получает ответ 200, а каждое обновление из очереди обрабатывается отдельной
+    задачей, как при поллинге: долгая генерация не задерживает остальные обновления (в том числе /cancel).
+    Сколько обновлений выполняется одновременно, ограничивает ChatOrderingMiddleware (MAX_CONCURRENT_UPDATES).
+    Если принятых, но ещё не обработанных обновлений (в очереди и в работе) набралось queue_size
+    (или бот останавливается), возвращается 503 — Telegram повторит доставку позже,
+    поэтому обновления не теряются, а нагрузка не растёт бесконечно.
+    """
+
+    def __init__(
+            self,
+            dispatcher: Dispatcher,
+            bot: Bot,
+            secret_token: Optional[str] = None,
+            queue_size: int = 1000,
+            drain_timeout: float = 30.0,
+            **data: Any,
+    ):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self._queue: asyncio.Queue[Dict[str, Any]] = asyncio.Queue()
+        self._queue_size = queue_size
+        self._drain_timeout = drain_timeout
+        self._feeder: Optional[asyncio.Task] = None
+        self._updates: Set[asyncio.Task] = set()  # Обновления, которые сейчас обрабатываются
+        self._accepting = True
+
+    @property
+    def accepting(self) -> bool:
+        return self._accepting
+
+    async def start(self):
+        """Запуск раздачи обновлений из очереди"""
+        self._feeder = asyncio.create_task(self._feed())
+
+    async def _feed(self):
+        while True:
+            update = await self._queue.get()
+            task = asyncio.create_task(self._process(update))
+            self._updates.add(task)
+            task.add_done_callback(self._updates.discard)
+
+    async def _process(self, update: Dict[str, Any]):
+        try:
+            await self._background_feed_update(bot=self.bot, update=update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления из webhook: {e}", exc_info=True)
+        finally:
+            self._queue.task_done()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if not self._accepting:
+            return web.Response(status=503, text="Shutting down")
+        # Учитываются и начатые обновления: иначе очередь, которую сразу разбирает _feed, никогда не заполнится
+        if self._queue.qsize() + len(self._updates) >= self._queue_size:
+            logger.warning(f"Очередь обновлений webhook заполнена ({self._queue_size}), отвечаем 503")
+            return web.Response(status=503, text="Too many updates")
+        update = await request.json(loads=bot.session.json_loads)
+        self._queue.put_nowait(update)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        """Перестать принимать обновления и дообработать уже принятые (сессию бота закрывает main)"""
+        self._accepting = False
+        try:
+            # task_done вызывается по завершении обработки, поэтому ждём и очередь, и начатые обновления
+            await asyncio.wait_for(self._queue.join(), timeout=self._drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались обработки {self._queue.qsize() + len(self._updates)} обновлений при остановке")
+        tasks = [task for task in (self._feeder, *self._updates) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._feeder = None
+        self._updates.clear()
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, **data: Any):
+    """
+    Запуск бота в режиме webhook: aiohttp-сервер на WEBAPP_HOST:WEBAPP_PORT
+    и регистрация адреса WEBHOOK_BASE_URL + WEBHOOK_PATH в Telegram.
+    Работает до SIGINT/SIGTERM, после чего дообрабатывает принятые обновления.
+    """
+    handler = QueuedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET,
+        queue_size=config.WEBHOOK_QUEUE_SIZE,
+        drain_timeout=config.WEBHOOK_DRAIN_TIMEOUT,
+        **data,
+    )
+
+    async def healthcheck(request: web.Request) -> web.Response:
+        # Балансировщик перестаёт слать запросы экземпляру, который останавливается
+        return web.Response(text="ok") if handler.accepting else web.Response(status=503, text="stopping")
+
+    app = web.Application()
+    handler.register(app, path=config.WEBHOOK_PATH)
+    app.router.add_get("/health", healthcheck)
+    setup_application(app, dp, bot=bot, **data)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBAPP_HOST, port=config.WEBAPP_PORT)
+    await handler.start()
+    await site.start()
+
+    await bot.set_webhook(
+        url=f"{config.WEBHOOK_BASE_URL.rstrip('/')}{config.WEBHOOK_PATH}",
+        secret_token=config.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=config.DROP_PENDING_UPDATES,
+    )
+    logger.info(f"Webhook-сервер запущен на {config.WEBAPP_HOST}:{config.WEBAPP_PORT}{config.WEBHOOK_PATH}")
+
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка webhook-сервера...")
+        # Webhook в Telegram не удаляем: при нескольких экземплярах обновления примут остальные
+        # cleanup перестаёт принимать соединения и вызывает handler.close (дообработка очереди)
+        await runner.cleanup()